@@ -1,4 +1,16 @@
 from .comms import PulseGenerator
+from .async_comms import AsyncPulseGenerator
+from . import protocol
 from . import transcode
-from .transcode import encode_instruction   #Frequently called by end user, and it is tedious to have to call it with ndpulsegen.transcode.encode_instruction
-from . import console_read
\ No newline at end of file
+from .transcode import encode_instruction, encode_instructions   #Frequently called by end user, and it is tedious to have to call it with ndpulsegen.transcode.encode_instruction
+from . import console_read
+from .instruction_table import InstructionTable
+from .simulate import simulate_run
+from .emulator import PulseGenEmulator
+from .scheduler import ShotScheduler
+from .stream import stream_instructions
+from .compiler import compile_sequence, compress_loops, optimize_instructions
+from .cache import CompileCache
+from .scan import compile_scan
+from .patch import ProgramPatch
+from .sampler import StateSampler
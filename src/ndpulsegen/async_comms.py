@@ -0,0 +1,147 @@
+import asyncio
+from .comms import PulseGenerator
+
+
+class AsyncPulseGenerator(PulseGenerator):
+    '''
+    A PulseGenerator for use with asyncio. Messages decoded by the monitor
+    thread are handed to the event loop in batches (one thread hop per serial
+    read, not per message), and put in asyncio queues, so waiting for a
+    notification or a state reply never blocks a thread.
+
+    All the write methods are inherited unchanged, as writing to the serial
+    port does not block for any significant time. The methods that wait for
+    messages are coroutines.
+
+    Example
+    -------
+    async def main():
+        pg = ndpulsegen.AsyncPulseGenerator()
+        await pg.connect_async()
+        pg.write_action(trigger_now=True)
+        print(await pg.wait_notification(finished=True, timeout=5))
+        async for notification in pg.notifications():
+            print(notification)
+    '''
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.async_queues = None
+
+    def connect(self, serial_number=None):
+        # Must be called from a coroutine or callback running in the event loop. Use connect_async to avoid blocking the loop during device discovery.
+        self.attach_event_loop(asyncio.get_running_loop())
+        super().connect(serial_number=serial_number)
+
+    async def connect_async(self, serial_number=None):
+        loop = asyncio.get_running_loop()
+        self.attach_event_loop(loop)
+        # Device discovery waits up to a second for echo replies, so do it outside of the event loop
+        await loop.run_in_executor(None, super().connect, serial_number)
+
+    def attach_serial(self, ser):
+        # When called directly (rather than by connect), the event loop hasn't been attached yet. It must be called from a coroutine or callback running in the loop.
+        if self.loop is None:
+            self.attach_event_loop(asyncio.get_running_loop())
+        super().attach_serial(ser)
+
+    def attach_event_loop(self, loop):
+        # The asyncio queues must be made for (and only used from) the loop that will consume them.
+        if self.loop is not loop:
+            self.loop = loop
+            self.async_queues = {message_type:asyncio.Queue() for message_type in self.msgin_queues.keys()}
+
+    def disconnect(self):
+        super().disconnect()
+        if self.async_queues is not None:
+            for q in self.async_queues.values():
+                while not q.empty():
+                    q.get_nowait()
+
+    def handle_messages(self, messages):
+        # Called by the monitor thread. The whole batch of messages is passed to the event loop at once. Replies to requests go straight to their
+        # futures, afterwards, so the batch is queued before a coroutine waiting for a reply resumes.
+        queued_messages, replies = self.match_replies(messages)
+        try:
+            self.loop.call_soon_threadsafe(self.put_messages, queued_messages, messages)
+        except RuntimeError as ex:
+            # The event loop has been closed, so there is nobody left to receive the messages.
+            pass
+        self.resolve_replies(replies)
+
+    def put_messages(self, queued_messages, messages):
+        # Runs in the event loop.
+        for message_type, message in queued_messages:
+            q = self.async_queues[message_type]
+            capacity = self.queue_capacity[message_type]
+            if capacity and q.qsize() >= capacity:
+                if self.queue_overflow[message_type] == 'drop_newest':
+                    self.dropped_messages[message_type] += 1
+                    continue
+                # If the capacity has just been lowered, several old messages may have to go.
+                while q.qsize() >= capacity:
+                    q.get_nowait()
+                    self.dropped_messages[message_type] += 1
+            q.put_nowait(message)
+        self.call_subscribers(messages)
+
+    def set_queue_capacity(self, message_type=None, capacity=0, overflow='drop_oldest'):
+        # The event loop can't be blocked, so a full queue always drops a message.
+        if overflow == 'block':
+            err_msg = f'\'overflow\' can\'t be \'block\' for an AsyncPulseGenerator. Use \'drop_oldest\' or \'drop_newest\''
+            raise ValueError(err_msg)
+        super().set_queue_capacity(message_type, capacity, overflow)
+
+    ######################### Coroutines that wait for messages
+    async def read_all_messages(self, timeout=0):
+        if timeout != 0:
+            await asyncio.sleep(timeout)
+        return self.read_all_current_messages()
+
+    def read_all_current_messages(self):
+        messages = []
+        for q in self.async_queues.values():
+            while not q.empty():
+                messages.append(q.get_nowait())
+        return messages
+
+    async def get_state(self, timeout=None):
+        # Any number of coroutines can wait for states at once. Each gets the reply to its own request.
+        timeout = self.request_expiry if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.request_state()), timeout)
+        except (asyncio.TimeoutError, TimeoutError, ConnectionError) as ex:
+            return None
+
+    async def get_powerline_state(self, timeout=None):
+        timeout = self.request_expiry if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.request_powerline_state()), timeout)
+        except (asyncio.TimeoutError, TimeoutError, ConnectionError) as ex:
+            return None
+
+    def return_on_notification(self, finished=None, triggered=None, address=None, timeout=None):
+        # Notifications go in the asyncio queues, which the inherited (blocking) version doesn't read.
+        err_msg = f'AsyncPulseGenerator doesn\'t support return_on_notification. Use \'await pg.wait_notification()\' instead'
+        raise NotImplementedError(err_msg)
+
+    async def wait_notification(self, finished=None, triggered=None, address=None, timeout=None):
+        # The async equivalent of return_on_notification. If no criteria are specified, return on any notification received.
+        return_on_any = True if finished is triggered is address is None else False
+        notification_queue = self.async_queues['notification']
+        async def wait_for_match():
+            while True:
+                notification = await notification_queue.get()
+                # check if notification satisfies any of the criteria set
+                if (notification['address_notify'] and notification['address'] == address) or (notification['trigger_notify'] == triggered) or (notification['finished_notify'] == finished) or return_on_any:
+                    return notification
+        try:
+            return await asyncio.wait_for(wait_for_match(), timeout)
+        except asyncio.TimeoutError as ex:
+            return None
+
+    async def notifications(self):
+        # An asynchronous iterator over notifications as they arrive. Use with "async for notification in pg.notifications():"
+        notification_queue = self.async_queues['notification']
+        while True:
+            yield await notification_queue.get()
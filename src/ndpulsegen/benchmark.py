@@ -0,0 +1,138 @@
+'''
+Offline benchmarks of the host side of ndpulsegen. No Pulse Gen is needed; uploads are written to a fake serial port that discards them.
+
+Run with:
+    python -m ndpulsegen.benchmark                          # print throughput of each benchmark
+    python -m ndpulsegen.benchmark --save baseline.json     # also store the results as a baseline
+    python -m ndpulsegen.benchmark --compare baseline.json  # report (and fail on) regressions against a baseline
+'''
+import argparse
+import json
+import platform
+import sys
+import timeit
+import numpy as np
+from . import transcode
+from .comms import PulseGenerator
+from .simulate import simulate_run
+from .version import package_version
+
+
+def random_instructions(instruction_num=1000, seed=0):
+    '''Encoded instructions similar to tests/run_plotter.py random_sequence: random states, durations and tags, with occasional short loops back to earlier addresses.'''
+    rng = np.random.default_rng(seed)
+    durations = 1 + np.round(rng.f(3, 2, instruction_num)).astype(np.int64)
+    goto_counters = rng.integers(1, 4, size=instruction_num)*(rng.random(instruction_num) < 0.1)
+    goto_counters[0] = 0
+    max_loopback_distance = 5
+    addresses = np.arange(instruction_num)
+    goto_addresses = np.maximum(addresses - rng.integers(1, max_loopback_distance + 1, size=instruction_num), 0)
+    states = rng.integers(0, 2, size=(instruction_num, 24))
+    tags = [rng.random(instruction_num) < 0.5 for tag in range(4)]
+    tags[3][0] = False # powerline_sync is not allowed on address 0
+    return transcode.encode_instructions(addresses, durations, states, goto_addresses, goto_counters, *tags)
+
+def message_stream(message_num=10000, seed=0):
+    '''A buffer of encoded messages, as they would be sent by the Pulse Gen, with message types in realistic proportions.'''
+    rng = np.random.default_rng(seed)
+    messages = {
+        'notification':     bytes([104, 5, 0, 0b001]),
+        'devicestate':      bytes([103]) + bytes(range(1, 18)),
+        'echo':             bytes([101, 209, 1, 2, 0x10, 0x27, 1, 0, 0]),
+        'powerlinestate':   bytes([105, 0b11, 1, 2, 3, 4, 5, 6]),
+        'error':            bytes([100, 0b100, 2]),
+        }
+    message_types = rng.choice(list(messages.keys()), size=message_num, p=[0.9, 0.04, 0.02, 0.02, 0.02])
+    return b''.join(messages[message_type] for message_type in message_types)
+
+class NullSerial():
+    '''Stands in for serial.Serial. Everything written is discarded, so only the host side cost of a write is measured.'''
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+def null_pulse_generator():
+    '''A PulseGenerator connected to a NullSerial rather than a real device. The monitor thread is not started.'''
+    pg = PulseGenerator()
+    pg.ser = NullSerial()
+    return pg
+
+def benchmarks():
+    '''Returns a dictionary of name:(function, items) where calling function() processes "items" items (instructions, messages, etc.).'''
+    full_ram = random_instructions(8192)
+    instruction_list = [full_ram[idx:idx + 19] for idx in range(0, len(full_ram), 19)]
+    decoded = transcode.decode_instructions(full_ram)
+    stream = message_stream()
+    simulated_program = random_instructions(8192, seed=1)
+    pg = null_pulse_generator()
+    def upload():
+        pg.write_instructions(instruction_list)
+    def encode_instruction_loop():
+        for address in range(1000):
+            transcode.encode_instruction(address, 1234, [1, 0, 1, 1, 0, 1], goto_address=0, goto_counter=0, notify_computer=True)
+    return {
+        'encode_instruction':           (encode_instruction_loop, 1000),
+        'encode_instructions':          (lambda: transcode.encode_instructions(decoded['address'], decoded['duration'], decoded['state'], decoded['goto_address'], decoded['goto_counter'], decoded['stop_and_wait'], decoded['hardware_trig_out'], decoded['notify_computer'], decoded['powerline_sync']), 8192),
+        'state_multiformat_to_int':     (lambda: transcode.state_multiformat_to_int([1, 0, 1, 1, 0, 1, 1, 1, 0, 0, 0, 1, 1, 0, 1, 1, 0, 1, 1, 1, 0, 0, 0, 1]), 1),
+        'decode_notification':          (lambda: transcode.decode_notification(bytes([5, 0, 0b001])), 1),
+        'decode_devicestate':           (lambda: transcode.decode_devicestate(bytes(range(1, 18))), 1),
+        'decode_powerlinestate':        (lambda: transcode.decode_powerlinestate(bytes([0b11, 1, 2, 3, 4, 5, 6])), 1),
+        'decode_echo':                  (lambda: transcode.decode_echo(bytes([209, 1, 2, 0x10, 0x27, 1, 0, 0])), 1),
+        'decode_internal_error':        (lambda: transcode.decode_internal_error(bytes([0b100, 2])), 1),
+        'decode_easyprint':             (lambda: transcode.decode_easyprint(bytes(range(8))), 1),
+        'decode_instructions':          (lambda: transcode.decode_instructions(full_ram), 8192),
+        'decode_messages':              (lambda: transcode.decode_messages(stream), 10000),
+        'write_instructions':           (upload, 8192),
+        'simulate_run':                 (lambda: simulate_run(simulated_program), 8192),
+        }
+
+def run_benchmarks(names=None, repeat=5):
+    results = {}
+    for name, (function, items) in benchmarks().items():
+        if names and name not in names:
+            continue
+        timer = timeit.Timer(function)
+        number, total_time = timer.autorange()
+        seconds_per_call = min(timer.repeat(repeat=repeat, number=number))/number
+        results[name] = {'seconds_per_item':seconds_per_call/items, 'items_per_second':items/seconds_per_call}
+        print(f'{name:<30} {results[name]["items_per_second"]:>14,.0f} items/s {results[name]["seconds_per_item"]*1E6:>12.3f} μs/item')
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    '''Prints the speed of each result relative to the baseline. Returns the names of benchmarks that are more than "tolerance" slower.'''
+    regressions = []
+    print(f'\nCompared with baseline from ndpulsegen {baseline.get("package_version")}:')
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        slowdown = result['seconds_per_item']/baseline['results'][name]['seconds_per_item']
+        regressed = slowdown > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<30} {slowdown:>8.2f}x time {"REGRESSION" if regressed else ""}')
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the ndpulsegen host software.')
+    parser.add_argument('names', nargs='*', help='Only run these benchmarks.')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as a JSON baseline.')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with a JSON baseline, and exit with status 1 on any regression.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Fractional slowdown allowed before a benchmark counts as a regression.')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'package_version':package_version(), 'python':platform.python_version(), 'numpy':np.__version__, 'results':results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
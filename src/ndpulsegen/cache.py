@@ -0,0 +1,226 @@
+'''
+A cache of compiled instructions on disk, so a program that has been compiled
+before (by this or any other process) is never compiled again.
+
+Example
+-------
+cache = ndpulsegen.CompileCache()
+for point in scan:
+    instructions = cache.compile(ndpulsegen.compile_sequence, pulses=make_pulses(point))
+    pg.write_instructions(instructions)
+'''
+import hashlib
+import mmap
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+from .instruction_table import InstructionTable
+from .version import package_version
+
+# Changes whenever the way results are hashed or stored changes, so old cache entries are never misread.
+format_version = 1
+
+
+class CompileCache():
+    '''
+    Stores the encoded instructions returned by a compiler function, under a
+    SHA-256 hash of the function's name and bytecode, its arguments, the
+    ndpulsegen version, `version` and the cache format_version, so editing the
+    function makes the cache miss. Results are returned as InstructionTables
+    that are memory mapped views of the cache files, so a cache hit reads only
+    the parts of the file that are used.
+
+    Several processes can share one cache directory. Each entry is written to a
+    temporary file and then renamed into place, so other processes only ever
+    see complete entries. When the cache is larger than `max_bytes`, the least
+    recently used entries are deleted. A hit marks an entry as used by updating
+    its modification time.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where to keep the cache. Defaults to an "ndpulsegen" directory in the
+        user's cache directory.
+    max_bytes : int, optional
+        The largest total size of the cached entries.
+    version : str, optional
+        Anything else the compiled instructions depend on. Only the bytecode of
+        the compiler function itself is hashed, so change `version` when
+        something it calls (another function, a file it reads) changes.
+    '''
+    def __init__(self, directory=None, max_bytes=2**30, version=''):
+        if directory is None:
+            directory = default_directory()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'CompileCache({self.directory!r}, {self.hits} hits, {self.misses} misses)'
+
+    def compile(self, function, *args, **kwargs):
+        '''
+        Returns function(*args, **kwargs) from the cache, or calls it and
+        caches the result if it isn't there. The function must return encoded
+        instructions (an InstructionTable or bytes-like object), and must
+        always return the same instructions for the same arguments. Arguments
+        can be numbers, strings, bytes, NumPy arrays, InstructionTables, or
+        lists, tuples and dicts of those.
+        '''
+        key = self.key(function, *args, **kwargs)
+        instructions = self.get(key)
+        if instructions is not None:
+            self.hits += 1
+            return instructions
+        self.misses += 1
+        return self.put(key, function(*args, **kwargs))
+
+    def key(self, function, *args, **kwargs):
+        '''The hash (as a hex string) that function(*args, **kwargs) is cached under.'''
+        hasher = hashlib.sha256()
+        _hash_value(hasher, (format_version, package_version(), self.version, f'{function.__module__}.{function.__qualname__}', args, kwargs))
+        code = getattr(function, '__code__', None)
+        if code is not None:
+            _hash_code(hasher, code)
+        return hasher.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.bin')
+
+    def get(self, key):
+        '''Returns the cached instructions as a read only InstructionTable, or None if there are none.'''
+        try:
+            with open(self.path(key), 'rb') as f:
+                # Another process may evict the entry at any time, but the memory map stays valid (except on Windows, where eviction fails instead)
+                os.utime(f.fileno() if os.utime in os.supports_fd else self.path(key))
+                if os.fstat(f.fileno()).st_size == 0:
+                    return InstructionTable.from_bytes(b'')
+                return InstructionTable.from_bytes(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError as ex:
+            return None
+
+    def put(self, key, instructions):
+        '''Caches the encoded instructions, evicts old entries if the cache is too big, and returns the cached instructions.'''
+        if isinstance(instructions, InstructionTable):
+            instructions = instructions.buffer
+        elif isinstance(instructions, (list, tuple)):
+            instructions = b''.join(instructions)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                f.write(instructions)
+            os.replace(temporary_path, self.path(key))
+        except BaseException as ex:
+            os.remove(temporary_path)
+            raise
+        self.evict()
+        cached = self.get(key)
+        if cached is None:
+            # The cache is too small to hold this entry, or another process evicted it already
+            cached = InstructionTable.from_bytes(bytes(instructions))
+        return cached
+
+    def evict(self):
+        '''Deletes the least recently used entries until the cache is no bigger than max_bytes.'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.bin'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError as ex:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total_bytes = sum(size for modified, size, path in entries)
+        for modified, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError as ex:
+                pass
+            except PermissionError as ex:
+                # On Windows, an entry can't be deleted while it is memory mapped
+                continue
+            total_bytes -= size
+
+    def clear(self):
+        '''Deletes every entry.'''
+        max_bytes = self.max_bytes
+        self.max_bytes = -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+    @property
+    def size(self):
+        '''The total size of the cached entries, in bytes.'''
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.bin'))
+
+
+def default_directory():
+    if sys.platform == 'win32':
+        base_directory = os.environ.get('LOCALAPPDATA', tempfile.gettempdir())
+    elif sys.platform == 'darwin':
+        base_directory = os.path.expanduser('~/Library/Caches')
+    else:
+        base_directory = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base_directory, 'ndpulsegen')
+
+def _hash_value(hasher, value):
+    # Feeds an unambiguous encoding of "value" to the hasher. Each type is tagged, and each container is prefixed with its length.
+    if value is None or isinstance(value, (bool, int, float, complex, str)):
+        hasher.update(f'{type(value).__name__}:{value!r};'.encode())
+    elif isinstance(value, np.generic):
+        _hash_value(hasher, value.item())
+    elif isinstance(value, InstructionTable):
+        hasher.update(b'InstructionTable:')
+        _hash_value(hasher, value.buffer)
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            _hash_value(hasher, value.tolist())
+        else:
+            hasher.update(f'ndarray:{value.dtype.str}:{value.shape};'.encode())
+            hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = memoryview(value).cast('B')
+        hasher.update(f'bytes:{value.nbytes};'.encode())
+        hasher.update(value)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f'{type(value).__name__}:{len(value)};'.encode())
+        for item in value:
+            _hash_value(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(f'dict:{len(value)};'.encode())
+        # Keys are ordered by their encoding, so dicts that compare equal hash the same
+        for key_hash, item in sorted(((_value_hash(key), item) for key, item in value.items()), key=lambda pair: pair[0]):
+            hasher.update(key_hash)
+            _hash_value(hasher, item)
+    else:
+        err_msg = f'Values of type {type(value).__name__} can\'t be used as arguments of a cached compiler'
+        raise TypeError(err_msg)
+
+def _hash_code(hasher, code):
+    # The bytecode, names and constants of a function, including the functions defined inside it.
+    hasher.update(f'code:{len(code.co_code)};'.encode())
+    hasher.update(code.co_code)
+    hasher.update(f'{code.co_names!r};'.encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(hasher, const)
+        elif isinstance(const, frozenset):
+            # The order of a set depends on the string hash seed of the process, so it is sorted
+            hasher.update(f'frozenset:{sorted(map(repr, const))!r};'.encode())
+        else:
+            hasher.update(f'{type(const).__name__}:{const!r};'.encode())
+
+def _value_hash(value):
+    hasher = hashlib.sha256()
+    _hash_value(hasher, value)
+    return hasher.digest()
@@ -1,11 +1,16 @@
 import numpy as np
+import os
 import time
 import serial
 import serial.tools.list_ports
 import struct
 import threading
+import concurrent.futures
+import collections
+import traceback
 import queue
 from . import transcode
+from .instruction_table import InstructionTable
 
 class PulseGenerator():
     def __init__(self):
@@ -18,14 +23,43 @@ class PulseGenerator():
         # For every message type that can recieved by the monitor thread, make a queue that the main thread will interact with
         self.msgin_queues = {decodeinfo['message_type']:queue.Queue() for decodeinfo in transcode.msgin_decodeinfo.values()}
         self.msgin_queues['bytes_dropped'] = queue.Queue()
+        # The most messages each queue holds (0 for no limit), what happens to a message that arrives when its queue is full, and the number
+        # of messages of each type that have been dropped because their queue was full. See set_queue_capacity.
+        self.queue_capacity = {message_type:0 for message_type in self.msgin_queues.keys()}
+        self.queue_overflow = {message_type:'drop_oldest' for message_type in self.msgin_queues.keys()}
+        self.dropped_messages = {message_type:0 for message_type in self.msgin_queues.keys()}
 
         # If the main thread needs to close the read thread, it will set this event.
         self.close_readthread_event = threading.Event()
 
+        # Notified by the monitor thread every time new messages are put in the queues, so other threads can wait for messages without polling.
+        self.message_condition = threading.Condition()
+        # Functions that are called (by the monitor thread) with every message of a given type. See subscribe.
+        self.subscribers = {message_type:[] for message_type in self.msgin_queues.keys()}
+
+        # Requests for a reply from the device, oldest first, as (time sent, future) tuples. The device replies in the order it was asked, so each
+        # reply belongs to the oldest request of its type. The future is None for requests made with write_action, whose replies go in the queues.
+        self.pending_requests = {'devicestate':collections.deque(), 'powerlinestate':collections.deque()}
+        self.request_lock = threading.Lock()
+        # A request that hasn't been replied to after this many seconds is assumed lost, so it can't take the reply to a later request.
+        self.request_expiry = 1.0
+        # Message types that are decoded only if they aren't a reply to a request that takes undecoded messages (see match_raw_replies), and
+        # the number of users (such as StateSamplers) of each. See add_raw_message_type.
+        self.raw_message_types = frozenset()
+        self.raw_message_users = collections.Counter()
+
+        # A copy of the encoded instruction last written to each RAM address, so write_program can send only the instructions that changed.
+        self.ram_shadow = np.zeros((8192, 19), dtype=np.uint8)
+        self.ram_shadow_valid = np.zeros(8192, dtype=np.bool_)
+
         self.device_type = 1 # The designator of the pulse generator
+        # Whether get_connected_devices also lists virtual devices (see ndpulsegen.virtual_device). Off unless the NDPULSEGEN_VIRTUAL_DEVICES
+        # environment variable is set to 1, as any program on the computer can register a virtual device.
+        self.find_virtual_devices = os.environ.get('NDPULSEGEN_VIRTUAL_DEVICES', '0') == '1'
 
         # encoding instructions is done all the time by the user. Make it also a method so peoples code can be more self contained. 
         self.encode_instruction = transcode.encode_instruction
+        self.encode_instructions = transcode.encode_instructions
 
     def connect(self, serial_number=None):
         # Get a list of all available Narwhal Devices devices. Devices won't appear if they are connected to another program
@@ -40,10 +74,7 @@ class PulseGenerator():
             self.serial_number_save = device['serial_number'] # This is incase the the program needs to automatically reconnect. Porbably superfluous at the moment.
             self.ser.port = device['comport']
             self.ser.open()                 
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
-            self.serial_read_thread = threading.Thread(target=self.monitor_serial, daemon=True)
-            self.serial_read_thread.start()
+            self.attach_serial(self.ser)
         else:
             if serial_number == None:
                 ex = 'No Narwhal Devices Pulse Generator found. It might be unconnected, or another program might be connected to it.'
@@ -52,81 +83,265 @@ class PulseGenerator():
                 ex = f'No Narwhal Devices Pulse Generator found with serial number: {serial_number}.  It might be unconnected, or another program might be connected to it.'
                 raise Exception(ex)
 
+    def attach_serial(self, ser):
+        '''Starts communicating through "ser", an open serial.Serial or an object that behaves like one (such as 
+        ndpulsegen.emulator.EmulatedSerial). Unlike connect, no device discovery is done.'''
+        self.ser = ser
+        self.ser.reset_input_buffer()
+        self.ser.reset_output_buffer()
+        # Nothing is known about what is in the RAM of the newly connected device
+        self.ram_shadow_valid[:] = False
+        self.serial_read_thread = threading.Thread(target=self.monitor_serial, daemon=True)
+        self.serial_read_thread.start()
+
     def get_connected_devices(self):
         # This attmpts to connect to all serial devices with valid parameters, and if it is a valid Narwhal Device, it adds them to a list and disconnects
         valid_ports = []
         comports = list(serial.tools.list_ports.comports())
+        if self.find_virtual_devices:
+            # Virtual devices are listed alongside the real serial ports. Imported here so "python -m ndpulsegen.virtual_device" doesn't import it twice.
+            from .virtual_device import list_virtual_ports
+            comports += list_virtual_ports()
         for comport in comports:
             if 'vid' in vars(comport) and 'pid' in vars(comport):
                 if vars(comport)['vid'] == 1027 and vars(comport)['pid'] == 24592:
                     valid_ports.append(comport)
-        # For every valid port, ask for an echo (which also sends serial number etc.) and store the info
+        # For every valid port, ask for an echo (which also sends serial number etc.) and store the info.
+        # All ports are probed at the same time, so this takes about one echo round trip no matter how many devices are connected.
         validated_devices = []
         unvalidated_devices = []
-        for comport in valid_ports:
-            self.ser.port = comport.device
-            try:
-                self.ser.open()
-                # print(f'open comport {comport.device}')
-            except Exception as ex: # Poor practice? Catch only the exception that happens when you can open a port...?
-                unvalidated_devices.append(comport.device)
-                # print(ex)
-                continue
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
-            self.serial_read_thread = threading.Thread(target=self.monitor_serial, daemon=True)
-            self.serial_read_thread.start()
-            # Ask the device to echo a byte, as the reply also contains device information sucha s version and serial number
-            check_byte = 209
-            check_byte = check_byte.to_bytes(1, 'little')
-            self.write_command(transcode.encode_echo(check_byte))
-            try:
-                device_info = self.msgin_queues['echo'].get(block=True, timeout=1)
-                if device_info['echoed_byte'] == check_byte:  #This is just to double check that the message is valid (the first check is the valid identifier and suffient lenght)
-                    del(device_info['echoed_byte'])
+        if valid_ports:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(valid_ports)) as executor:
+                device_infos = list(executor.map(self.probe_port, [comport.device for comport in valid_ports]))
+            for comport, device_info in zip(valid_ports, device_infos):
+                if device_info is None:
+                    unvalidated_devices.append(comport.device)
+                else:
                     device_info['comport'] = comport.device
                     validated_devices.append(device_info)
-                else:
-                    unvalidated_devices.append(comport.device)
-            except queue.Empty as ex:
-                unvalidated_devices.append(comport.device)
-                pass
-            self.disconnect()
         return {'validated_devices':validated_devices, 'unvalidated_devices':unvalidated_devices}
 
+    def probe_port(self, port, timeout=1):
+        # Opens the port with its own short lived serial object, asks for an echo, and returns the device info if a valid echo comes back before the timeout. Otherwise returns None.
+        ser = serial.Serial()
+        ser.port = port
+        ser.baudrate = self.ser.baudrate
+        ser.writeTimeout = self.ser.writeTimeout
+        try:
+            ser.open()
+        except serial.serialutil.SerialException as ex: # The port doesn't exist, or another program is connected to it.
+            return None
+        try:
+            ser.reset_input_buffer()
+            ser.reset_output_buffer()
+            # Ask the device to echo a byte, as the reply also contains device information sucha s version and serial number
+            check_byte = 209
+            check_byte = check_byte.to_bytes(1, 'little')
+            ser.write(transcode.encode_echo(check_byte))
+            buffer = bytearray()
+            t0 = time.time()
+            while time.time() - t0 < timeout:
+                ser.timeout = max(timeout - (time.time() - t0), 0.0)
+                buffer += ser.read(max(1, ser.in_waiting))
+                messages, bytes_decoded = transcode.decode_messages(bytes(buffer))
+                del buffer[:bytes_decoded]
+                for message_type, message in messages:
+                    if message_type == 'echo' and message['echoed_byte'] == check_byte:  #This is just to double check that the message is valid (the first check is the valid identifier and suffient lenght)
+                        del(message['echoed_byte'])
+                        return message
+        except serial.serialutil.SerialException as ex:
+            pass
+        finally:
+            ser.close()
+        return None
+
     def monitor_serial(self):
+        # Bytes that have been read, but not yet decoded. This is reused so the buffer isn't reallocated on every read.
+        buffer = bytearray()
         while not self.close_readthread_event.is_set():
-            # Try reading one byte. The first byte is always the message identifier
+            # Block until at least one byte arrives (or the read times out), and take everything else that has already arrived in the same read.
             try:
-                byte_message_identifier = self.ser.read(1)
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
             except serial.serialutil.SerialException as ex:
                 self.close_readthread_event.set()
                 break
-            # Normally the read will timeout and return empty, but if it returns someting try to read the reminder of the message
-            if byte_message_identifier:
-                timestamp = time.time()
-                message_identifier, = struct.unpack('B', byte_message_identifier)
-                # Only read more bytes if the identifier is valid
-                if message_identifier not in transcode.msgin_decodeinfo.keys():
-                    self.msgin_queues['bytes_dropped'].put({'message_identifier':message_identifier, 'message':None, 'timestamp':timestamp})
-                else:
-                    decodeinfo = transcode.msgin_decodeinfo[message_identifier]
-                    message_length = decodeinfo['message_length'] - 1
-                    try:
-                        byte_message = self.ser.read(message_length)
-                    except serial.serialutil.SerialException as ex:
-                        self.close_readthread_event.set()
-                        break   
-                    # A random byte still a chance of being valid, so the read could timeout without reading a whole message worth of bytes
-                    if len(byte_message) != message_length:
-                        self.msgin_queues['bytes_dropped'].put({'message_identifier':message_identifier, 'message':None, 'timestamp':timestamp})
-                    else:
-                        # At this point, just decode the message and put it in the queue corresponding to its type.
-                        decode_function = decodeinfo['decode_function']
-                        message = decode_function(byte_message)
+            timestamp = time.time()
+            # Requests whose replies were lost are expired here, as no later reply of their type may ever arrive to expire them.
+            for message_type in self.pending_requests:
+                self.expire_requests(message_type, timestamp)
+            if chunk:
+                buffer += chunk
+            elif buffer:
+                # A random byte still a chance of being a valid identifier, so the read could timeout without a whole message being received.
+                # Drop the identifier, and try to decode the bytes following it.
+                message = transcode.BytesDroppedMessage(buffer[0])
+                message.timestamp = timestamp
+                self.handle_messages([('bytes_dropped', message)])
+                del buffer[0]
+            if buffer:
+                # Decode every complete message in the buffer. Partial messages are kept for the next read.
+                raw_message_types = self.raw_message_types
+                messages, bytes_decoded = transcode.decode_messages(bytes(buffer), raw_message_types)
+                del buffer[:bytes_decoded]
+                if raw_message_types:
+                    messages = self.match_raw_replies(messages, raw_message_types, timestamp)
+                if messages:
+                    for message_type, message in messages:
                         message['timestamp'] = timestamp
-                        queue_name = decodeinfo['message_type']
-                        self.msgin_queues[queue_name].put(message)
+                    self.handle_messages(messages)
+
+    def handle_messages(self, messages):
+        # Called by the monitor thread with a list of (message_type, message) tuples. Put every message that isn't a reply to a request in the
+        # queue corresponding to its type, then give the replies to their futures (so whoever gets a reply finds the messages that arrived 
+        # before it already queued), then wake up anything waiting for messages.
+        queued_messages, replies = self.match_replies(messages)
+        # The condition isn't held while putting, as a put can block until a consumer (which may be waiting on the condition) makes space.
+        for message_type, message in queued_messages:
+            self.put_message(message_type, message)
+        self.resolve_replies(replies)
+        with self.message_condition:
+            self.message_condition.notify_all()
+        self.call_subscribers(messages)
+
+    def put_message(self, message_type, message):
+        q = self.msgin_queues[message_type]
+        if self.queue_overflow[message_type] == 'block' or self.queue_capacity[message_type] == 0:
+            # Reading the serial port stops until there is space (so the device's output buffer fills up instead), unless disconnecting.
+            while True:
+                try:
+                    q.put(message, timeout=0.1)
+                    return
+                except queue.Full as ex:
+                    if self.close_readthread_event.is_set():
+                        self.dropped_messages[message_type] += 1
+                        return
+        try:
+            q.put_nowait(message)
+        except queue.Full as ex:
+            if self.queue_overflow[message_type] == 'drop_newest':
+                self.dropped_messages[message_type] += 1
+                return
+            # If the capacity has just been lowered, several old messages may have to go. Only this thread puts messages in the queues, so
+            # once there is space the put can't fail.
+            while q.qsize() >= q.maxsize > 0:
+                try:
+                    q.get_nowait()
+                    self.dropped_messages[message_type] += 1
+                except queue.Empty as ex:
+                    break
+            q.put_nowait(message)
+
+    def set_queue_capacity(self, message_type=None, capacity=0, overflow='drop_oldest'):
+        '''Limits the number of messages of type "message_type" (or of every type if None) that are kept in the message queues, so memory
+        use stays flat if nobody reads them. capacity=0 means no limit. When a message arrives and its queue is full, "overflow" decides what
+        happens: 'drop_oldest' removes the oldest message to make space, 'drop_newest' discards the new message, and 'block' stops reading
+        the serial port until there is space. The number of messages of each type that have been dropped is in dropped_messages.'''
+        message_types = list(self.msgin_queues.keys()) if message_type is None else [message_type]
+        for message_type in message_types:
+            if message_type not in self.msgin_queues:
+                err_msg = f'\'message_type\' must be one of {list(self.msgin_queues.keys())}, not {message_type}'
+                raise ValueError(err_msg)
+        if overflow not in ('drop_oldest', 'drop_newest', 'block'):
+            err_msg = f'\'overflow\' must be one of [\'drop_oldest\', \'drop_newest\', \'block\'], not {overflow}'
+            raise ValueError(err_msg)
+        if not (isinstance(capacity, (int, np.integer)) and capacity >= 0):
+            err_msg = f'\'capacity\' must be a non-negative int, not {capacity}'
+            raise ValueError(err_msg)
+        for message_type in message_types:
+            self.queue_capacity[message_type] = capacity
+            self.queue_overflow[message_type] = overflow
+            q = self.msgin_queues[message_type]
+            with q.mutex:
+                q.maxsize = capacity
+                # A larger capacity may free a put that is blocked.
+                q.not_full.notify_all()
+
+    def match_replies(self, messages):
+        # Matches each reply to the oldest pending request of its type. Returns the messages that weren't taken by a future, and the 
+        # (future, reply) pairs to pass to resolve_replies.
+        queued_messages = []
+        replies = []
+        for message_type, message in messages:
+            pending = self.pending_requests.get(message_type)
+            if pending:
+                self.expire_requests(message_type, message['timestamp'])
+            if pending:
+                sent_time, future = pending.popleft()
+                if future is not None:
+                    replies.append((future, message))
+                    continue
+            queued_messages.append((message_type, message))
+        return queued_messages, replies
+
+    def resolve_replies(self, replies):
+        for future, message in replies:
+            future.set_result(message)
+
+    def match_raw_replies(self, messages, raw_message_types, timestamp):
+        # Undecoded replies are given to the oldest pending request if it takes them (with a set_raw_result(message, timestamp) method, like 
+        # StateSampler). The rest are decoded as usual. Replies taken here never reach the queues or subscribers.
+        decoded_messages = []
+        # The number of the oldest requests that will be matched to replies decoded earlier in this batch, by match_replies.
+        reserved = {message_type:0 for message_type in raw_message_types}
+        for message_type, message in messages:
+            if message_type in raw_message_types:
+                pending = self.pending_requests[message_type]
+                if reserved[message_type] == 0:
+                    self.expire_requests(message_type, timestamp)
+                if len(pending) > reserved[message_type] and hasattr(pending[reserved[message_type]][1], 'set_raw_result'):
+                    sent_time, requester = pending[reserved[message_type]]
+                    del pending[reserved[message_type]]
+                    requester.set_raw_result(message, timestamp)
+                    continue
+                if len(pending) > reserved[message_type]:
+                    reserved[message_type] += 1
+                message = transcode.msgin_decodeinfo[transcode.msgin_identifier[message_type]]['decode_function'](message)
+            decoded_messages.append((message_type, message))
+        return decoded_messages
+
+    def add_raw_message_type(self, message_type):
+        '''Makes the monitor thread give undecoded messages of type "message_type" to the requests that take them (see match_raw_replies).
+        Each call must be matched by a call to remove_raw_message_type, and the type stays raw until every user has removed it.'''
+        with self.request_lock:
+            self.raw_message_users[message_type] += 1
+            self.raw_message_types = frozenset(self.raw_message_users)
+
+    def remove_raw_message_type(self, message_type):
+        with self.request_lock:
+            if self.raw_message_users[message_type] > 0:
+                self.raw_message_users[message_type] -= 1
+            if self.raw_message_users[message_type] == 0:
+                del self.raw_message_users[message_type]
+            self.raw_message_types = frozenset(self.raw_message_users)
+
+    def expire_requests(self, message_type, timestamp):
+        # Requests that are too old to be the one this reply answers are assumed lost.
+        pending = self.pending_requests[message_type]
+        while pending and timestamp - pending[0][0] > self.request_expiry:
+            sent_time, future = pending.popleft()
+            if future is not None:
+                future.set_exception(TimeoutError(f'No {message_type} reply was received within {self.request_expiry} s'))
+
+    def call_subscribers(self, messages):
+        for message_type, message in messages:
+            for callback in self.subscribers[message_type]:
+                try:
+                    callback(message)
+                except Exception as ex:
+                    # A broken callback must not stop the monitor thread from reading the serial port.
+                    traceback.print_exc()
+
+    def subscribe(self, message_type, callback):
+        '''Registers a function that will be called with every message of type "message_type" ('notification', 'devicestate', 'error', 
+        'print', 'echo', 'powerlinestate' or 'bytes_dropped') as soon as it is received. The callback runs in the thread that reads the serial
+        port, so it should return quickly. Messages are still put in the message queues as usual.'''
+        if message_type not in self.subscribers:
+            err_msg = f'\'message_type\' must be one of {list(self.subscribers.keys())}, not {message_type}'
+            raise ValueError(err_msg)
+        self.subscribers[message_type] = self.subscribers[message_type] + [callback]
+
+    def unsubscribe(self, message_type, callback):
+        self.subscribers[message_type] = [subscriber for subscriber in self.subscribers[message_type] if subscriber != callback]
 
     def disconnect(self):
         self.close_readthread_event.set()
@@ -134,6 +349,11 @@ class PulseGenerator():
         self.close_readthread_event.clear()
         for q in self.msgin_queues.values():
             q.queue.clear()
+        for message_type, pending in self.pending_requests.items():
+            while pending:
+                sent_time, future = pending.popleft()
+                if future is not None:
+                    future.set_exception(ConnectionError(f'Disconnected before the {message_type} reply was received'))
         self.ser.close()
 
     def write_command(self, encoded_command):
@@ -171,7 +391,42 @@ class PulseGenerator():
     def write_action(self, trigger_now=False, disable_after_current_run=False, reset_run=False, request_state=False, request_powerline_state=False):
         '''For more documentation, see ndpulsegen.transcode.encode_action '''
         command = transcode.encode_action(trigger_now, disable_after_current_run, reset_run, request_state, request_powerline_state)
-        self.write_command(command)
+        replies = [('devicestate', None)]*bool(request_state) + [('powerlinestate', None)]*bool(request_powerline_state)
+        self.write_request(command, replies)
+        if reset_run:
+            # reset_run leaves the volitile goto_counters in an unknown state, so every instruction must be uploaded again.
+            self.ram_shadow_valid[:] = False
+
+    def write_request(self, command, replies):
+        # Writes a command, first registering the replies it asks for (a list of (message_type, future) tuples) so they can be matched to it.
+        with self.request_lock:
+            sent_time = time.time()
+            for message_type, future in replies:
+                self.pending_requests[message_type].append((sent_time, future))
+            try:
+                self.write_command(command)
+            except BaseException as ex:
+                # Nothing was asked for, so nothing will reply. Newer requests can't have been added while the lock is held.
+                for message_type, future in replies:
+                    self.pending_requests[message_type].pop()
+                raise
+
+    def request_state(self):
+        '''Asks the Pulse Gen for its state, and returns a concurrent.futures.Future that will hold the decoded devicestate message (see 
+        ndpulsegen.transcode.decode_devicestate). Any number of requests can be outstanding at once, from any thread, and each gets its own 
+        reply. The future raises TimeoutError if no reply arrives within request_expiry seconds.'''
+        return self.request_reply('devicestate', transcode.encode_action(request_state=True))
+
+    def request_powerline_state(self):
+        '''The same as request_state, for the powerlinestate message.'''
+        return self.request_reply('powerlinestate', transcode.encode_action(request_powerline_state=True))
+
+    def request_reply(self, message_type, command):
+        future = concurrent.futures.Future()
+        # The reply is given to the future even if whoever is waiting for it gives up, so it must not be cancelled.
+        future.set_running_or_notify_cancel()
+        self.write_request(command, [(message_type, future)])
+        return future
 
     def write_general_debug(self, message):
         '''For more documentation, see ndpulsegen.transcode.encode_general_debug '''
@@ -189,21 +444,71 @@ class PulseGenerator():
         These instructions must be generated using the transcode.encode_instruction function. 
         This function accecpts encoded instructions in the following formats (where each individual instruction is always
         in bytes/bytearray): A single encoded instruction, multiple encoded instructions joined together in a single bytes/bytearray, 
-        or a list, tuple, or array of single or multiple encoded instructions.'''
-        if isinstance(instructions, (list, tuple, np.ndarray)):
-            self.write_command(b''.join(instructions)) 
+        or a list, tuple, or array of single or multiple encoded instructions, or an InstructionTable.'''
+        encoded_instructions = self.join_instructions(instructions)
+        self.write_command(encoded_instructions)
+        self.update_ram_shadow(encoded_instructions)
+
+    def write_program(self, instructions, delta=True):
+        '''Writes instructions to the Pulse Gen in the same formats accepted by write_instructions. If delta=True, only the 
+        instructions that differ from what was last written to their RAM address (since connecting, or since the last reset_run)
+        are sent, in a single write. Instructions written with write_command directly are not tracked.
+        Returns the number of instructions that were sent.'''
+        encoded_instructions = self.join_instructions(instructions)
+        if delta:
+            records = self.instruction_records(encoded_instructions)
+            if records is not None:
+                addresses = records[:, 1].astype(np.intp) | (records[:, 2].astype(np.intp) << 8)
+                changed = ~self.ram_shadow_valid[addresses] | np.any(self.ram_shadow[addresses] != records, axis=1)
+                encoded_instructions = records[changed].tobytes()
+        if encoded_instructions:
+            self.write_command(encoded_instructions)
+            self.update_ram_shadow(encoded_instructions)
+        return len(encoded_instructions) // 19
+
+    def join_instructions(self, instructions):
+        if isinstance(instructions, InstructionTable):
+            return instructions.to_bytes()
+        elif isinstance(instructions, (list, tuple, np.ndarray)):
+            return b''.join(instructions)
         else:
-            self.write_command(instructions) 
+            return instructions
+
+    def instruction_records(self, encoded_instructions):
+        # Views the encoded instructions as a (N, 19) array of bytes. Returns None if they are not all valid encoded instructions.
+        records = np.frombuffer(encoded_instructions, dtype=np.uint8)
+        if records.size % 19 != 0:
+            return None
+        records = records.reshape(-1, 19)
+        if np.any(records[:, 0] != transcode.msgout_identifier['load_ram']):
+            return None
+        return records
+
+    def update_ram_shadow(self, encoded_instructions):
+        records = self.instruction_records(encoded_instructions)
+        if records is None:
+            # Can't tell what was written where, so don't trust the shadow any more.
+            self.ram_shadow_valid[:] = False
+            return
+        addresses = records[:, 1].astype(np.intp) | (records[:, 2].astype(np.intp) << 8)
+        # Addresses above 8191 are not part of the RAM, and are rejected by encode_instruction anyway.
+        in_ram = addresses < self.ram_shadow.shape[0]
+        self.ram_shadow[addresses[in_ram]] = records[in_ram]
+        self.ram_shadow_valid[addresses[in_ram]] = True
 
     ######################### Some functions that will help in reading, waiting, doing stuff. I am not sure how future programs will interact with this
     def read_all_messages(self, timeout=0):
         if timeout != 0:
             t0 = time.time()
             messages = []
-            while True:
-                messages.extend(self.read_all_current_messages())
-                if time.time() - t0 > timeout:
-                    break
+            with self.message_condition:
+                while True:
+                    messages.extend(self.read_all_current_messages())
+                    timeout_remaining = timeout - (time.time() - t0)
+                    if timeout_remaining <= 0:
+                        break
+                    # Sleep until the monitor thread puts new messages in the queues, or the timeout is reached
+                    self.message_condition.wait(timeout_remaining)
             return messages
         else:
             return self.read_all_current_messages()
@@ -216,27 +521,19 @@ class PulseGenerator():
         return messages
 
     def get_state(self, timeout=None):
-        state_queue = self.msgin_queues['devicestate']
-        #Empty the queue
-        state_queue.queue.clear()
-        #request the state
-        self.write_action(request_state=True)
-        # wait for the state to be sent
+        # Returns the reply to this request (not whichever devicestate arrives next), or None if it doesn't arrive within the timeout. 
+        # timeout=None waits until the request expires, after request_expiry seconds.
+        timeout = self.request_expiry if timeout is None else timeout
         try:
-            return state_queue.get(timeout=1)
-        except queue.Empty as ex:
+            return self.request_state().result(timeout)
+        except (concurrent.futures.TimeoutError, TimeoutError, ConnectionError) as ex:
             return None
 
     def get_powerline_state(self, timeout=None):
-        state_queue = self.msgin_queues['powerlinestate']
-        #Empty the queue
-        state_queue.queue.clear()
-        #request the state
-        self.write_action(request_powerline_state=True)
-        # wait for the state to be sent
+        timeout = self.request_expiry if timeout is None else timeout
         try:
-            return state_queue.get(timeout=1)
-        except queue.Empty as ex:
+            return self.request_powerline_state().result(timeout)
+        except (concurrent.futures.TimeoutError, TimeoutError, ConnectionError) as ex:
             return None
 
     def return_on_notification(self, finished=None, triggered=None, address=None, timeout=None):
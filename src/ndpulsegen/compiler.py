@@ -1,5 +1,523 @@
+import numpy as np
+from . import transcode
+from .instruction_table import InstructionTable, instruction_dtype
+from .simulate import simulate_run
 
+clock_period = 10E-9
+channel_num = 24
+max_duration = 281474976710655
 
 
+def compile_sequence(edges=None, pulses=None, duration=None, time_unit='cycles', initial_state=0):
+    '''
+    Compiles the output of each channel into the smallest table of timing
+    instructions that produces it. Instruction i has address i, and they run
+    one after another from time 0.
 
+    Parameters
+    ----------
+    edges : dict or sequence, optional
+        For each channel (the dictionary key, or the index in the sequence),
+        the times at which the channel changes level and the level it changes
+        to. Either a (times, levels) tuple of arrays, or a list of (time, level)
+        pairs. Where a channel has several edges at the same time, the last one
+        is used.
+    pulses : dict or sequence, optional
+        For each channel, a list of (start, stop) pairs. The channel is high
+        from start until stop, whatever its level from `initial_state` and
+        `edges`, and returns to that level afterwards. Overlapping pulses are
+        combined.
+    duration : int or float, optional
+        The length of the whole sequence. Defaults to one cycle after the last
+        edge, so that the final state is output. Edges at exactly `duration`
+        are ignored.
+    time_unit : {'cycles', 'seconds'}, optional
+        The unit of every time, including `duration`. Times in seconds are
+        rounded to the nearest clock cycle (10 ns). Times in cycles must be
+        ints.
+    initial_state : int, optional
+        The state of all channels before their first edge. The binary digits
+        represent the state of each channel, as for
+        `transcode.encode_instruction`.
 
+    Returns
+    -------
+    InstructionTable
+        Neighbouring instructions always have different states, unless the
+        duration of a state is too long for one instruction (more than
+        281474976710655 cycles), in which case it is split. If there are more
+        than 8192 instructions the table can't be uploaded as it is (and the
+        16 bit addresses wrap around), but it can be run with
+        `stream_instructions`, which ignores the addresses.
+
+    Raises
+    ------
+    TypeError
+        If times in cycles are not ints.
+    ValueError
+        If a channel is not in [0, 23], a time is negative, or an edge is after
+        `duration`.
+
+    Notes
+    -----
+    The events of each channel are sorted separately, and turned into the
+    change they make to the state. The channels are then merged with a single
+    stable sort of all the events, which combines the already sorted runs of
+    each channel (a k-way merge), and the state after every event is a
+    cumulative sum of the changes. The cost is O(n log k) for n edges on k
+    channels, and nothing is done per clock cycle.
+    '''
+    if time_unit not in ('cycles', 'seconds'):
+        err_msg = f'\'time_unit\' must be \'cycles\' or \'seconds\', not {time_unit}'
+        raise ValueError(err_msg)
+    # The (times, levels, level before the first time) of every source of events for each channel. Edges start from the initial state.
+    channel_levels = {}
+    for channel, channel_edges in _channel_items(edges):
+        times, levels = _edge_arrays(channel_edges)
+        channel_levels.setdefault(channel, []).append((_to_cycles(times, time_unit), (levels != 0).astype(np.int64), (initial_state >> channel) & 1))
+    for channel, channel_pulses in _channel_items(pulses):
+        channel_pulses = np.asarray(channel_pulses).reshape(-1, 2)
+        starts = _to_cycles(channel_pulses[:, 0], time_unit)
+        stops = _to_cycles(channel_pulses[:, 1], time_unit)
+        if np.any(stops < starts):
+            err_msg = f'Each pulse of channel {channel} must stop after it starts'
+            raise ValueError(err_msg)
+        times = np.concatenate([starts, stops])
+        # Count how many pulses are high after each start (+1) and stop (-1). Stops are sorted first at equal times, so touching pulses are merged.
+        steps = np.concatenate([np.ones(starts.size, dtype=np.int64), -np.ones(stops.size, dtype=np.int64)])
+        order = np.lexsort((steps, times))
+        if channel not in channel_levels:
+            # A channel without edges stays at its initial state outside of its pulses
+            channel_levels[channel] = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), (initial_state >> channel) & 1)]
+        channel_levels[channel].append((times[order], (np.cumsum(steps[order]) > 0).astype(np.int64), 0))
+
+    # The change to the state made by each event, for each channel
+    event_times = []
+    event_changes = []
+    for channel, sources in channel_levels.items():
+        times, levels = _combine_sources(sources)
+        if times.size == 0:
+            continue
+        previous_levels = np.concatenate([[(initial_state >> channel) & 1], levels[:-1]])
+        event_times.append(times)
+        event_changes.append((levels - previous_levels) << channel)
+    if event_times:
+        event_times = np.concatenate(event_times)
+        event_changes = np.concatenate(event_changes)
+    else:
+        event_times = np.zeros(0, dtype=np.int64)
+        event_changes = np.zeros(0, dtype=np.int64)
+
+    if duration is None:
+        duration = int(event_times.max()) + 1 if event_times.size else 1
+    else:
+        duration = int(_to_cycles(np.array([duration]), time_unit)[0])
+        if duration < 1:
+            err_msg = f'\'duration\' must be at least one cycle'
+            raise ValueError(err_msg)
+    if event_times.size and event_times.max() > duration:
+        err_msg = f'There are edges after the end of the sequence (at {int(event_times.max())} cycles, but \'duration\'={duration} cycles)'
+        raise ValueError(err_msg)
+
+    # Merge the channels. The state after the last event at each time is the state from that time on.
+    order = np.argsort(event_times, kind='stable')
+    event_times = event_times[order]
+    states = initial_state + np.cumsum(event_changes[order])
+    last_at_time = np.flatnonzero(np.append(event_times[1:] != event_times[:-1], event_times.size > 0))
+    segment_starts = np.concatenate([[0], event_times[last_at_time]])
+    segment_states = np.concatenate([[initial_state], states[last_at_time]])
+    # Only keep the segments that start before the end, and change the state
+    keep = segment_starts < duration
+    segment_starts = segment_starts[keep]
+    segment_states = segment_states[keep]
+    # Events at time 0 replace the initial state
+    if segment_starts.size > 1 and segment_starts[1] == 0:
+        segment_starts = segment_starts[1:]
+        segment_states = segment_states[1:]
+    changes = np.concatenate([[True], segment_states[1:] != segment_states[:-1]])
+    segment_starts = segment_starts[changes]
+    segment_states = segment_states[changes]
+    segment_durations = np.diff(np.append(segment_starts, duration))
+    return _table_from_segments(segment_durations, segment_states)
+
+def _channel_items(channels):
+    if channels is None:
+        return []
+    items = channels.items() if isinstance(channels, dict) else enumerate(channels)
+    items = [(channel, values) for channel, values in items if values is not None]
+    for channel, values in items:
+        if not isinstance(channel, (int, np.integer)) or channel < 0 or channel >= channel_num:
+            err_msg = f'Channels must be ints in range [0, {channel_num - 1}], not {channel}'
+            raise ValueError(err_msg)
+    return items
+
+def _edge_arrays(channel_edges):
+    if isinstance(channel_edges, tuple) and len(channel_edges) == 2 and np.ndim(channel_edges[0]) == 1:
+        times, levels = channel_edges
+        return np.asarray(times), np.asarray(levels)
+    channel_edges = np.asarray(channel_edges).reshape(-1, 2)
+    return channel_edges[:, 0], channel_edges[:, 1]
+
+def _to_cycles(times, time_unit):
+    times = np.asarray(times)
+    if time_unit == 'seconds':
+        cycles = np.rint(times.astype(np.float64)/clock_period).astype(np.int64)
+    elif times.size and times.dtype.kind not in 'iu':
+        err_msg = f'Times in cycles must be ints, not {times.dtype}'
+        raise TypeError(err_msg)
+    else:
+        cycles = times.astype(np.int64)
+    if np.any(cycles < 0):
+        err_msg = f'Times must not be negative'
+        raise ValueError(err_msg)
+    return cycles
+
+def _combine_sources(sources):
+    # Sorts the (times, levels, initial_level) of a channel by time. If a channel has several sources (eg. both edges and pulses), it is high
+    # when any of them is. Before its first event, each source is at its initial level.
+    if len(sources) == 1:
+        times, levels, initial_level = sources[0]
+        order = np.argsort(times, kind='stable')
+        return times[order], levels[order]
+    all_times = np.concatenate([times for times, levels, initial_level in sources])
+    source_idx = np.concatenate([np.full(times.size, idx) for idx, (times, levels, initial_level) in enumerate(sources)])
+    order = np.argsort(all_times, kind='stable')
+    all_times = all_times[order]
+    source_idx = source_idx[order]
+    # The level of every source after each event is the level of its most recent event, or its initial level if it hasn't had one yet
+    levels = np.zeros(all_times.size, dtype=np.int64)
+    for idx, (times, source_levels, initial_level) in enumerate(sources):
+        source_order = np.argsort(times, kind='stable')
+        source_levels = np.concatenate([[initial_level], source_levels[source_order]])
+        levels |= source_levels[np.cumsum(source_idx == idx)]
+    return all_times, levels
+
+def _table_from_segments(durations, states):
+    # Durations too long for one instruction are split into several instructions with the same state.
+    repeats = (durations + max_duration - 1)//max_duration
+    if np.any(repeats > 1):
+        states = np.repeat(states, repeats)
+        split_durations = np.full(states.size, max_duration, dtype=np.int64)
+        last_of_segment = np.cumsum(repeats) - 1
+        split_durations[last_of_segment] = durations - (repeats - 1)*max_duration
+        durations = split_durations
+    # The table is filled in directly, rather than with encode_instructions, as it may be longer than the RAM (see compile_sequence).
+    array = np.zeros(durations.size, dtype=instruction_dtype)
+    array['identifier'] = transcode.msgout_identifier['load_ram']
+    array['address'] = np.arange(durations.size).astype(np.uint16)
+    array['state'] = states.astype('<u4').view(np.uint8).reshape(-1, 4)[:, :3]
+    array['duration'] = durations.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+    return InstructionTable(array)
+
+def compress_loops(instructions, max_period=64):
+    '''
+    Rewrites a flat sequence of instructions using loops (`goto_address` and
+    `goto_counter`) wherever a block of instructions is repeated back to back,
+    including repeats of blocks that themselves contain loops. The compressed
+    instructions execute exactly the same (duration, state, tags) sequence as
+    the original ones.
+
+    Parameters
+    ----------
+    instructions : InstructionTable, bytes-like, or list of bytes
+        The encoded instructions, in the order they are executed. They must
+        not already contain loops. Their addresses are ignored, so the table
+        may be longer than the RAM (see `compile_sequence`).
+    max_period : int, optional
+        The longest block (in instructions, or already compressed loops) that
+        is looked for. The time taken is proportional to `max_period`.
+
+    Returns
+    -------
+    LoopCompression
+
+    Raises
+    ------
+    ValueError
+        If the instructions already contain loops, or there are still more than
+        8192 instructions after compression.
+
+    Notes
+    -----
+    The loop semantics are those of `examples.py` using_loops_normally: a
+    block is repeated n times by giving its last instruction goto_address=
+    (the first address of the block) and goto_counter=n-1. As the volitile
+    goto_counter is reset when a loop finishes, loops can be nested. A loop's
+    last instruction can only hold one goto, so when a block ends with an inner
+    loop, one repeat of the inner block is written out after the inner loop.
+
+    Repeats are found by comparing the sequence with itself shifted by each
+    period, from 1 to `max_period`. Each run of repeats is replaced by a single
+    loop, if that needs fewer instructions, and the search is repeated on the
+    shorter sequence until nothing changes, so repeated loops become nested
+    loops.
+    '''
+    if not isinstance(instructions, InstructionTable):
+        instructions = InstructionTable.from_bytes(instructions)
+    records = np.ascontiguousarray(instructions.array).view(np.uint8).reshape(-1, instruction_dtype.itemsize)
+    if np.any(records[:, 14:18]):
+        err_msg = f'\'instructions\' must not already contain loops (goto_counter must be 0)'
+        raise ValueError(err_msg)
+    # Identical instructions (ignoring the address) are given the same token
+    keys = np.ascontiguousarray(np.concatenate([records[:, 3:12], records[:, 18:19]], axis=1)).view(np.dtype((np.void, 10))).ravel()
+    unique_keys, first_index, sequence = np.unique(keys, return_index=True, return_inverse=True)
+    compressor = _LoopCompressor(records[first_index])
+    sequence = compressor.compress(sequence.astype(np.int64).ravel(), max_period)
+    return LoopCompression(compressor.emit(sequence), len(records))
+
+
+class LoopCompression():
+    '''The result of `compress_loops`. "instructions" is an InstructionTable starting at address 0, ready to upload.'''
+    def __init__(self, instructions, original_instruction_number):
+        self.instructions = instructions
+        self.original_instruction_number = original_instruction_number
+
+    @property
+    def instruction_number(self):
+        return len(self.instructions)
+
+    @property
+    def compression_ratio(self):
+        '''The number of instructions before compression, divided by the number after.'''
+        return self.original_instruction_number/max(self.instruction_number, 1)
+
+    @property
+    def upload_time_saved(self):
+        '''The time (in seconds) saved when uploading the compressed instructions, at 12 Mbaud with 10 bits per byte.'''
+        return (self.original_instruction_number - self.instruction_number)*instruction_dtype.itemsize*10/12E6
+
+    def __repr__(self):
+        return f'LoopCompression({self.original_instruction_number} -> {self.instruction_number} instructions, ratio {self.compression_ratio:.1f}, {self.upload_time_saved*1E3:.2f} ms upload saved)'
+
+
+class _LoopCompressor():
+    # Tokens below len(records) are single instructions. Larger tokens are loops, stored as (body tokens, repeats).
+    def __init__(self, records):
+        self.records = records
+        self.loops = {}
+        self.loop_tokens = {}
+        self.costs = [1]*len(records)
+
+    def loop_token(self, body, repeats):
+        key = (body, repeats)
+        token = self.loop_tokens.get(key)
+        if token is None:
+            # Finding the cost can make new tokens for inner loops, so it is done first
+            cost = sum(self.costs[body_token] for body_token in self.plain_ending(body))
+            token = len(self.costs)
+            self.loop_tokens[key] = token
+            self.loops[token] = key
+            self.costs.append(cost)
+        return token
+
+    def plain_ending(self, body):
+        # A loop body cannot end with another loop, so the last repeat of an inner loop at the end is written out.
+        body = list(body)
+        while body and body[-1] in self.loops:
+            inner_body, inner_repeats = self.loops[body.pop()]
+            if inner_repeats > 2:
+                body.append(self.loop_token(inner_body, inner_repeats - 1))
+            elif inner_repeats == 2:
+                body.extend(inner_body)
+            body.extend(inner_body)
+        return body
+
+    def compress(self, sequence, max_period):
+        changed = True
+        while changed:
+            changed = False
+            for period in range(1, max_period + 1):
+                if sequence.size < 2*period:
+                    break
+                matches = np.concatenate([[False], sequence[:-period] == sequence[period:], [False]])
+                run_edges = np.flatnonzero(matches[1:] != matches[:-1])
+                run_starts = run_edges[0::2]
+                run_lengths = run_edges[1::2] - run_starts
+                long_runs = run_lengths >= period
+                if not np.any(long_runs):
+                    continue
+                pieces = []
+                position = 0
+                for run_start, length in zip(run_starts[long_runs].tolist(), run_lengths[long_runs].tolist()):
+                    # The run may overlap the end of the previous loop
+                    start = max(run_start, position)
+                    repeats = min((length - (start - run_start))//period + 1, 2**32)
+                    if repeats < 2:
+                        continue
+                    body = tuple(sequence[start:start + period].tolist())
+                    # Loops made earlier in this pass can make a block that is itself a repeat of a shorter block
+                    body, body_repeats = _primitive_block(body)
+                    token = self.loop_token(body, repeats*body_repeats)
+                    if self.costs[token] >= repeats*body_repeats*sum(self.costs[body_token] for body_token in body):
+                        continue
+                    pieces.append(sequence[position:start])
+                    pieces.append(np.array([token], dtype=np.int64))
+                    position = start + repeats*period
+                    changed = True
+                if pieces:
+                    pieces.append(sequence[position:])
+                    sequence = np.concatenate(pieces)
+        return sequence
+
+    def emit(self, sequence):
+        rows = []
+        self.emit_tokens(sequence.tolist(), rows)
+        if len(rows) > 8192:
+            # Unlike a flat sequence, loops can't be streamed, as their goto_addresses must be in the RAM
+            err_msg = f'The compressed instructions don\'t fit in the RAM. There are {len(rows)} instructions, but there can be at most 8192'
+            raise ValueError(err_msg)
+        records = self.records[[token for token, goto_address, goto_counter in rows]].copy()
+        addresses = np.arange(len(rows))
+        records[:, 1] = addresses & 0xFF
+        records[:, 2] = (addresses >> 8) & 0xFF
+        goto = np.array([(goto_address, goto_counter) for token, goto_address, goto_counter in rows], dtype=np.int64).reshape(-1, 2)
+        records[:, 12:14] = goto[:, 0:1].astype('<u2').view(np.uint8)
+        records[:, 14:18] = goto[:, 1:2].astype('<u4').view(np.uint8)
+        return InstructionTable(records.view(instruction_dtype).ravel())
+
+    def emit_tokens(self, tokens, rows):
+        for token in tokens:
+            if token in self.loops:
+                body, repeats = self.loops[token]
+                start = len(rows)
+                self.emit_tokens(self.plain_ending(body), rows)
+                rows[-1] = (rows[-1][0], start, repeats - 1)
+            else:
+                rows.append((token, 0, 0))
+
+
+def _primitive_block(block):
+    # Returns the shortest block that "block" is a repeat of, and the number of repeats.
+    length = len(block)
+    for period in range(1, length//2 + 1):
+        if length % period == 0 and block == block[:period]*(length//period):
+            return block[:period], length//period
+    return block, 1
+
+def optimize_instructions(instructions, final_ram_address=None, remove_unexecuted=True):
+    '''
+    Removes redundant instructions from a program without changing what it
+    outputs. Each instruction that runs straight on into the next one, with the
+    same state, is merged with it into one instruction whose duration is the
+    sum. Instructions that the run never executes are removed. The remaining
+    instructions are given consecutive addresses from 0, and every
+    `goto_address` is updated to match.
+
+    Parameters
+    ----------
+    instructions : InstructionTable, bytes-like, or list of bytes
+        The encoded instructions. They may contain loops, and need not be in
+        address order.
+    final_ram_address : int, optional
+        The `final_ram_address` device setting used for the run. Defaults to the
+        highest address in `instructions`.
+    remove_unexecuted : bool, optional
+        If True, instructions that are never executed (according to
+        `simulate.simulate_run`) are removed.
+
+    Returns
+    -------
+    InstructionOptimization
+        Use its `final_ram_address` for the optimized program.
+
+    Raises
+    ------
+    ValueError
+        If the run would execute an address that is not in `instructions` (see
+        `simulate.simulate_run`).
+
+    Notes
+    -----
+    An instruction at address a is only merged with the instruction at a+1 if
+    every time the run finishes a it goes on to a+1, and every time the run
+    starts a+1 it came from a. So a must not have a goto_counter, or
+    stop_and_wait (which pauses the run between them), or be the
+    final_ram_address. a+1 must not be the goto_address of any executed
+    instruction, and must not have notify_computer, hardware_trig_out or
+    powerline_sync, which act when it starts. The merged instruction keeps the
+    tags of a that act when it starts, and the stop_and_wait and goto of a+1.
+    Durations are never merged beyond 281474976710655 cycles.
+    '''
+    if not isinstance(instructions, InstructionTable):
+        instructions = InstructionTable.from_bytes(instructions)
+    instructions = instructions.sort_by_address()
+    original_instruction_number = len(instructions)
+    if final_ram_address is None:
+        final_ram_address = int(instructions.address.max())
+    simulation = simulate_run(instructions, final_ram_address)
+    if remove_unexecuted:
+        executed = simulation.execution_counts[instructions.address] > 0
+        instructions = instructions[executed]
+    address = instructions.address.astype(np.int64)
+    duration = instructions.duration.astype(np.uint64)
+    tags = instructions.array['tags']
+    goto_counter = instructions.goto_counter
+    looping = goto_counter > 0
+    goto_target = np.zeros(max(address.max(initial=0), instructions.goto_address.max(initial=0)) + 2, dtype=np.bool_)
+    goto_target[instructions.goto_address[looping]] = True
+    # joins[i] means instruction i+1 is merged into instruction i
+    joins = ((address[1:] == address[:-1] + 1) & (instructions.state[1:] == instructions.state[:-1])
+        & ~looping[:-1] & (tags[:-1] & 0b1 == 0) & (address[:-1] != final_ram_address)
+        & (tags[1:] & 0b1110 == 0) & ~goto_target[address[1:]])
+    heads = np.flatnonzero(np.concatenate([[True], ~joins]))
+    merged_durations = _group_sums(duration, heads)
+    if np.any(merged_durations > max_duration):
+        heads = _split_long_groups(duration, heads, merged_durations)
+        merged_durations = _group_sums(duration, heads)
+    tails = np.append(heads[1:] - 1, address.size - 1)
+    # The new address of the instruction that each old address is merged into
+    is_head = np.zeros(address.size, dtype=np.bool_)
+    is_head[heads] = True
+    new_address = np.zeros(goto_target.size, dtype=np.int64)
+    new_address[address] = np.cumsum(is_head) - 1
+    array = instructions.array[heads].copy()
+    array['address'] = np.arange(heads.size)
+    array['duration'] = merged_durations.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+    array['tags'] = (tags[heads] & 0b1110) | (tags[tails] & 0b1)
+    array['goto_counter'] = goto_counter[tails]
+    array['goto_address'] = np.where(looping[tails], new_address[instructions.goto_address[tails]], 0)
+    final_ram_address = int(new_address[final_ram_address])
+    return InstructionOptimization(InstructionTable(array), final_ram_address, original_instruction_number)
+
+
+class InstructionOptimization():
+    '''The result of `optimize_instructions`. "instructions" is an InstructionTable starting at address 0, to be run with "final_ram_address".'''
+    def __init__(self, instructions, final_ram_address, original_instruction_number):
+        self.instructions = instructions
+        self.final_ram_address = final_ram_address
+        self.original_instruction_number = original_instruction_number
+
+    @property
+    def instruction_number(self):
+        return len(self.instructions)
+
+    @property
+    def upload_time_saved(self):
+        '''The time (in seconds) saved when uploading the optimized instructions, at 12 Mbaud with 10 bits per byte.'''
+        return (self.original_instruction_number - self.instruction_number)*instruction_dtype.itemsize*10/12E6
+
+    def __repr__(self):
+        return f'InstructionOptimization({self.original_instruction_number} -> {self.instruction_number} instructions, final_ram_address={self.final_ram_address})'
+
+
+def _group_sums(values, heads):
+    # The sum of each group of values starting at each head. Sums of uint64 wrap around, but the differences are still exact.
+    cumulative = np.concatenate([[0], np.cumsum(values, dtype=np.uint64)]).astype(np.uint64)
+    bounds = np.append(heads, values.size)
+    return cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+def _split_long_groups(durations, heads, group_durations):
+    # Starts new groups wherever a group would last longer than one instruction can. Only needed for very long instructions, so isn't vectorised.
+    bounds = np.append(heads, durations.size)
+    new_heads = []
+    for group in range(heads.size):
+        new_heads.append(bounds[group])
+        if group_durations[group] <= max_duration:
+            continue
+        total = 0
+        for index in range(bounds[group], bounds[group + 1]):
+            total += int(durations[index])
+            if total > max_duration:
+                new_heads.append(index)
+                total = int(durations[index])
+    return np.array(new_heads, dtype=np.int64)
@@ -0,0 +1,452 @@
+import threading
+import serial
+from . import protocol
+from . import transcode
+
+
+# The length of each command that can be sent to the Pulse Gen, including the message identifier.
+msgout_length = {codec.identifier:codec.length for codec in protocol.msgout_codecs.values()}
+
+
+class PulseGenEmulator():
+    '''
+    A software model of a Pulse Gen. It accepts the commands made by the
+    `transcode.encode_*` functions, keeps an emulated RAM and the device
+    options, executes runs, and replies with echo, devicestate, powerlinestate,
+    notification and error messages in the same byte layout as the hardware.
+
+    Time is kept by a virtual clock (in cycles of 10 ns) that only moves when
+    `advance` is called, or when an `EmulatedSerial` is waiting for a reply.
+    Each instruction costs the same to emulate however long it lasts, and loops
+    that repeat without sending a notification are skipped over (in the same
+    way as `simulate_run`), so runs that would take hours finish in
+    milliseconds.
+
+    Example
+    -------
+    emulator = ndpulsegen.PulseGenEmulator()
+    pg = ndpulsegen.PulseGenerator()
+    pg.attach_serial(emulator.open_serial())
+    pg.write_instructions(instructions)
+    pg.write_device_options(final_ram_address=3, notify_when_run_finished=True)
+    pg.write_action(trigger_now=True)
+    pg.return_on_notification(finished=True, timeout=1)
+
+    Notes
+    -----
+    Instructions that have not been uploaded since the emulator was made are
+    all zeros, and last for a single cycle. Hardware triggers can be emulated
+    with `hardware_trigger`. The powerline is always locked, with a period of
+    `powerline_period` cycles, and its positive zero crossings happen at
+    multiples of `powerline_period`.
+    '''
+    clock_period = 10E-9
+    ram_size = 8192
+
+    def __init__(self, serial_number=1, device_type=1, hardware_version=1, firmware_version=1000, powerline_period=2000000):
+        self.serial_number = serial_number
+        self.device_type = device_type
+        self.hardware_version = hardware_version
+        self.firmware_version = firmware_version
+        self.powerline_period = powerline_period
+
+        # Held while the emulator is used, and notified every time a command is received.
+        self.condition = threading.Condition()
+        self.time = 0
+        self.input_buffer = bytearray()
+        self.output_buffer = bytearray()
+
+        # The uploaded instructions, decoded into lists so a run can be stepped through quickly.
+        self.durations = [1]*self.ram_size
+        self.states = [0]*self.ram_size
+        self.goto_addresses = [0]*self.ram_size
+        self.goto_counters = [0]*self.ram_size
+        self.instruction_tags = [0]*self.ram_size
+        # The volitile goto_counters that currently differ from their uploaded value.
+        self.volitile_counters = {}
+
+        # Device options, with the same names as the devicestate and powerlinestate messages
+        self.final_ram_address = 0
+        self.run_mode = 'single'
+        self.trigger_source = 'software'
+        self.trigger_out_length = 1
+        self.trigger_out_delay = 0
+        self.notify_on_main_trig_out = False
+        self.notify_on_run_finished = False
+        self.software_run_enable = True
+        self.hardware_run_enable = True
+        self.trig_on_powerline = False
+        self.powerline_trigger_delay = 0
+        self.output_state = 0
+
+        # Progress of the current run. run_status is one of 'idle', 'running' or 'paused' (by a stop_and_wait instruction).
+        self.run_status = 'idle'
+        self.current_address = 0
+        # The next thing that happens in the run: ('start', address, time) or ('end', address, time) of an instruction.
+        self.next_event = None
+        self.paused_address = None
+        self.trigger_notify_time = None
+        self.disable_after_current_run = False
+        # The time the run was paused by software_run_enable=False, or None if it isn't.
+        self.frozen_since = None
+        # Used to skip over repeated loops. See end_instruction.
+        self.loop_frames = {}
+        self.event_count = 0
+        self.advance_until = 0
+
+    ######################### Host side interface
+    def open_serial(self, idle_advance=10.0):
+        '''Returns an EmulatedSerial connected to this emulator, that can be used with PulseGenerator.attach_serial.'''
+        return EmulatedSerial(self, idle_advance=idle_advance)
+
+    def write(self, data):
+        '''Receives bytes sent by the host, and processes every complete command.'''
+        with self.condition:
+            self.input_buffer += data
+            position = 0
+            while position < len(self.input_buffer):
+                message_identifier = self.input_buffer[position]
+                message_length = msgout_length.get(message_identifier)
+                if message_length is None:
+                    self.send_error(invalid_identifier_received=True)
+                    position += 1
+                    continue
+                if position + message_length > len(self.input_buffer):
+                    break
+                self.process_command(message_identifier, bytes(self.input_buffer[position+1:position+message_length]))
+                position += message_length
+            del self.input_buffer[:position]
+            self.condition.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        '''Removes and returns up to "size" bytes that have been sent to the host.'''
+        with self.condition:
+            data = bytes(self.output_buffer[:size])
+            del self.output_buffer[:size]
+            return data
+
+    @property
+    def in_waiting(self):
+        return len(self.output_buffer)
+
+    @property
+    def elapsed_time(self):
+        '''The time on the virtual clock, in seconds.'''
+        return self.time*self.clock_period
+
+    def advance(self, seconds=None, cycles=None, stop_on_output=False):
+        '''
+        Moves the virtual clock forward by "seconds" or "cycles", executing any
+        run that is in progress. If stop_on_output=True, the clock stops early
+        at the first message sent to the host, or once nothing else is scheduled
+        to happen. Returns True if anything is still scheduled to happen after
+        the clock stops.
+        '''
+        if cycles is None:
+            cycles = round(seconds/self.clock_period)
+        with self.condition:
+            return self.advance_cycles(cycles, stop_on_output)
+
+    def hardware_trigger(self):
+        '''Emulates a pulse on the hardware trigger input, at the current time.'''
+        with self.condition:
+            if self.trigger_source in ('hardware', 'either', 'single_hardware') and self.accepts_trigger():
+                if self.trigger_source == 'single_hardware':
+                    self.trigger_source = 'software'
+                self.trigger()
+
+    ######################### Commands
+    def process_command(self, message_identifier, message):
+        # Changes to the RAM or settings would make the recorded loop passes out of date
+        self.loop_frames.clear()
+        if message_identifier == transcode.msgout_identifier['echo']:
+            byte_to_echo, = protocol.msgout_codecs['echo'].unpack(message)
+            self.output_buffer += protocol.msgin_codecs['echo'].pack(byte_to_echo, self.device_type, self.hardware_version, self.firmware_version, self.serial_number)
+        elif message_identifier == transcode.msgout_identifier['load_ram']:
+            self.load_instruction(message)
+        elif message_identifier == transcode.msgout_identifier['action_request']:
+            self.action(*protocol.msgout_codecs['action_request'].unpack(message))
+        elif message_identifier == transcode.msgout_identifier['device_options']:
+            self.set_device_options(message)
+        elif message_identifier == transcode.msgout_identifier['set_static_state']:
+            if self.run_status == 'idle':
+                self.output_state, = protocol.msgout_codecs['set_static_state'].unpack(message)
+        elif message_identifier == transcode.msgout_identifier['powerline_trigger_options']:
+            powerline_trigger_delay, update_powerline_trigger_delay, trigger_on_powerline = protocol.msgout_codecs['powerline_trigger_options'].unpack(message)
+            if update_powerline_trigger_delay:
+                self.powerline_trigger_delay = powerline_trigger_delay
+            if trigger_on_powerline & 0b10:
+                self.trig_on_powerline = bool(trigger_on_powerline & 0b1)
+        # general_input commands are ignored, as they are by the hardware.
+
+    def load_instruction(self, message):
+        address, state, duration, goto_address, goto_counter, stop_and_wait, hardware_trig_out, notify_computer, powerline_sync = protocol.msgout_codecs['load_ram'].unpack(message)
+        if address >= self.ram_size:
+            return
+        self.states[address] = state
+        self.durations[address] = duration
+        self.goto_addresses[address] = goto_address
+        self.goto_counters[address] = goto_counter
+        # The tags are kept in the same bits as an encoded instruction
+        self.instruction_tags[address] = stop_and_wait | (hardware_trig_out << 1) | (notify_computer << 2) | (powerline_sync << 3)
+        # Writing an instruction also resets its volitile goto_counter
+        self.volitile_counters.pop(address, None)
+
+    def action(self, trigger_now, request_state, request_powerline_state, disable_after_current_run, reset_run):
+        if reset_run:
+            # reset_run. The volitile goto_counters are deliberately left as they are.
+            self.run_status = 'idle'
+            self.current_address = 0
+            self.next_event = None
+            self.trigger_notify_time = None
+            self.disable_after_current_run = False
+        if trigger_now:
+            if self.trigger_source in ('software', 'either') and self.accepts_trigger():
+                self.trigger()
+        if disable_after_current_run:
+            if self.run_mode == 'continuous' and self.run_status != 'idle':
+                self.disable_after_current_run = True
+        if request_state:
+            self.send_devicestate()
+        if request_powerline_state:
+            self.send_powerlinestate()
+
+    def set_device_options(self, message):
+        (final_ram_address, trigger_out_delay, trigger_out_length, run_mode, trigger_source, notify_on_main_trig_out, update_final_ram_address,
+            update_trigger_out_delay, update_trigger_out_length, software_run_enable, notify_when_run_finished) = protocol.msgout_codecs['device_options'].unpack(message)
+        # Settings of several bits have an update flag in their highest bit
+        if run_mode & 0b10:
+            self.run_mode = transcode.decode_lookup['run_mode'][run_mode & 0b1]
+        if trigger_source & 0b100:
+            self.trigger_source = transcode.decode_lookup['trigger_source'][trigger_source & 0b11]
+        if notify_on_main_trig_out & 0b10:
+            self.notify_on_main_trig_out = bool(notify_on_main_trig_out & 0b1)
+        if update_final_ram_address:
+            self.final_ram_address = final_ram_address
+        if update_trigger_out_delay:
+            self.trigger_out_delay = trigger_out_delay
+        if update_trigger_out_length:
+            self.trigger_out_length = trigger_out_length
+        if software_run_enable & 0b10:
+            self.set_software_run_enable(bool(software_run_enable & 0b1))
+        if notify_when_run_finished & 0b10:
+            self.notify_on_run_finished = bool(notify_when_run_finished & 0b1)
+
+    def set_software_run_enable(self, software_run_enable):
+        if software_run_enable and self.frozen_since is not None:
+            # Everything that was scheduled while the run was paused happens that much later
+            pause_length = self.time - self.frozen_since
+            if self.next_event is not None:
+                event_type, address, event_time = self.next_event
+                self.next_event = (event_type, address, event_time + pause_length)
+            if self.trigger_notify_time is not None:
+                self.trigger_notify_time += pause_length
+            self.frozen_since = None
+        elif not software_run_enable and self.frozen_since is None:
+            self.frozen_since = self.time
+        self.software_run_enable = software_run_enable
+
+    ######################### Replies
+    def send_error(self, invalid_identifier_received=False, timeout_waiting_to_receive_message=False, error_info=0):
+        self.output_buffer += protocol.msgin_codecs['error'].pack(int(invalid_identifier_received), int(timeout_waiting_to_receive_message), 0, error_info)
+
+    def send_notification(self, address, address_notify=False, trigger_notify=False, finished_notify=False):
+        self.output_buffer += protocol.msgin_codecs['notification'].pack(address, int(address_notify), int(trigger_notify), int(finished_notify))
+        self.event_count += 1
+
+    def send_devicestate(self):
+        run_mode_tag = {value:key for key, value in transcode.decode_lookup['run_mode'].items()}[self.run_mode]
+        trigger_source_tag = {value:key for key, value in transcode.decode_lookup['trigger_source'].items()}[self.trigger_source]
+        # The clock source is always internal
+        self.output_buffer += protocol.msgin_codecs['devicestate'].pack(self.output_state, self.final_ram_address, self.trigger_out_delay, self.trigger_out_length,
+            self.current_address, run_mode_tag, trigger_source_tag, int(self.notify_on_main_trig_out), 1, int(self.run_status != 'idle'), int(self.software_run_enable),
+            int(self.hardware_run_enable), int(self.notify_on_run_finished))
+
+    def send_powerlinestate(self):
+        # The emulated powerline is always locked
+        self.output_buffer += protocol.msgin_codecs['powerlinestate'].pack(int(self.trig_on_powerline), 1, self.powerline_period, self.powerline_trigger_delay)
+
+    ######################### Runs
+    def accepts_trigger(self):
+        return self.run_status != 'running' and self.software_run_enable and self.hardware_run_enable
+
+    def next_powerline_trigger(self, after_time):
+        phase = (after_time - self.powerline_trigger_delay) % self.powerline_period
+        return after_time if phase == 0 else after_time + self.powerline_period - phase
+
+    def trigger(self):
+        start_time = self.next_powerline_trigger(self.time) if self.trig_on_powerline else self.time
+        if self.run_status == 'paused':
+            self.run_status = 'running'
+            self.next_event = ('start', self.paused_address, start_time)
+        else:
+            self.start_run(start_time)
+
+    def start_run(self, start_time):
+        self.run_status = 'running'
+        self.next_event = ('start', 0, start_time)
+        if self.notify_on_main_trig_out:
+            self.trigger_notify_time = start_time + self.trigger_out_delay
+
+    def advance_cycles(self, cycles, stop_on_output=False):
+        # Must be called while holding self.condition. Handles every event up to and including self.time + cycles.
+        self.advance_until = self.time + cycles
+        if cycles > 0 and self.input_buffer:
+            # A partial command that is not completed before the clock moves on is discarded, as it would be by the hardware.
+            error_info = self.input_buffer[0] - transcode.msgout_identifier['echo'] + 1
+            self.send_error(timeout_waiting_to_receive_message=True, error_info=error_info)
+            self.input_buffer.clear()
+        output_length = len(self.output_buffer)
+        while self.frozen_since is None:
+            if self.next_event is not None and (self.trigger_notify_time is None or self.next_event[2] <= self.trigger_notify_time):
+                event_type, address, event_time = self.next_event
+                if event_time > self.advance_until:
+                    break
+                self.time = event_time
+                if event_type == 'start':
+                    self.start_instruction(address)
+                else:
+                    self.end_instruction(address)
+            elif self.trigger_notify_time is not None and self.trigger_notify_time <= self.advance_until:
+                self.time = self.trigger_notify_time
+                self.trigger_notify_time = None
+                self.send_notification(self.current_address, trigger_notify=True)
+            else:
+                break
+            if stop_on_output and len(self.output_buffer) > output_length:
+                return True
+        pending = self.is_pending()
+        if pending or not stop_on_output:
+            self.time = self.advance_until
+        return pending
+
+    def is_pending(self):
+        '''True if anything is scheduled to happen as the clock moves forward.'''
+        return bool(self.input_buffer) or (self.frozen_since is None and (self.next_event is not None or self.trigger_notify_time is not None))
+
+    def start_instruction(self, address):
+        self.current_address = address
+        self.output_state = self.states[address]
+        if self.instruction_tags[address] & 0b100:
+            self.send_notification(address, address_notify=True)
+        self.next_event = ('end', address, self.time + max(self.durations[address], 1))
+
+    def end_instruction(self, address):
+        goto_counter = self.volitile_counters.get(address, self.goto_counters[address])
+        if goto_counter:
+            goto_counter = self.skip_repeated_loops(address, goto_counter)
+        if goto_counter:
+            self.volitile_counters[address] = goto_counter - 1
+            next_address = self.goto_addresses[address]
+        else:
+            self.volitile_counters.pop(address, None)
+            self.loop_frames.pop(address, None)
+            if address == self.final_ram_address:
+                self.end_run()
+                return
+            next_address = (address + 1) % self.ram_size
+        if self.instruction_tags[address] & 0b1:
+            # stop_and_wait. An instruction with powerline_sync restarts the run by itself.
+            self.event_count += 1
+            if self.instruction_tags[next_address] & 0b1000:
+                self.next_event = ('start', next_address, self.next_powerline_trigger(self.time))
+            else:
+                self.run_status = 'paused'
+                self.paused_address = next_address
+                self.next_event = None
+        else:
+            self.next_event = ('start', next_address, self.time)
+
+    def skip_repeated_loops(self, address, goto_counter):
+        # If the run last jumped from this address with every other goto_counter in the same state, and nothing has been sent to the host
+        # or paused the run since, every remaining jump repeats exactly the same instructions. Skip as many as fit before self.advance_until.
+        other_counters = self.volitile_counters.copy()
+        other_counters.pop(address, None)
+        loop_frame = self.loop_frames.get(address)
+        if loop_frame is not None and loop_frame['goto_counter'] == goto_counter + 1 and loop_frame['event_count'] == self.event_count and loop_frame['counters'] == other_counters and self.trigger_notify_time is None:
+            pass_duration = self.time - loop_frame['time']
+            skipped_passes = min(goto_counter, (self.advance_until - self.time)//pass_duration)
+            if skipped_passes:
+                self.time += skipped_passes*pass_duration
+                goto_counter -= skipped_passes
+                self.loop_frames = {frame_address:frame for frame_address, frame in self.loop_frames.items() if frame['time'] <= loop_frame['time']}
+        self.loop_frames[address] = {'time':self.time, 'goto_counter':goto_counter, 'counters':other_counters, 'event_count':self.event_count}
+        return goto_counter
+
+    def end_run(self):
+        if self.run_mode == 'continuous' and not self.disable_after_current_run:
+            # Restarting is treated like a loop from the final address back to address 0, that never runs out.
+            loop_frame = self.loop_frames.get('restart')
+            if loop_frame is not None and loop_frame['event_count'] == self.event_count and loop_frame['counters'] == self.volitile_counters:
+                pass_duration = self.time - loop_frame['time']
+                self.time += ((self.advance_until - self.time)//pass_duration)*pass_duration
+                self.loop_frames = {}
+            self.loop_frames['restart'] = {'time':self.time, 'counters':self.volitile_counters.copy(), 'event_count':self.event_count}
+            self.start_run(self.time)
+            return
+        self.run_status = 'idle'
+        self.next_event = None
+        self.disable_after_current_run = False
+        self.loop_frames.clear()
+        if self.notify_on_run_finished:
+            self.send_notification(self.current_address, finished_notify=True)
+
+
+class EmulatedSerial():
+    '''
+    Stands in for an open serial.Serial that is connected to a PulseGenEmulator.
+    When the host waits to read and nothing has been sent yet, the emulator's
+    virtual clock is moved forward to the next message (by at most
+    "idle_advance" seconds per read), so waiting for a notification at the end
+    of a long run returns straight away.
+    '''
+    def __init__(self, emulator, idle_advance=10.0):
+        self.emulator = emulator
+        self.idle_advance = idle_advance
+        self.port = f'emulated:{emulator.serial_number}'
+        self.baudrate = 12000000
+        self.timeout = 0.1
+        self.writeTimeout = 1
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return self.emulator.in_waiting
+
+    def check_open(self):
+        if not self.is_open:
+            raise serial.serialutil.SerialException('Attempting to use a port that is not open')
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        with self.emulator.condition:
+            self.emulator.condition.notify_all()
+
+    def reset_input_buffer(self):
+        self.check_open()
+        with self.emulator.condition:
+            self.emulator.output_buffer.clear()
+
+    def reset_output_buffer(self):
+        self.check_open()
+
+    def write(self, data):
+        self.check_open()
+        return self.emulator.write(data)
+
+    def read(self, size=1):
+        self.check_open()
+        emulator = self.emulator
+        idle_cycles = round(self.idle_advance/emulator.clock_period)
+        with emulator.condition:
+            if not emulator.output_buffer:
+                if emulator.is_pending():
+                    emulator.advance_cycles(idle_cycles, stop_on_output=True)
+                elif self.timeout != 0:
+                    # Nothing will happen until the host sends another command
+                    emulator.condition.wait(self.timeout)
+            return emulator.read(size)
@@ -0,0 +1,139 @@
+import numpy as np
+from . import protocol
+from . import transcode
+
+# The numpy dtype of a single encoded timing instruction, generated from its layout in protocol.schema. It has exactly the same memory
+# layout as the bytes sent to the Pulse Gen (see transcode.encode_instruction), so an array of this dtype IS the wire format, and
+# converting between the two never requires copying. Fields that are not a whole number of standard integer widths are stored as bytes.
+instruction_dtype = protocol.msgout_codecs['load_ram'].dtype
+
+
+class InstructionTable():
+    '''
+    A table of encoded timing instructions, backed by a single numpy structured
+    array with dtype `instruction_dtype` (one row per instruction). The memory
+    layout of the array is identical to the encoded instructions that are
+    uploaded to the Pulse Gen, so tables can be made from, and converted to,
+    encoded instructions without copying.
+
+    Iterating over a table, or indexing it with an int, gives the encoded bytes
+    of each instruction, so a table can be used anywhere a list of instructions
+    from `transcode.encode_instruction` is expected. Indexing with a slice,
+    boolean mask or array of indices gives another InstructionTable.
+    '''
+    def __init__(self, array):
+        array = np.asarray(array)
+        if array.dtype != instruction_dtype:
+            err_msg = f'\'array\' must have dtype ndpulsegen.instruction_table.instruction_dtype, not {array.dtype}'
+            raise TypeError(err_msg)
+        self.array = array.reshape(-1)
+
+    @classmethod
+    def from_arrays(cls, address, duration, state, goto_address=0, goto_counter=0, stop_and_wait=False, hardware_trig_out=False, notify_computer=False, powerline_sync=False):
+        '''Encodes the instructions with transcode.encode_instructions. See that function for a description of the arguments.'''
+        encoded = transcode.encode_instructions(address, duration, state, goto_address, goto_counter, stop_and_wait, hardware_trig_out, notify_computer, powerline_sync)
+        return cls.from_bytes(bytearray(encoded))
+
+    @classmethod
+    def from_bytes(cls, instructions):
+        '''
+        Makes a table from encoded instructions. If `instructions` is a single
+        bytes-like object (bytes, bytearray, memoryview, mmap...) the table is a
+        view of it, and no copy is made. If the buffer is writable, so is the
+        table. A list or tuple of encoded instructions is joined first.
+        '''
+        if isinstance(instructions, (list, tuple)):
+            instructions = bytearray(b''.join(instructions))
+        array = np.frombuffer(instructions, dtype=np.uint8)
+        if array.size % instruction_dtype.itemsize != 0:
+            err_msg = f'\'instructions\' must have a length that is a multiple of {instruction_dtype.itemsize}, not {array.size}'
+            raise ValueError(err_msg)
+        array = array.view(instruction_dtype)
+        if np.any(array['identifier'] != transcode.msgout_identifier['load_ram']):
+            err_msg = f'\'instructions\' contains messages that are not encoded instructions'
+            raise ValueError(err_msg)
+        return cls(array)
+
+    def to_bytes(self):
+        return self.array.tobytes()
+
+    def __bytes__(self):
+        return self.to_bytes()
+
+    @property
+    def buffer(self):
+        '''A memoryview of the encoded instructions, without copying.'''
+        return memoryview(np.ascontiguousarray(self.array).view(np.uint8))
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def __len__(self):
+        return self.array.size
+
+    def __iter__(self):
+        for record in np.ascontiguousarray(self.array).view(np.uint8).reshape(-1, instruction_dtype.itemsize):
+            yield record.tobytes()
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.array[key].tobytes()
+        return InstructionTable(self.array[key])
+
+    def __repr__(self):
+        return f'InstructionTable({len(self)} instructions)'
+
+    def sort_by_address(self):
+        '''Returns a new table with the instructions ordered by address.'''
+        return InstructionTable(self.array[np.argsort(self.array['address'], kind='stable')])
+
+    ######################### Decoded columns. The address, goto_address and goto_counter are views into the table.
+    @property
+    def address(self):
+        return self.array['address']
+
+    @property
+    def goto_address(self):
+        return self.array['goto_address']
+
+    @property
+    def goto_counter(self):
+        return self.array['goto_counter']
+
+    @property
+    def duration(self):
+        return _unpack_uint_columns(self.array['duration'])
+
+    @property
+    def state(self):
+        '''The state of each instruction as an int, where the binary digits represent the output state of each channel.'''
+        return _unpack_uint_columns(self.array['state'])
+
+    @property
+    def channel_states(self):
+        '''The state of each instruction as a (N, 24) array of 0s and 1s, where the column index is the channel.'''
+        return np.unpackbits(np.ascontiguousarray(self.array['state']), axis=1, bitorder='little')
+
+    @property
+    def stop_and_wait(self):
+        return (self.array['tags'] >> 0 & 0b1).astype(np.bool_)
+
+    @property
+    def hardware_trig_out(self):
+        return (self.array['tags'] >> 1 & 0b1).astype(np.bool_)
+
+    @property
+    def notify_computer(self):
+        return (self.array['tags'] >> 2 & 0b1).astype(np.bool_)
+
+    @property
+    def powerline_sync(self):
+        return (self.array['tags'] >> 3 & 0b1).astype(np.bool_)
+
+
+def _unpack_uint_columns(byte_columns):
+    ''' Converts a (N, width) array of little endian bytes into a 1D uint64 array. '''
+    unpacked = np.zeros((byte_columns.shape[0], 8), dtype=np.uint8)
+    unpacked[:, :byte_columns.shape[1]] = byte_columns
+    return unpacked.view('<u8').ravel()
@@ -0,0 +1,139 @@
+import numpy as np
+from . import transcode
+from .instruction_table import InstructionTable, instruction_dtype
+
+
+class ProgramPatch():
+    '''
+    An encoded program that can be changed in place, a few fields at a time,
+    and written to the Pulse Gen by sending only the instructions that changed.
+
+    The instructions are kept in an image of the RAM, where the row index is
+    the address. `view` returns writable NumPy views of the encoded bytes of a
+    field, for one address or a slice of addresses, and the `set_*` methods
+    encode values into the fields of any addresses. The `set_*` methods mark
+    their addresses as dirty. The addresses of views are watched, and are
+    marked as dirty by `write` if their bytes differ from what was last
+    written. `write` sends only the dirty instructions.
+
+    Example
+    -------
+    program = ndpulsegen.ProgramPatch(instructions)
+    program.write(pg)                              # Sends every instruction
+    delay = program.view('duration', 5)            # The 6 bytes of the duration of address 5
+    for duration in scan_durations:
+        delay[:] = np.array([duration], dtype='<u8').view(np.uint8)[:6]
+        program.write(pg)                          # Sends only address 5
+        pg.write_action(trigger_now=True)
+    '''
+    # The fields that can be changed, and the range of values each can hold.
+    fields = {'duration':(1, 281474976710655), 'state':(0, 16777215), 'goto_address':(0, 8191), 'goto_counter':(0, 4294967295)}
+
+    def __init__(self, instructions, ram_size=8192):
+        if not isinstance(instructions, InstructionTable):
+            if isinstance(instructions, (list, tuple)):
+                instructions = b''.join(instructions)
+            instructions = InstructionTable.from_bytes(bytearray(instructions))
+        self.image = np.zeros(ram_size, dtype=instruction_dtype)
+        self.image['identifier'] = transcode.msgout_identifier['load_ram']
+        self.image['address'] = np.arange(ram_size)
+        self.present = np.zeros(ram_size, dtype=np.bool_)
+        self.image[instructions.address] = instructions.array
+        self.present[instructions.address] = True
+        # Nothing has been written yet, so every instruction is dirty.
+        self.dirty = self.present.copy()
+        # The addresses that views have been made of, and the bytes last written to each address.
+        self.watched = np.zeros(ram_size, dtype=np.bool_)
+        self.records = self.image.view(np.uint8).reshape(ram_size, instruction_dtype.itemsize)
+        self.written_records = np.zeros_like(self.records)
+
+    def __repr__(self):
+        return f'ProgramPatch({np.count_nonzero(self.present)} instructions, {np.count_nonzero(self.dirty)} dirty)'
+
+    @property
+    def instructions(self):
+        '''A copy of the current instructions, as an InstructionTable.'''
+        return InstructionTable(self.image[self.present])
+
+    @property
+    def dirty_addresses(self):
+        '''The addresses that the next call to `write` will send.'''
+        self.check_watched()
+        return np.flatnonzero(self.dirty)
+
+    def view(self, field, addresses):
+        '''
+        Returns a writable view of `field` ('duration', 'state', 'goto_address'
+        or 'goto_counter') of the instruction at an address, or of a slice of
+        addresses, and watches them for changes. The duration and state are the
+        raw little endian bytes (6 and 3 of them per instruction). The goto fields
+        are views as uint16 and uint32 integers, which are 0 dimensional for a
+        single address (write to them with `view[...] = value`). Nothing is checked when the
+        view is written to, so the values must be in range (see
+        `transcode.encode_instruction`).
+        '''
+        if field not in self.fields:
+            err_msg = f'\'field\' must be one of {list(self.fields)}, not {field!r}'
+            raise ValueError(err_msg)
+        if not isinstance(addresses, (int, np.integer, slice)):
+            err_msg = f'\'addresses\' must be an int or slice to get a view. Use the set_ methods to change scattered addresses'
+            raise TypeError(err_msg)
+        self.check_present(addresses)
+        self.watched[addresses] = True
+        # The trailing Ellipsis makes indexing with a single address return a 0 dimensional view rather than a scalar copy
+        return self.image[field][addresses, ...]
+
+    def set_duration(self, addresses, duration):
+        '''Sets the duration (in cycles) of the instructions at `addresses`, which may be an int, slice or array of addresses.'''
+        self.set_field('duration', addresses, duration)
+
+    def set_state(self, addresses, state):
+        '''Sets the state of the instructions at `addresses`. `state` can be in any format accepted by `transcode.states_multiformat_to_int`.'''
+        if isinstance(addresses, (int, np.integer)):
+            state = transcode.state_multiformat_to_int(state)
+        self.set_field('state', addresses, transcode.states_multiformat_to_int(state))
+
+    def set_goto(self, addresses, goto_address, goto_counter):
+        '''Sets the goto_address and goto_counter of the instructions at `addresses`.'''
+        self.set_field('goto_address', addresses, goto_address)
+        self.set_field('goto_counter', addresses, goto_counter)
+
+    def set_field(self, field, addresses, values):
+        minimum, maximum = self.fields[field]
+        values = transcode._integer_array(field, values, minimum, maximum)
+        single_address = isinstance(addresses, (int, np.integer))
+        if single_address and values.size != 1:
+            err_msg = f'\'{field}\' must be a single value for a single address'
+            raise ValueError(err_msg)
+        self.mark_dirty(addresses)
+        column = self.image[field]
+        if column.ndim == 2:
+            # Fields stored as bytes are packed little endian
+            values = values.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :column.shape[1]]
+        column[addresses] = values[0] if single_address else values
+
+    def mark_dirty(self, addresses):
+        '''Marks addresses as needing to be written, whether or not they have changed.'''
+        self.check_present(addresses)
+        self.dirty[addresses] = True
+
+    def check_present(self, addresses):
+        if not np.all(self.present[addresses]):
+            err_msg = f'The program has no instruction at some of the addresses {addresses}'
+            raise ValueError(err_msg)
+
+    def check_watched(self):
+        # Watched addresses that have been changed through a view since they were last written are dirty.
+        watched_addresses = np.flatnonzero(self.watched & ~self.dirty)
+        changed = np.any(self.records[watched_addresses] != self.written_records[watched_addresses], axis=1)
+        self.dirty[watched_addresses[changed]] = True
+
+    def write(self, pg):
+        '''Writes the dirty instructions to the Pulse Gen `pg` in a single write, and returns how many were sent.'''
+        self.check_watched()
+        dirty_addresses = np.flatnonzero(self.dirty)
+        if dirty_addresses.size:
+            pg.write_instructions(self.records[dirty_addresses].tobytes())
+            self.written_records[dirty_addresses] = self.records[dirty_addresses]
+            self.dirty[dirty_addresses] = False
+        return dirty_addresses.size
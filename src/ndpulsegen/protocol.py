@@ -0,0 +1,309 @@
+'''
+The layout of every message sent to and from the Pulse Gen, in one schema, and
+the codecs that are generated from it.
+
+Each message is an identifier byte followed by a fixed number of bytes of
+fields. `schema` gives the identifier of each message type and the byte offset
+(not including the identifier) and width of each of its fields. A field that
+packs several values into its bits (eg tags) also lists the bit offset and
+width of each value. From the schema, a `MessageCodec` is made for every
+message type, with:
+    pack(*values)           Encodes one message (including its identifier) from
+                            the value of every field, using a precompiled
+                            struct.Struct. Values are not checked, beyond what
+                            struct.pack checks.
+    unpack(message)         Decodes the bytes of one message (not including its
+                            identifier) into a tuple of the value of every field.
+    pack_arrays(**values)   Encodes many messages at once from arrays of values,
+                            into a NumPy structured array with the same memory
+                            layout as the messages.
+    unpack_arrays(messages) Decodes many messages at once (including their
+                            identifiers) into a dict of uint64 arrays.
+    layout_table()          The bitwise layout of the message, as text.
+The values of a field with bits are the values in its bits, in the order they
+are listed, rather than the field itself.
+
+Adding a new message (or changing one) only needs its entry in `schema`.
+`transcode` decides what the values mean (eg looking up strings and checking
+ranges).
+
+Run with:
+    python -m ndpulsegen.protocol                           # print the layout of every message
+'''
+import struct
+import numpy as np
+
+# 'in' messages are sent by the Pulse Gen, and 'out' messages are sent to it. Each field is (name, byte offset, width in bytes), or
+# (name, byte offset, width in bytes, [(name, bit offset, width in bits), ...]) for a field made of bits.
+schema = {
+    'in':{
+        'error':{'identifier':100, 'fields':[
+            ('tags',                    0,  1,  [('invalid_identifier_received', 0, 1), ('timeout_waiting_to_receive_message', 1, 1), ('received_message_not_forwarded', 2, 1)]),
+            ('error_info',              1,  1),
+            ]},
+        'echo':{'identifier':101, 'fields':[
+            ('echoed_byte',             0,  1),
+            ('device_type',             1,  1),
+            ('hardware_version',        2,  1),
+            ('firmware_version',        3,  2),
+            ('serial_number',           5,  3),
+            ]},
+        'print':{'identifier':102, 'fields':[
+            ('message',                 0,  8),
+            ]},
+        'devicestate':{'identifier':103, 'fields':[
+            ('state',                   0,  3),
+            ('final_ram_address',       3,  2),
+            ('trigger_out_delay',       5,  7),
+            ('trigger_out_length',      12, 1),
+            ('current_address',         13, 2),
+            ('tags',                    15, 2,  [('run_mode', 0, 1), ('trigger_source', 1, 2), ('notify_on_main_trig_out', 3, 1), ('clock_source', 4, 1), ('running', 5, 1),
+                                                ('software_run_enable', 6, 1), ('hardware_run_enable', 7, 1), ('notify_on_run_finished', 8, 1)]),
+            ]},
+        'notification':{'identifier':104, 'fields':[
+            ('address',                 0,  2),
+            ('tags',                    2,  1,  [('address_notify', 0, 1), ('trigger_notify', 1, 1), ('finished_notify', 2, 1)]),
+            ]},
+        'powerlinestate':{'identifier':105, 'fields':[
+            ('tags',                    0,  1,  [('trig_on_powerline', 0, 1), ('powerline_locked', 1, 1)]),
+            ('powerline_period',        1,  3),
+            ('powerline_trigger_delay', 4,  3),
+            ]},
+        },
+    'out':{
+        'echo':{'identifier':150, 'fields':[
+            ('byte_to_echo',            0,  1),
+            ]},
+        'load_ram':{'identifier':151, 'fields':[
+            ('address',                 0,  2),
+            ('state',                   2,  3),
+            ('duration',                5,  6),
+            ('goto_address',            11, 2),
+            ('goto_counter',            13, 4),
+            ('tags',                    17, 1,  [('stop_and_wait', 0, 1), ('hardware_trig_out', 1, 1), ('notify_computer', 2, 1), ('powerline_sync', 3, 1)]),
+            ]},
+        'action_request':{'identifier':152, 'fields':[
+            ('tags',                    0,  1,  [('trigger_now', 0, 1), ('request_state', 1, 1), ('request_powerline_state', 2, 1), ('disable_after_current_run', 3, 1), ('reset_run', 4, 1)]),
+            ]},
+        'general_input':{'identifier':153, 'fields':[
+            ('message',                 0,  8),
+            ]},
+        # Settings with 2 or 3 bits are the setting followed by a flag to update it. The other update flags are for the fields of the same name.
+        'device_options':{'identifier':154, 'fields':[
+            ('final_ram_address',       0,  2),
+            ('trigger_out_delay',       2,  7),
+            ('trigger_out_length',      9,  1),
+            ('tags',                    10, 2,  [('run_mode', 0, 2), ('trigger_source', 2, 3), ('notify_on_main_trig_out', 5, 2), ('update_final_ram_address', 7, 1),
+                                                ('update_trigger_out_delay', 8, 1), ('update_trigger_out_length', 9, 1), ('software_run_enable', 10, 2), ('notify_when_run_finished', 12, 2)]),
+            ]},
+        'set_static_state':{'identifier':155, 'fields':[
+            ('state',                   0,  3),
+            ]},
+        'powerline_trigger_options':{'identifier':156, 'fields':[
+            ('powerline_trigger_delay', 0,  3),
+            ('tags',                    3,  1,  [('update_powerline_trigger_delay', 0, 1), ('trigger_on_powerline', 1, 2)]),
+            ]},
+        },
+    }
+
+# The struct format and NumPy dtype of fields of each width that has a standard integer type. Other widths are split into several of these.
+_struct_formats = {8:'Q', 4:'I', 2:'H', 1:'B'}
+_dtype_formats = {8:'<u8', 4:'<u4', 2:'<u2', 1:'u1'}
+
+
+class MessageCodec():
+    '''
+    Encodes and decodes one type of message, using the layout of the message in
+    `schema`. See the module docstring for what each method does. The source of
+    the generated pack and unpack functions is in `source`.
+    '''
+    def __init__(self, message_type, direction, identifier, fields):
+        self.message_type = message_type
+        self.direction = direction
+        self.identifier = identifier
+        self.fields = [(field[0], field[1], field[2], field[3] if len(field) > 3 else None) for field in sorted(fields, key=lambda field: field[1])]
+        # The names of the values that are packed and unpacked, in order
+        self.value_names = []
+        for name, offset, width, bits in self.fields:
+            self.value_names.extend([name] if bits is None else [bit_name for bit_name, bit_offset, bit_width in bits])
+        if len(set(self.value_names)) != len(self.value_names):
+            err_msg = f'The values of the {direction} message {message_type!r} must have unique names'
+            raise ValueError(err_msg)
+        self.length = 1 + max(offset + width for name, offset, width, bits in self.fields)
+        self.dtype = np.dtype({
+            'names':    ['identifier'] + [name for name, offset, width, bits in self.fields],
+            'formats':  ['u1'] + [_dtype_formats.get(width, ('u1', width)) for name, offset, width, bits in self.fields],
+            'offsets':  [0] + [1 + offset for name, offset, width, bits in self.fields],
+            'itemsize': self.length,
+            })
+        payload_format, self.source = self.generate_source()
+        self.struct = struct.Struct('<B' + payload_format)
+        self.payload_struct = struct.Struct('<' + payload_format)
+        # The generated functions only call the precompiled structs, so they are as fast as functions written by hand for this message type.
+        namespace = {'_pack':self.struct.pack, '_unpack_from':self.payload_struct.unpack_from}
+        exec(compile(self.source, f'<{direction} message {message_type}>', 'exec'), namespace)
+        self.pack = namespace['pack']
+        self.unpack = namespace['unpack']
+
+    def __repr__(self):
+        return f'MessageCodec({self.message_type!r}, {self.direction!r}, identifier={self.identifier}, length={self.length})'
+
+    def generate_source(self):
+        # Returns the struct format of the message (not including the identifier), and the source of the pack and unpack functions. Fields
+        # that aren't a standard integer width are split into several items of the struct (eg 7 bytes is 4, 2 and 1).
+        payload_format = ''
+        position = 0
+        pack_lines = []
+        pack_arguments = [str(self.identifier)]
+        unpack_lines = []
+        unpack_names = []
+        unpack_values = []
+        for index, (name, offset, width, bits) in enumerate(self.fields):
+            if offset < position:
+                err_msg = f'The field {name!r} of the {self.direction} message {self.message_type!r} overlaps the field before it'
+                raise ValueError(err_msg)
+            pieces = _split_width(width)
+            payload_format += 'x'*(offset - position) + ''.join(_struct_formats[piece_width] for piece_width, shift in pieces)
+            position = offset + width
+            # Packing
+            value = name
+            if bits is not None:
+                value = f'_field{index}'
+                pack_lines.append(f'    {value} = ' + ' | '.join(_shifted(bit_name, '<<', bit_offset) for bit_name, bit_offset, bit_width in bits))
+            for piece_index, (piece_width, shift) in enumerate(pieces):
+                # The most significant piece isn't masked, so struct.pack raises an error if the value is too big for the field.
+                if piece_index == len(pieces) - 1:
+                    pack_arguments.append(_shifted(value, '>>', shift))
+                else:
+                    pack_arguments.append(f'({_shifted(value, ">>", shift)} & {(1 << 8*piece_width) - 1})')
+            # Unpacking
+            piece_names = [f'_field{index}'] if len(pieces) == 1 else [f'_field{index}_{piece_index}' for piece_index in range(len(pieces))]
+            unpack_names.extend(piece_names)
+            value = ' | '.join(_shifted(piece_name, '<<', shift) for piece_name, (piece_width, shift) in zip(piece_names, pieces))
+            if bits is None:
+                unpack_values.append(value)
+                continue
+            if len(pieces) > 1:
+                unpack_lines.append(f'    _field{index} = {value}')
+                value = f'_field{index}'
+            for bit_name, bit_offset, bit_width in bits:
+                unpack_values.append(f'({_shifted(value, ">>", bit_offset)} & {(1 << bit_width) - 1})')
+        source = '\n'.join([
+            f'def pack({", ".join(self.value_names)}):',
+            *pack_lines,
+            f'    return _pack({", ".join(pack_arguments)})',
+            '',
+            'def unpack(message):',
+            f'    {", ".join(unpack_names)}, = _unpack_from(message)',
+            *unpack_lines,
+            f'    return ({", ".join(unpack_values)},)',
+            ''])
+        return payload_format, source
+
+    def pack_arrays(self, **values):
+        '''
+        Encodes many messages at once. Each keyword is the name of a value (see
+        `value_names`), and is an int or an array of ints, with one element per
+        message. Values that aren't given are 0. Returns a structured array with
+        dtype `dtype`, which has the memory layout of the encoded messages, so
+        `.tobytes()` gives the messages ready to be sent.
+        '''
+        unknown_names = set(values) - set(self.value_names)
+        if unknown_names:
+            err_msg = f'The {self.direction} message {self.message_type!r} has no values named {sorted(unknown_names)}'
+            raise TypeError(err_msg)
+        arrays = np.broadcast_arrays(*(np.atleast_1d(np.asarray(values.get(name, 0), dtype=np.uint64)) for name in self.value_names))
+        values = dict(zip(self.value_names, arrays))
+        encoded = np.zeros(arrays[0].size, dtype=self.dtype)
+        encoded['identifier'] = self.identifier
+        for name, offset, width, bits in self.fields:
+            if bits is None:
+                value = values[name].ravel()
+            else:
+                value = np.zeros(encoded.size, dtype=np.uint64)
+                for bit_name, bit_offset, bit_width in bits:
+                    value |= values[bit_name].ravel() << np.uint64(bit_offset)
+            if width in _dtype_formats:
+                encoded[name] = value
+            else:
+                encoded[name] = value.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :width]
+        return encoded
+
+    def unpack_arrays(self, messages):
+        '''
+        Decodes many messages at once. `messages` is either a bytes-like object
+        of encoded messages (including their identifiers) joined together, which
+        is checked and viewed without copying, or a structured array with dtype
+        `dtype`. Returns a dict mapping the name of each value (see
+        `value_names`) to a uint64 array with one element per message.
+        '''
+        if not (isinstance(messages, np.ndarray) and messages.dtype == self.dtype):
+            messages = np.frombuffer(messages, dtype=np.uint8)
+            if messages.size % self.length != 0:
+                err_msg = f'\'messages\' must have a length that is a multiple of {self.length}, not {messages.size}'
+                raise ValueError(err_msg)
+            messages = messages.view(self.dtype)
+            if np.any(messages['identifier'] != self.identifier):
+                err_msg = f'\'messages\' contains messages that are not {self.direction} {self.message_type!r} messages'
+                raise ValueError(err_msg)
+        values = {}
+        for name, offset, width, bits in self.fields:
+            if width in _dtype_formats:
+                value = messages[name].astype(np.uint64)
+            else:
+                padded = np.zeros((messages.size, 8), dtype=np.uint8)
+                padded[:, :width] = messages[name]
+                value = padded.view('<u8').ravel().astype(np.uint64)
+            if bits is None:
+                values[name] = value
+                continue
+            for bit_name, bit_offset, bit_width in bits:
+                values[bit_name] = (value >> np.uint64(bit_offset)) & np.uint64((1 << bit_width) - 1)
+        return values
+
+    def layout_table(self):
+        '''The bitwise layout of the message, as in the notes of the transcode functions. The FPGA INDEX is the bit index in Lucid HDL.'''
+        lines = [f'Message{self.direction} identifier:  1 byte: {self.identifier}', f'{"Message format:":<44}BITS USED   FPGA INDEX.']
+        for name, offset, width, bits in self.fields:
+            byte_range = f'[{offset}]' if width == 1 else f'[{offset}:{offset + width}]'
+            bits_used = 8*width if bits is None else max(bit_offset + bit_width for bit_name, bit_offset, bit_width in bits)
+            lines.append(f'{name + ":":<28}{_plural(width, "byte"):<8}{byte_range:<8}{_plural(bits_used, "bit"):<12}{_bit_index(8*offset, bits_used)}')
+            for bit_name, bit_offset, bit_width in bits or []:
+                lines.append(f'    {bit_name:<40}{_plural(bit_width, "bit"):<12}{_bit_index(8*offset + bit_offset, bit_width)}')
+        return '\n'.join(lines)
+
+
+def _split_width(width):
+    # The widths of the standard integers that a field of "width" bytes is split into, and how far each is shifted, least significant first
+    pieces = []
+    shift = 0
+    while width:
+        piece_width = max(size for size in _struct_formats if size <= width)
+        pieces.append((piece_width, shift))
+        shift += 8*piece_width
+        width -= piece_width
+    return pieces
+
+def _shifted(value, operator, shift):
+    return value if shift == 0 else f'({value} {operator} {shift})'
+
+def _plural(number, unit):
+    return f'{number} {unit}' if number == 1 else f'{number} {unit}s'
+
+def _bit_index(index, width):
+    return f'[{index}]' if width == 1 else f'[{index}+:{width}]'
+
+def layout_tables():
+    '''The bitwise layout of every message, as text.'''
+    tables = []
+    for direction, codecs in (('in', msgin_codecs), ('out', msgout_codecs)):
+        for message_type, codec in codecs.items():
+            tables.append(f'{message_type} ({"sent by" if direction == "in" else "sent to"} the Pulse Gen)\n{codec.layout_table()}')
+    return '\n\n'.join(tables)
+
+
+msgin_codecs = {message_type:MessageCodec(message_type, 'in', **layout) for message_type, layout in schema['in'].items()}
+msgout_codecs = {message_type:MessageCodec(message_type, 'out', **layout) for message_type, layout in schema['out'].items()}
+
+if __name__ == '__main__':
+    print(layout_tables())
@@ -0,0 +1,156 @@
+import threading
+import time
+import numpy as np
+from . import protocol
+from . import transcode
+
+# The columns recorded for every sample, and their dtypes.
+column_dtypes = {'timestamp':np.float64, 'current_address':np.uint16, 'state':np.uint32, 'running':np.bool_,
+    'software_run_enable':np.bool_, 'hardware_run_enable':np.bool_, 'final_ram_address':np.uint16}
+
+_unpack_devicestate = protocol.msgin_codecs['devicestate'].unpack
+
+
+class StateSampler():
+    '''
+    Samples the state of a Pulse Gen at a steady rate, keeping several
+    request_state actions in flight at once so the rate isn't limited by the
+    round trip time. Replies are decoded straight from the encoded devicestate
+    message into preallocated NumPy columns, with no dictionary per sample.
+
+    The columns are 'timestamp' (the time.time() that the reply was received),
+    'current_address', 'state' (an int where the binary digits are the output
+    state of each channel, as in transcode.encode_instruction), 'running',
+    'software_run_enable', 'hardware_run_enable' and 'final_ram_address'.
+    They are kept in a ring buffer of `capacity` + `margin` samples. Each
+    sample is written twice, a ring length apart, so the latest samples are
+    always contiguous, and `snapshot` returns views of up to `capacity` of them
+    without copying. The samples after a snapshot are written to the `margin`
+    rows that aren't in it, so a snapshot stays valid until `margin` more
+    samples have been recorded (65 s at 1 kHz with the defaults).
+
+    The replies to the sampler's requests are not put in the message queues,
+    and are not passed to subscribers. get_state can still be used at the same
+    time, and gets its own replies.
+
+    Example
+    -------
+    with ndpulsegen.StateSampler(pg, rate=2000) as sampler:
+        time.sleep(1)
+        samples = sampler.snapshot()
+        print(samples['timestamp'].size, samples['current_address'])
+    '''
+    def __init__(self, pg, rate=1000.0, capacity=65536, max_in_flight=16, margin=None):
+        self.pg = pg
+        # Requests per second. None sends a new request as soon as one of the max_in_flight requests is answered.
+        self.rate = rate
+        self.capacity = capacity
+        self.margin = capacity if margin is None else margin
+        self.ring_size = capacity + self.margin
+        self.max_in_flight = max_in_flight
+        self.columns = {name:np.zeros(2*self.ring_size, dtype=dtype) for name, dtype in column_dtypes.items()}
+        # The total number of samples recorded, and requests that were never answered.
+        self.sample_number = 0
+        self.lost_number = 0
+        self.in_flight = threading.Semaphore(max_in_flight)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.request_command = transcode.encode_action(request_state=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        return f'StateSampler({self.sample_number} samples, {self.lost_number} lost)'
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.pg.add_raw_message_type('devicestate')
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.send_requests, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        '''Stops sending requests, and waits up to `timeout` seconds for the requests in flight to be answered. Does nothing if the sampler isn't running.'''
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        deadline = time.perf_counter() + timeout
+        acquired = 0
+        while acquired < self.max_in_flight and self.in_flight.acquire(timeout=max(deadline - time.perf_counter(), 0)):
+            acquired += 1
+        for request in range(acquired):
+            self.in_flight.release()
+        self.pg.remove_raw_message_type('devicestate')
+
+    def send_requests(self):
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            if self.rate is not None:
+                next_time += 1/self.rate
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Don't try to catch up on samples that couldn't be sent in time
+                    next_time -= delay
+            # Wait for a request to be answered (or expire) if too many are in flight
+            while not self.in_flight.acquire(timeout=0.1):
+                if self.stop_event.is_set():
+                    return
+            self.pg.write_request(self.request_command, [('devicestate', self)])
+
+    ######################### Called by the PulseGenerator's monitor thread
+    def set_raw_result(self, message, timestamp):
+        # "message" is the encoded devicestate message (see transcode.decode_devicestate)
+        (state, final_ram_address, trigger_out_delay, trigger_out_length, current_address, run_mode, trigger_source, notify_on_main_trig_out, clock_source,
+            running, software_run_enable, hardware_run_enable, notify_on_run_finished) = _unpack_devicestate(message)
+        self.record(timestamp, current_address, state, running, software_run_enable, hardware_run_enable, final_ram_address)
+
+    def set_result(self, message):
+        # Used if the reply was decoded before the sampler was stopped
+        state = int.from_bytes(np.packbits(message['state'], bitorder='little').tobytes(), 'little')
+        self.record(message['timestamp'], message['current_address'], state, message['running'], message['software_run_enable'],
+            message['hardware_run_enable'], message['final_ram_address'])
+
+    def set_exception(self, exception):
+        self.lost_number += 1
+        self.in_flight.release()
+
+    def record(self, *values):
+        index = self.sample_number % self.ring_size
+        for column, value in zip(self.columns.values(), values):
+            column[index] = value
+            column[index + self.ring_size] = value
+        self.sample_number += 1
+        self.in_flight.release()
+
+    ######################### For consumers
+    def snapshot(self, sample_number=None):
+        '''
+        Returns a dictionary of views of each column, holding the samples
+        recorded since sample number `sample_number` (or as many of the last
+        `capacity` samples as have been recorded). Pass the returned
+        'sample_number' back in to get only the samples recorded since then.
+        The views are overwritten as more samples are recorded, so copy them if
+        they will be needed after another `margin` samples.
+        '''
+        end = self.sample_number
+        start = max(end - self.capacity, 0 if sample_number is None else sample_number)
+        first_index = start % self.ring_size
+        snapshot = {name:column[first_index:first_index + end - start] for name, column in self.columns.items()}
+        snapshot['sample_number'] = end
+        return snapshot
+
+    @property
+    def channel_states(self):
+        '''The states of the last `capacity` samples, as a (N, 24) array of 0s and 1s, where the column index is the channel.'''
+        states = self.snapshot()['state']
+        return np.unpackbits(states.astype('<u4').view(np.uint8).reshape(-1, 4)[:, :3], axis=1, bitorder='little')
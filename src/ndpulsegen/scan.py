@@ -0,0 +1,169 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+from .instruction_table import InstructionTable
+
+
+def compile_scan(template, parameter_grid, workers=None, cache=None, max_pending=None):
+    '''
+    Compiles every variant of a parameter scan in a pool of processes, and
+    yields the results in order while the rest are still being compiled.
+
+    Parameters
+    ----------
+    template : callable
+        Called as template(**parameters) for each variant, and returns its
+        encoded instructions (an InstructionTable, a bytes-like object, or a
+        list or tuple of encoded instructions). It is run in other processes,
+        so it must be picklable (eg a function defined at the top level of a
+        module, or a functools.partial of one).
+    parameter_grid : dict or iterable of dicts
+        Either a dictionary mapping each parameter name to a sequence of values,
+        in which case every combination is compiled (with the last parameter
+        changing fastest), or an iterable of dictionaries of parameters, one
+        per variant.
+    workers : int, optional
+        The number of processes. Defaults to the number of CPUs. If 1, every
+        variant is compiled in this process.
+    cache : CompileCache, optional
+        If given, variants that are in the cache are not compiled, and the
+        rest are added to it.
+    max_pending : int, optional
+        The most variants that are compiled ahead of the one being yielded.
+        Defaults to 4 per worker. Limits the memory used while the results are
+        consumed more slowly than they are compiled.
+
+    Yields
+    ------
+    (dict, InstructionTable)
+        The parameters of each variant and its instructions, in the order of
+        `parameter_grid`.
+
+    Notes
+    -----
+    Each worker joins the encoded instructions of a variant into one buffer
+    and returns it in a block of shared memory, so only its name and length
+    are pickled. The block is copied into the InstructionTable and released as
+    soon as it is received. On Windows, where a block is destroyed as soon as
+    the worker closes it, and on Python 3.7, which has no shared memory, the
+    joined buffer is returned as bytes instead.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4*workers
+    variants = _iterate_variants(parameter_grid)
+    if workers == 1:
+        for parameters in variants:
+            yield parameters, _compile_cached(template, parameters, cache, lambda: InstructionTable.from_bytes(bytearray(_join_instructions(template(**parameters)))))
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_set_template, initargs=(template,)) as executor:
+        pending = collections.deque()
+        try:
+            for parameters in variants:
+                pending.append((parameters, _submit(executor, template, parameters, cache)))
+                while len(pending) > max_pending or (pending and pending[0][1].done()):
+                    yield _receive(template, *pending.popleft(), cache)
+            while pending:
+                yield _receive(template, *pending.popleft(), cache)
+        finally:
+            # If the caller stops early, nothing more is compiled, and any blocks already made are released.
+            for parameters, future in pending:
+                future.cancel()
+            for parameters, future in pending:
+                if not future.cancelled() and future.exception() is None and isinstance(future.result(), tuple):
+                    _release(*future.result())
+
+
+def _iterate_variants(parameter_grid):
+    if isinstance(parameter_grid, dict):
+        names = list(parameter_grid.keys())
+        for values in itertools.product(*parameter_grid.values()):
+            yield dict(zip(names, values))
+    else:
+        yield from parameter_grid
+
+def _compile_cached(template, parameters, cache, compile_variant):
+    if cache is None:
+        return compile_variant()
+    key = cache.key(template, **parameters)
+    instructions = cache.get(key)
+    if instructions is not None:
+        cache.hits += 1
+        return instructions
+    cache.misses += 1
+    return cache.put(key, compile_variant())
+
+def _submit(executor, template, parameters, cache):
+    # Returns a future, or the InstructionTable if the variant is in the cache.
+    if cache is not None:
+        instructions = cache.get(cache.key(template, **parameters))
+        if instructions is not None:
+            cache.hits += 1
+            future = concurrent.futures.Future()
+            future.set_result(instructions)
+            return future
+    return executor.submit(_compile_variant, parameters)
+
+def _receive(template, parameters, future, cache):
+    result = future.result()
+    if isinstance(result, InstructionTable):
+        return parameters, result
+    if isinstance(result, bytes):
+        instructions = InstructionTable.from_bytes(bytearray(result))
+    else:
+        from multiprocessing import shared_memory   # Workers only return blocks when it can be imported
+        name, size = result
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            instructions = InstructionTable.from_bytes(bytearray(block.buf[:size]))
+        finally:
+            block.close()
+            block.unlink()
+    if cache is not None:
+        cache.misses += 1
+        instructions = cache.put(cache.key(template, **parameters), instructions)
+    return parameters, instructions
+
+def _release(name, size):
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=name)
+    block.close()
+    block.unlink()
+
+def _join_instructions(instructions):
+    # The same formats as PulseGenerator.join_instructions
+    if isinstance(instructions, InstructionTable):
+        return instructions.buffer
+    elif isinstance(instructions, (list, tuple)):
+        return b''.join(instructions)
+    return instructions
+
+######################### Run in the worker processes
+_template = None
+
+def _set_template(template):
+    # The template is sent to each worker once, rather than with every variant.
+    global _template
+    _template = template
+
+def _compile_variant(parameters):
+    encoded = memoryview(_join_instructions(_template(**parameters))).cast('B')
+    if os.name != 'posix':
+        return encoded.tobytes()
+    try:
+        from multiprocessing import resource_tracker, shared_memory
+    except ImportError as ex:
+        # Shared memory is new in Python 3.8
+        return encoded.tobytes()
+    # Shared memory blocks can't be empty
+    block = shared_memory.SharedMemory(create=True, size=max(encoded.nbytes, 1))
+    # The parent process unlinks the block once it has been copied. Otherwise the worker's resource tracker would unlink it when the worker exits.
+    # The tracker knows the block by its POSIX name, which is `name` with a leading slash.
+    resource_tracker.unregister('/' + block.name, 'shared_memory')
+    try:
+        block.buf[:encoded.nbytes] = encoded
+        return block.name, encoded.nbytes
+    finally:
+        block.close()
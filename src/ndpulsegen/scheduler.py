@@ -0,0 +1,178 @@
+import collections
+import queue
+import time
+import numpy as np
+from .instruction_table import InstructionTable
+from .simulate import simulate_run
+
+
+class Shot():
+    '''A program queued in a ShotScheduler. Made by ShotScheduler.add_shot.'''
+    def __init__(self, instructions, final_ram_address, device_options, timeout):
+        self.instructions = instructions
+        self.final_ram_address = final_ram_address
+        self.device_options = device_options
+        simulation = simulate_run(instructions, final_ram_address)
+        self.duration = simulation.total_duration
+        self.timeout = timeout
+        # The addresses this shot executes. Every other address can be written to while it runs.
+        self.executed = simulation.execution_counts > 0
+        # When the notification from address a arrives, the run will never again execute an address below safe_below[a], because no
+        # instruction at or after a jumps back past it.
+        jump_targets = np.full(self.executed.size, self.executed.size, dtype=np.int64)
+        looping = instructions.goto_counter > 0
+        jump_targets[instructions.address[looping]] = instructions.goto_address[looping]
+        self.safe_below = np.minimum(np.arange(self.executed.size), np.minimum.accumulate(jump_targets[::-1])[::-1])
+
+
+class ShotScheduler():
+    '''
+    Runs a queue of programs ("shots") one after another, uploading each shot
+    while the one before it is still running, so the dead time between shots
+    is not spent waiting for uploads.
+
+    While a shot runs, the instructions of the next shot are written straight
+    away to every address the running shot doesn't use. Addresses it does use
+    are written once a notification (from an instruction with
+    notify_computer=True) shows the run has moved past them for good. Only the
+    instructions that aren't already known to be in the RAM are sent (see
+    PulseGenerator.write_program). When the finished notification arrives, the
+    rest of the next shot is written, then any device options that changed, and
+    the next shot is triggered. Shots with more instructions tagged with
+    notify_computer overlap more of their upload with the previous shot.
+
+    To avoid the problems shown in examples.py put_into_and_recover_from_erroneous_state:
+    - The final_ram_address and other device options are only changed between
+      runs, never while a shot is running.
+    - An instruction is never overwritten while the running shot could still
+      execute it (including by jumping back to it with a goto_address).
+    - Every shot must only execute addresses that it contains, and end at its
+      final_ram_address. This is checked with simulate_run when it is added.
+    - Shots run in 'single' run_mode, with notify_when_run_finished=True.
+    If a shot doesn't finish in time, reset_run is sent (so the whole of the
+    next shot will be uploaded again) and a TimeoutError is raised.
+
+    Notifications are received with PulseGenerator.subscribe, so they still
+    appear in the message queues as usual. Must be used with a PulseGenerator,
+    not an AsyncPulseGenerator.
+
+    Example
+    -------
+    scheduler = ndpulsegen.ShotScheduler(pg)
+    for instructions in programs:
+        scheduler.add_shot(instructions)
+    for result in scheduler.run():
+        print(result['dead_time'])
+    '''
+    def __init__(self, pg, software_trigger=True, timeout_margin=1.0):
+        self.pg = pg
+        self.software_trigger = software_trigger
+        self.timeout_margin = timeout_margin
+        self.shots = collections.deque()
+        self.notifications = queue.Queue()
+        # The device options as they were last written by the scheduler.
+        self.device_options = {}
+        self.ram_addresses = np.arange(pg.ram_shadow.shape[0])
+
+    def add_shot(self, instructions, final_ram_address=None, timeout=None, **device_options):
+        '''
+        Adds a shot to the end of the queue, and returns it. "instructions" can
+        be in any of the formats accepted by PulseGenerator.write_instructions.
+        "final_ram_address" defaults to the highest address in the shot. Other
+        keyword arguments are passed to write_device_options before the shot is
+        triggered. "timeout" is how long to wait for the shot to finish after it
+        is triggered, in seconds. It defaults to the duration of the shot plus
+        timeout_margin, or forever if the shot contains stop_and_wait or
+        powerline_sync instructions.
+        '''
+        for option in ('run_mode', 'notify_when_run_finished'):
+            if option in device_options:
+                err_msg = f'\'{option}\' is set by the ShotScheduler, and cannot be given for a shot'
+                raise ValueError(err_msg)
+        instructions = InstructionTable.from_bytes(bytearray(self.pg.join_instructions(instructions))).sort_by_address()
+        if np.any(np.diff(instructions.address.astype(np.int64)) == 0):
+            err_msg = f'\'instructions\' contains more than one instruction for the same address'
+            raise ValueError(err_msg)
+        if final_ram_address is None:
+            final_ram_address = int(instructions.address.max())
+        shot = Shot(instructions, final_ram_address, device_options, timeout)
+        if timeout is None and not np.any(instructions.stop_and_wait | instructions.powerline_sync):
+            shot.timeout = shot.duration*10E-9 + self.timeout_margin
+        self.shots.append(shot)
+        return shot
+
+    def run(self):
+        '''
+        Runs every queued shot, including shots added while running. Each time
+        a shot has finished (and the next one has been triggered), yields a
+        dictionary containing the 'finished' notification, 'preloaded' (the
+        number of instructions of the shot written while the previous shot was
+        running), 'uploaded' (the number written between the two shots) and
+        'dead_time' (the time in seconds between receiving the previous shot's
+        finished notification and triggering the shot, None for the first shot).
+        '''
+        # Notifications from before the scheduler started say nothing about its shots
+        self.notifications.queue.clear()
+        self.pg.subscribe('notification', self.notifications.put)
+        try:
+            running = None
+            result = None
+            while self.shots or running is not None:
+                shot = self.shots.popleft() if self.shots else None
+                preloaded = 0
+                if shot is not None:
+                    pending = np.ones(len(shot.instructions), dtype=np.bool_)
+                if running is not None:
+                    if shot is not None:
+                        # Addresses the running shot never executes can be written straight away
+                        preloaded += self.write_pending(shot, pending, ~running.executed)
+                    result['finished'], preloaded_while_running = self.wait_for_finish(running, shot, pending)
+                    preloaded += preloaded_while_running
+                    if shot is None:
+                        yield result
+                        break
+                uploaded = self.write_pending(shot, pending, np.ones(self.ram_addresses.size, dtype=np.bool_))
+                self.write_device_options(shot)
+                if self.software_trigger:
+                    self.pg.write_action(trigger_now=True)
+                shot.triggered_at = time.time()
+                dead_time = None if running is None else shot.triggered_at - result['finished']['timestamp']
+                if running is not None:
+                    yield result
+                running = shot
+                result = {'finished':None, 'preloaded':preloaded, 'uploaded':uploaded, 'dead_time':dead_time}
+        finally:
+            self.pg.unsubscribe('notification', self.notifications.put)
+
+    def write_pending(self, shot, pending, writable_addresses):
+        # Writes the instructions of "shot" that haven't been written yet, and whose address is writable. Returns the number sent.
+        to_write = pending & writable_addresses[shot.instructions.address]
+        if not np.any(to_write):
+            return 0
+        pending &= ~to_write
+        return self.pg.write_program(shot.instructions[to_write], delta=True)
+
+    def wait_for_finish(self, running, shot, pending):
+        # Waits for the running shot to finish, writing instructions of the next shot as the run moves past their addresses.
+        preloaded = 0
+        while True:
+            timeout_remaining = None if running.timeout is None else max(running.timeout - (time.time() - running.triggered_at), 0.0)
+            try:
+                notification = self.notifications.get(timeout=timeout_remaining)
+            except queue.Empty as ex:
+                # The run is in an unknown state. Stop it, which also means all instructions must be uploaded again.
+                self.pg.write_action(reset_run=True)
+                err_msg = f'The shot did not finish within {running.timeout} s of being triggered'
+                raise TimeoutError(err_msg)
+            if notification['finished_notify']:
+                return notification, preloaded
+            if notification['address_notify'] and shot is not None and np.any(pending):
+                preloaded += self.write_pending(shot, pending, self.ram_addresses < running.safe_below[notification['address']])
+
+    def write_device_options(self, shot):
+        # Only options that differ from what the scheduler last wrote are sent
+        device_options = dict(shot.device_options, final_ram_address=shot.final_ram_address, run_mode='single', notify_when_run_finished=True)
+        changed = {option:value for option, value in device_options.items() if option not in self.device_options or self.device_options[option] != value}
+        if changed:
+            self.pg.write_device_options(**changed)
+            self.device_options.update(changed)
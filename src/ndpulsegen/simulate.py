@@ -0,0 +1,218 @@
+import bisect
+import numpy as np
+from . import transcode
+from .instruction_table import InstructionTable
+
+
+def simulate_run(instructions, final_ram_address=None, max_steps=10000000):
+    '''
+    Simulates the order in which the Pulse Gen executes instructions during a
+    run, without uploading them. Loops made with `goto_address` and
+    `goto_counter` are never unrolled. The first time a loop body repeats with
+    every other goto_counter in the same state, the remaining repeats are known
+    to be identical, so they are recorded as a single repeated block. The cost
+    of a simulation therefore depends on the structure of the program, not how
+    long it runs for.
+
+    Parameters
+    ----------
+    instructions : InstructionTable, bytes-like, or list of bytes
+        The encoded instructions (see `transcode.encode_instruction`).
+    final_ram_address : int, optional
+        The `final_ram_address` device setting used for the run. Defaults to the
+        highest address in `instructions`.
+    max_steps : int, optional
+        The maximum number of jumps and fall throughs that are simulated before
+        giving up. Only reached by programs whose loops never settle into a
+        repeating pattern.
+
+    Returns
+    -------
+    RunSimulation
+
+    Raises
+    ------
+    ValueError
+        If the run would execute an address that is not in `instructions`,
+        run past the end of the RAM, or does not finish within `max_steps`.
+
+    Notes
+    -----
+    The simulation models the goto_counter behaviour of the output coordinator
+    (see `transcode.encode_instruction`). At the end of each instruction, if its
+    volitile goto_counter is nonzero it is decremented and the run jumps to the
+    goto_address. Otherwise the volitile goto_counter is reset, and the run
+    either ends (at the final_ram_address) or continues to the next address.
+    Pauses caused by `stop_and_wait` are not included in any durations; the run
+    is assumed to be retriggered immediately.
+    '''
+    if isinstance(instructions, InstructionTable):
+        instructions = instructions.buffer
+    elif isinstance(instructions, (list, tuple)):
+        instructions = b''.join(instructions)
+    decoded = transcode.decode_instructions(instructions)
+    ram_size = 8192
+    address = decoded['address'].astype(np.intp)
+    written = np.zeros(ram_size, dtype=np.bool_)
+    written[address] = True
+    durations = np.zeros(ram_size, dtype=np.uint64)
+    durations[address] = decoded['duration']
+    goto_addresses = np.zeros(ram_size, dtype=np.intp)
+    goto_addresses[address] = decoded['goto_address']
+    goto_counters = np.zeros(ram_size, dtype=np.int64)
+    goto_counters[address] = decoded['goto_counter']
+    if final_ram_address is None:
+        final_ram_address = int(address.max())
+    simulation = RunSimulation(durations, final_ram_address)
+    simulation.trace = _trace_run(written, goto_addresses.tolist(), goto_counters.tolist(), final_ram_address, max_steps)
+    return simulation
+
+
+class RunSimulation():
+    '''
+    The result of `simulate_run`. The executed instructions are stored as a
+    tree of runs of sequential addresses and repeated blocks, which is expanded
+    only as far as is needed.
+    '''
+    def __init__(self, durations, final_ram_address):
+        self.final_ram_address = final_ram_address
+        # The run of addresses [start, stop] lasts cumulative_durations[stop+1] - cumulative_durations[start] cycles
+        self.cumulative_durations = [0] + np.cumsum(durations).tolist()
+        self.trace = []
+
+    @property
+    def total_duration(self):
+        '''The number of clock cycles between the start of the run and the end of the final instruction.'''
+        return _nodes_duration(self.trace, self.cumulative_durations)
+
+    @property
+    def execution_counts(self):
+        '''The number of times each RAM address is executed. Index is the address.'''
+        count_steps = [0]*(len(self.cumulative_durations) + 1)
+        _accumulate_counts(self.trace, 1, count_steps)
+        counts = np.cumsum(np.array(count_steps[:-2], dtype=object))
+        if counts.size and counts.max() >= 2**64:
+            return counts
+        return counts.astype(np.uint64)
+
+    @property
+    def executed_instruction_number(self):
+        '''The total number of instructions executed in the run.'''
+        return int(sum(self.execution_counts))
+
+    def executed_addresses(self):
+        '''
+        A generator of the executed addresses, in order, as a run length encoded
+        stream of (start_address, stop_address, repetitions) tuples. Each tuple
+        means that addresses start_address to stop_address inclusive are each
+        executed once in order, and that is repeated `repetitions` times. Loops
+        are only expanded as the generator is consumed.
+        '''
+        return _iterate_nodes(self.trace)
+
+
+class _Run():
+    __slots__ = ('start', 'stop')
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+
+class _Repeat():
+    __slots__ = ('body', 'count')
+    def __init__(self, body, count):
+        self.body = body
+        self.count = count
+
+class _LoopFrame():
+    __slots__ = ('trace_position', 'counters', 'goto_counter')
+    def __init__(self, trace_position, counters, goto_counter):
+        self.trace_position = trace_position
+        self.counters = counters
+        self.goto_counter = goto_counter
+
+
+def _trace_run(written, goto_addresses, goto_counters, final_ram_address, max_steps):
+    ram_size = len(goto_addresses)
+    written_before = [0] + np.cumsum(written).tolist()
+    # Only instructions with a nonzero goto_counter, or the final instruction, can do anything other than continue to the next address.
+    decision_addresses = sorted(set(np.flatnonzero(np.array(goto_counters) > 0).tolist()) | {final_ram_address})
+    # The volitile goto_counters that currently differ from their uploaded value.
+    volitile_counters = {}
+    # For each instruction that has jumped, where the trace was and what the counters were when it last jumped.
+    loop_frames = {}
+    trace = []
+    address = 0
+    jumped = True
+    for step in range(max_steps):
+        decision_idx = bisect.bisect_left(decision_addresses, address)
+        end_address = decision_addresses[decision_idx] if decision_idx < len(decision_addresses) else ram_size - 1
+        if written_before[end_address + 1] - written_before[address] != end_address + 1 - address:
+            unwritten_address = address + int(np.argmin(written[address:end_address + 1]))
+            err_msg = f'The run executes address {unwritten_address}, which is not one of the instructions'
+            raise ValueError(err_msg)
+        if decision_idx == len(decision_addresses):
+            err_msg = f'The run continues past the end of the RAM without reaching final_ram_address={final_ram_address}'
+            raise ValueError(err_msg)
+        # Execute address to end_address in order. Sequential runs are merged, unless the first would then span a jump target.
+        if not jumped and trace and isinstance(trace[-1], _Run) and trace[-1].stop == address - 1:
+            trace[-1].stop = end_address
+        else:
+            trace.append(_Run(address, end_address))
+        goto_counter = volitile_counters.get(end_address, goto_counters[end_address])
+        if goto_counter == 0:
+            volitile_counters.pop(end_address, None)
+            loop_frames.pop(end_address, None)
+        else:
+            loop_frame = loop_frames.get(end_address)
+            other_counters = volitile_counters.copy()
+            other_counters.pop(end_address, None)
+            if loop_frame is not None and loop_frame.goto_counter == goto_counter + 1 and loop_frame.counters == other_counters:
+                # Since the last jump from here, every other counter has returned to the same value. So each remaining jump will execute
+                # exactly the same instructions again. Record them as a repeated block, and skip to the end of the loop.
+                body = trace[loop_frame.trace_position:]
+                del trace[loop_frame.trace_position:]
+                trace.append(_Repeat(body, goto_counter + 1))
+                loop_frames = {frame_address:frame for frame_address, frame in loop_frames.items() if frame.trace_position < loop_frame.trace_position}
+                volitile_counters.pop(end_address, None)
+            else:
+                loop_frames[end_address] = _LoopFrame(len(trace), other_counters, goto_counter)
+                volitile_counters[end_address] = goto_counter - 1
+                address = goto_addresses[end_address]
+                jumped = True
+                continue
+        if end_address == final_ram_address:
+            return trace
+        address = end_address + 1
+        jumped = False
+        if address >= ram_size:
+            err_msg = f'The run continues past the end of the RAM without reaching final_ram_address={final_ram_address}'
+            raise ValueError(err_msg)
+    err_msg = f'The run did not finish within max_steps={max_steps} jumps'
+    raise ValueError(err_msg)
+
+def _nodes_duration(nodes, cumulative_durations):
+    duration = 0
+    for node in nodes:
+        if isinstance(node, _Run):
+            duration += cumulative_durations[node.stop + 1] - cumulative_durations[node.start]
+        else:
+            duration += node.count*_nodes_duration(node.body, cumulative_durations)
+    return duration
+
+def _accumulate_counts(nodes, multiplier, count_steps):
+    for node in nodes:
+        if isinstance(node, _Run):
+            count_steps[node.start] += multiplier
+            count_steps[node.stop + 1] -= multiplier
+        else:
+            _accumulate_counts(node.body, multiplier*node.count, count_steps)
+
+def _iterate_nodes(nodes):
+    for node in nodes:
+        if isinstance(node, _Run):
+            yield (node.start, node.stop, 1)
+        elif len(node.body) == 1 and isinstance(node.body[0], _Run):
+            yield (node.body[0].start, node.body[0].stop, node.count)
+        else:
+            for repetition in range(node.count):
+                yield from _iterate_nodes(node.body)
@@ -0,0 +1,216 @@
+import queue
+import time
+import numpy as np
+from . import transcode
+
+
+def stream_instructions(pg, instructions, bank_size=4096, software_trigger=True, timeout_margin=1.0):
+    '''
+    Runs a sequence of instructions that may be far longer than the RAM, by
+    splitting the RAM into two banks, and refilling each bank while the other
+    one is executing.
+
+    The first instruction of each bank is tagged with notify_computer, so the
+    notification from the start of one bank shows that the other bank has
+    finished executing, and can be refilled with the next instructions from
+    `instructions`. The last instruction of the second bank jumps back to
+    address 0 (with goto_counter=1, which is reset every time the bank is
+    refilled). The final_ram_address is kept at the end of the second bank
+    until the last instructions have been written, and is then moved to the
+    last instruction. The device is never pointed at an address it has already
+    passed, so this is safe to do during the run.
+
+    Parameters
+    ----------
+    pg : PulseGenerator
+        A connected PulseGenerator.
+    instructions : iterable
+        An iterable (such as a generator) of encoded instructions, in any of the
+        formats accepted by PulseGenerator.write_instructions. Each item can
+        hold any number of instructions. The addresses of the instructions are
+        ignored; they are executed in the order they are produced. They must
+        not contain loops (goto_counter must be 0).
+    bank_size : int, optional
+        The number of instructions in each bank. Two banks must fit in the RAM.
+    software_trigger : bool, optional
+        If True, the run is started with a software trigger once both banks have
+        been filled. Otherwise it waits for a trigger from elsewhere.
+    timeout_margin : float, optional
+        How long (in seconds) to wait for each bank to finish executing, on top
+        of the duration of the bank.
+
+    Returns
+    -------
+    StreamResult
+
+    Raises
+    ------
+    ValueError
+        If an instruction contains a loop, or the bank size doesn't fit in the
+        RAM.
+    TimeoutError
+        If a bank doesn't finish executing in time. reset_run is sent first.
+    '''
+    ram_size = pg.ram_shadow.shape[0]
+    if bank_size < 1 or 2*bank_size > ram_size:
+        err_msg = f'\'bank_size\' out of range. Must be in range [1, {ram_size//2}]'
+        raise ValueError(err_msg)
+    source = _InstructionSource(pg, instructions)
+    result = StreamResult(bank_size)
+    notifications = queue.Queue()
+    pg.subscribe('notification', notifications.put)
+    try:
+        bank_durations = [0, 0]
+        records, is_last = source.take(bank_size)
+        if records is None:
+            return result
+        last_address, bank_durations[0] = _write_bank(pg, records, 0, bank_size, is_last)
+        result.instruction_number += len(records)
+        if not is_last:
+            records, is_last = source.take(bank_size)
+            last_address, bank_durations[1] = _write_bank(pg, records, 1, bank_size, is_last)
+            result.instruction_number += len(records)
+        pg.write_device_options(final_ram_address=last_address if is_last else 2*bank_size - 1, run_mode='single', notify_when_run_finished=True)
+        if software_trigger:
+            pg.write_action(trigger_now=True)
+        # The start of the first bank. The run may be waiting for an external trigger, so there is no timeout.
+        if not _wait_for_address(pg, notifications, 0, None, result):
+            return result
+        executing_bank = 0
+        refill = None
+        while not is_last:
+            # The other bank starting means the executing one has finished, and can be refilled.
+            other_bank = 1 - executing_bank
+            notification = _wait_for_address(pg, notifications, other_bank*bank_size, bank_durations[executing_bank]*10E-9 + timeout_margin, result)
+            if notification is None:
+                return result
+            if refill is not None:
+                result.add_refill(refill, notification['timestamp'])
+            records, is_last = source.take(bank_size)
+            last_address, bank_durations[executing_bank] = _write_bank(pg, records, executing_bank, bank_size, is_last)
+            result.instruction_number += len(records)
+            if is_last:
+                pg.write_device_options(final_ram_address=last_address)
+            # The time the device reaches the refilled bank is known when the next notification arrives.
+            refill = {'bank':executing_bank, 'instructions':len(records), 'written':time.time(), 'time_available':bank_durations[other_bank]*10E-9}
+            executing_bank = other_bank
+        if refill is not None:
+            notification = _wait_for_address(pg, notifications, (1 - executing_bank)*bank_size, bank_durations[executing_bank]*10E-9 + timeout_margin, result)
+            if notification is None:
+                return result
+            result.add_refill(refill, notification['timestamp'])
+        # Wait for the end of the run
+        if _wait_for_address(pg, notifications, None, sum(bank_durations)*10E-9 + timeout_margin, result) is None:
+            result.completed = True
+        return result
+    finally:
+        pg.unsubscribe('notification', notifications.put)
+
+
+class StreamResult():
+    '''
+    The result of `stream_instructions`. "refills" has a dictionary for each
+    time a bank was refilled during the run, containing the 'bank', the number
+    of 'instructions' written, 'time_available' (the duration of the other
+    bank, in seconds), and 'margin' (the time in seconds from finishing writing
+    the bank to the device starting to execute it). A negative margin is an
+    underrun: the device started executing the bank before it had all been
+    written.
+    '''
+    def __init__(self, bank_size):
+        self.bank_size = bank_size
+        self.instruction_number = 0
+        self.refills = []
+        # True once the finished notification from the last instruction has been received.
+        self.completed = False
+        # True if the run finished before all the instructions were executed, because a bank wasn't refilled in time.
+        self.stopped_early = False
+
+    def add_refill(self, refill, reached_time):
+        refill = dict(refill)
+        refill['margin'] = reached_time - refill.pop('written')
+        self.refills.append(refill)
+
+    @property
+    def underruns(self):
+        '''The number of banks that the device started executing before they had been completely written.'''
+        return sum(refill['margin'] < 0 for refill in self.refills) + int(self.stopped_early)
+
+    @property
+    def min_margin(self):
+        '''The smallest margin of any refill, in seconds, or None if no banks were refilled.'''
+        return min((refill['margin'] for refill in self.refills), default=None)
+
+    def __repr__(self):
+        return f'StreamResult({self.instruction_number} instructions, {len(self.refills)} refills, {self.underruns} underruns, min_margin={self.min_margin})'
+
+
+class _InstructionSource():
+    # Takes encoded instructions from an iterable, a bank at a time.
+    def __init__(self, pg, instructions):
+        self.pg = pg
+        self.iterator = iter(instructions)
+        self.buffer = bytearray()
+        self.exhausted = False
+
+    def take(self, instruction_num):
+        # Returns a (N, 19) array of up to instruction_num encoded instructions (None if there are none left), and whether they are the last.
+        wanted_bytes = instruction_num*19
+        # One more instruction than needed is read, so it is known whether these are the last ones.
+        while not self.exhausted and len(self.buffer) <= wanted_bytes:
+            try:
+                self.buffer += self.pg.join_instructions(next(self.iterator))
+            except StopIteration as ex:
+                self.exhausted = True
+        if not self.buffer:
+            return None, True
+        records = np.frombuffer(bytes(self.buffer[:wanted_bytes]), dtype=np.uint8)
+        del self.buffer[:wanted_bytes]
+        if records.size % 19 != 0:
+            err_msg = f'\'instructions\' must contain whole encoded instructions'
+            raise ValueError(err_msg)
+        records = records.reshape(-1, 19).copy()
+        if np.any(records[:, 0] != transcode.msgout_identifier['load_ram']):
+            err_msg = f'\'instructions\' contains messages that are not encoded instructions'
+            raise ValueError(err_msg)
+        if np.any(records[:, 14:18]):
+            err_msg = f'Streamed instructions cannot contain loops. \'goto_counter\' must be 0'
+            raise ValueError(err_msg)
+        return records, self.exhausted and not self.buffer
+
+def _write_bank(pg, records, bank, bank_size, is_last):
+    # Places the instructions in a bank and writes them. Returns the address of the last one, and the duration of the bank in cycles.
+    addresses = bank*bank_size + np.arange(len(records))
+    if bank == 0 and records[0, 18] & 0b1000:
+        err_msg = f'The first streamed instruction, and the first of every {2*bank_size}, is at address 0, so cannot have powerline_sync=True'
+        raise ValueError(err_msg)
+    records[:, 1] = addresses & 0xFF
+    records[:, 2] = addresses >> 8
+    # The notification from the first instruction of a bank shows the other bank has finished
+    records[0, 18] |= 0b100
+    if bank == 1 and not is_last and len(records) == bank_size:
+        # Jump from the end of the second bank back to the start of the first
+        records[-1, 12:14] = 0
+        records[-1, 14:18] = (1, 0, 0, 0)
+    pg.write_instructions(records.tobytes())
+    durations = np.zeros((len(records), 8), dtype=np.uint8)
+    durations[:, :6] = records[:, 6:12]
+    return int(addresses[-1]), int(durations.view('<u8').sum())
+
+def _wait_for_address(pg, notifications, address, timeout, result):
+    # Waits for the notification from "address". Returns it, or None if the run finished first. If address is None, waits for the run to finish.
+    t0 = time.time()
+    while True:
+        timeout_remaining = None if timeout is None else max(timeout - (time.time() - t0), 0.0)
+        try:
+            notification = notifications.get(timeout=timeout_remaining)
+        except queue.Empty as ex:
+            pg.write_action(reset_run=True)
+            err_msg = f'The streamed run did not reach address {address} within {timeout} s'
+            raise TimeoutError(err_msg)
+        if notification['finished_notify']:
+            if address is not None:
+                result.stopped_early = True
+            return None
+        if notification['address_notify'] and notification['address'] == address:
+            return notification
@@ -1,5 +1,155 @@
+import collections.abc
 import numpy as np
-import struct
+from . import protocol
+
+#########################################################
+# message records
+class MessageRecord(collections.abc.MutableMapping):
+    '''
+    The base class of the decoded messages. Each message type has its own
+    subclass with a slot per field, which is much lighter than a dictionary per
+    message. Fields can be read and set as attributes (message.address) or as
+    keys (message['address']), and records work anywhere a dictionary does
+    (keys, items, get, update, pop, `in`, del, dict(message), comparison with a
+    dictionary), except where a real dict is required, such as json.dumps. Use
+    message.copy() to get one. Keys that aren't fields can also be added; they
+    are kept in a dictionary that is only made when the first one is added.
+    '''
+    __slots__ = ('_extra',)
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError as ex:
+                pass
+        else:
+            extra = getattr(self, '_extra', None)
+            if extra is not None and key in extra:
+                return extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.__slots__:
+            setattr(self, key, value)
+        else:
+            extra = getattr(self, '_extra', None)
+            if extra is None:
+                extra = self._extra = {}
+            extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.__slots__:
+            try:
+                delattr(self, key)
+                return
+            except AttributeError as ex:
+                pass
+        else:
+            extra = getattr(self, '_extra', None)
+            if extra is not None and key in extra:
+                del extra[key]
+                return
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+        extra = getattr(self, '_extra', None)
+        if extra:
+            yield from list(extra)
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)})'
+
+    def copy(self):
+        '''Returns the fields of the message as a new dict.'''
+        return dict(self)
+
+class ErrorMessage(MessageRecord):
+    __slots__ = ('invalid_identifier_received', 'timeout_waiting_to_receive_message', 'received_message_not_forwarded', 'destination_subsystem', 'timestamp')
+
+    def __init__(self, invalid_identifier_received, timeout_waiting_to_receive_message, received_message_not_forwarded, destination_subsystem):
+        self.invalid_identifier_received = invalid_identifier_received
+        self.timeout_waiting_to_receive_message = timeout_waiting_to_receive_message
+        self.received_message_not_forwarded = received_message_not_forwarded
+        self.destination_subsystem = destination_subsystem
+
+class EchoMessage(MessageRecord):
+    __slots__ = ('echoed_byte', 'device_type', 'hardware_version', 'firmware_version', 'serial_number', 'timestamp')
+
+    def __init__(self, echoed_byte, device_type, hardware_version, firmware_version, serial_number):
+        self.echoed_byte = echoed_byte
+        self.device_type = device_type
+        self.hardware_version = hardware_version
+        self.firmware_version = firmware_version
+        self.serial_number = serial_number
+
+class DeviceStateMessage(MessageRecord):
+    __slots__ = ('state', 'final_ram_address', 'trigger_out_delay', 'run_mode', 'trigger_source', 'notify_on_main_trig_out', 'notify_on_run_finished', 
+        'trigger_out_length', 'clock_source', 'running', 'software_run_enable', 'hardware_run_enable', 'current_address', 'timestamp')
+
+    def __init__(self, state, final_ram_address, trigger_out_delay, run_mode, trigger_source, notify_on_main_trig_out, notify_on_run_finished, 
+            trigger_out_length, clock_source, running, software_run_enable, hardware_run_enable, current_address):
+        self.state = state
+        self.final_ram_address = final_ram_address
+        self.trigger_out_delay = trigger_out_delay
+        self.run_mode = run_mode
+        self.trigger_source = trigger_source
+        self.notify_on_main_trig_out = notify_on_main_trig_out
+        self.notify_on_run_finished = notify_on_run_finished
+        self.trigger_out_length = trigger_out_length
+        self.clock_source = clock_source
+        self.running = running
+        self.software_run_enable = software_run_enable
+        self.hardware_run_enable = hardware_run_enable
+        self.current_address = current_address
+
+class NotificationMessage(MessageRecord):
+    __slots__ = ('address', 'address_notify', 'trigger_notify', 'finished_notify', 'timestamp')
+
+    def __init__(self, address, address_notify, trigger_notify, finished_notify):
+        self.address = address
+        self.address_notify = address_notify
+        self.trigger_notify = trigger_notify
+        self.finished_notify = finished_notify
+
+class PowerlineStateMessage(MessageRecord):
+    __slots__ = ('trig_on_powerline', 'powerline_locked', 'powerline_period', 'powerline_trigger_delay', 'timestamp')
+
+    def __init__(self, trig_on_powerline, powerline_locked, powerline_period, powerline_trigger_delay):
+        self.trig_on_powerline = trig_on_powerline
+        self.powerline_locked = powerline_locked
+        self.powerline_period = powerline_period
+        self.powerline_trigger_delay = powerline_trigger_delay
+
+class BytesDroppedMessage(MessageRecord):
+    __slots__ = ('message_identifier', 'message', 'timestamp')
+
+    def __init__(self, message_identifier, message=None):
+        self.message_identifier = message_identifier
+        self.message = message
+
+# The codecs generated from the layout of each message in protocol.schema. They only pack and unpack values; what the values mean is
+# decided here.
+_unpack_error =             protocol.msgin_codecs['error'].unpack
+_unpack_echo =              protocol.msgin_codecs['echo'].unpack
+_unpack_devicestate =       protocol.msgin_codecs['devicestate'].unpack
+_unpack_notification =      protocol.msgin_codecs['notification'].unpack
+_unpack_powerlinestate =    protocol.msgin_codecs['powerlinestate'].unpack
+_pack_echo =                protocol.msgout_codecs['echo'].pack
+_pack_instruction =         protocol.msgout_codecs['load_ram'].pack
+_pack_action =              protocol.msgout_codecs['action_request'].pack
+_pack_general_input =       protocol.msgout_codecs['general_input'].pack
+_pack_device_options =      protocol.msgout_codecs['device_options'].pack
+_pack_static_state =        protocol.msgout_codecs['set_static_state'].pack
+_pack_powerline_trigger_options = protocol.msgout_codecs['powerline_trigger_options'].pack
+# Each possible byte as a bytes object of length 1
+_single_bytes = [bytes((value,)) for value in range(256)]
 
 #########################################################
 # decodes
@@ -19,7 +169,7 @@ def decode_internal_error(message):
 
     Returns
     -------
-    dictionary
+    ErrorMessage
         The decoded message containing what type of error occurred, and
     additional information if the error is type received_message_not_forwarded.
 
@@ -40,11 +190,7 @@ def decode_internal_error(message):
     error information:  1 byte  [1]     8 bits      [8+:8]     unsigned int.
 
     '''
-    tags, =         struct.unpack('<Q', message[0:1] + bytes(7))
-    error_info, =   struct.unpack('<Q', message[1:2] + bytes(7))
-    invalid_identifier_received_tag =       (tags >> 0) & 0b1        
-    timeout_waiting_for_msg_tag =           (tags >> 1) & 0b1     
-    received_message_not_forwarded_tag =    (tags >> 2) & 0b1
+    invalid_identifier_received_tag, timeout_waiting_for_msg_tag, received_message_not_forwarded_tag, error_info = _unpack_error(message)
     if error_info in decode_lookup['error_info'].keys():
         destination_subsystem = decode_lookup['error_info'][error_info]
     else:
@@ -52,7 +198,7 @@ def decode_internal_error(message):
     invalid_identifier_received =       decode_lookup['invalid_identifier'][invalid_identifier_received_tag]
     timeout_waiting_for_msg =           decode_lookup['msg_receive_timeout'][timeout_waiting_for_msg_tag]
     received_message_not_forwarded =    decode_lookup['msg_not_forwarded'][received_message_not_forwarded_tag]
-    return {'invalid_identifier_received':invalid_identifier_received, 'timeout_waiting_to_receive_message':timeout_waiting_for_msg, 'received_message_not_forwarded':received_message_not_forwarded, 'destination_subsystem':destination_subsystem}
+    return ErrorMessage(invalid_identifier_received, timeout_waiting_for_msg, received_message_not_forwarded, destination_subsystem)
 
 def decode_easyprint(message):
     ''' 
@@ -98,7 +244,7 @@ def decode_devicestate(message):
 
     Returns
     -------
-    dictionary
+    DeviceStateMessage
         The decoded message containing information about most persistent device 
         settings, along with other information about the current state of the
         device.
@@ -135,21 +281,9 @@ def decode_devicestate(message):
         notify on finished              1 bit       [128]
     
     '''
-    state =                 np.unpackbits(np.array([message[0], message[1], message[2]], dtype=np.uint8), bitorder='little')
-    final_ram_address, =    struct.unpack('<Q', message[3:5] + bytes(6))
-    trigger_out_delay, =        struct.unpack('<Q', message[5:12] + bytes(1))
-    trigger_out_length, =       struct.unpack('<Q', message[12:13] + bytes(7))
-    current_ram_address, =  struct.unpack('<Q', message[13:15] + bytes(6))
-    tags, =                 struct.unpack('<Q', message[15:17] + bytes(6))
-
-    run_mode_tag =                  (tags >> 0) & 0b1            
-    trigger_source_tag =            (tags >> 1) & 0b11              
-    notify_on_main_trig_out_tag =   (tags >> 3) & 0b1    
-    clock_source_tag =              (tags >> 4) & 0b1  
-    running_tag =                   (tags >> 5) & 0b1  
-    software_run_enable_tag =       (tags >> 6) & 0b1  
-    hardware_run_enable_tag =       (tags >> 7) & 0b1
-    notify_on_run_finished_tag =    (tags >> 8) & 0b1    
+    (state, final_ram_address, trigger_out_delay, trigger_out_length, current_ram_address, run_mode_tag, trigger_source_tag, notify_on_main_trig_out_tag,
+        clock_source_tag, running_tag, software_run_enable_tag, hardware_run_enable_tag, notify_on_run_finished_tag) = _unpack_devicestate(message)
+    state =                     np.unpackbits(np.frombuffer(state.to_bytes(3, 'little'), dtype=np.uint8), bitorder='little')
     run_mode =                  decode_lookup['run_mode'][run_mode_tag]
     trigger_source =            decode_lookup['trigger_source'][trigger_source_tag]
     notify_on_main_trig_out =   decode_lookup['notify_on_main_trig_out'][notify_on_main_trig_out_tag]
@@ -158,7 +292,7 @@ def decode_devicestate(message):
     software_run_enable =       decode_lookup['software_run_enable'][software_run_enable_tag]
     hardware_run_enable =       decode_lookup['hardware_run_enable'][hardware_run_enable_tag]
     notify_on_run_finished =    decode_lookup['notify_on_run_finished'][notify_on_run_finished_tag]
-    return {'state':state, 'final_ram_address':final_ram_address, 'trigger_out_delay':trigger_out_delay, 'run_mode':run_mode, 'trigger_source':trigger_source, 'notify_on_main_trig_out':notify_on_main_trig_out, 'notify_on_run_finished':notify_on_run_finished, 'trigger_out_length':trigger_out_length, 'clock_source':clock_source, 'running':running, 'software_run_enable':software_run_enable, 'hardware_run_enable':hardware_run_enable, 'current_address':current_ram_address}
+    return DeviceStateMessage(state, final_ram_address, trigger_out_delay, run_mode, trigger_source, notify_on_main_trig_out, notify_on_run_finished, trigger_out_length, clock_source, running, software_run_enable, hardware_run_enable, current_ram_address)
 
 def decode_powerlinestate(message):
     ''' 
@@ -174,7 +308,7 @@ def decode_powerlinestate(message):
 
     Returns
     -------
-    dictionary
+    PowerlineStateMessage
         The decoded message containing information about global powerline
         triggering settings, and information about the current powerline period.
 
@@ -199,14 +333,10 @@ def decode_powerlinestate(message):
     powerline_period:           3 bytes [1:4]   22 bits     [8+:22]   unsigned int.
     powerline_trigger_delay:    3 bytes [4:7]   22 bits     [32+:22]  unsigned int.
     '''
-    tags, =                     struct.unpack('<Q', message[0:1] + bytes(7))
-    powerline_period, =         struct.unpack('<Q', message[1:4] + bytes(5))
-    powerline_trigger_delay, =  struct.unpack('<Q', message[4:7] + bytes(5))
-    trig_on_powerline_tag = (tags >> 0) & 0b1
-    powerline_locked_tag =  (tags >> 1) & 0b1
+    trig_on_powerline_tag, powerline_locked_tag, powerline_period, powerline_trigger_delay = _unpack_powerlinestate(message)
     trig_on_powerline = decode_lookup['trig_on_powerline'][trig_on_powerline_tag]
     powerline_locked =  decode_lookup['powerline_locked'][powerline_locked_tag]
-    return {'trig_on_powerline':trig_on_powerline, 'powerline_locked':powerline_locked, 'powerline_period':powerline_period, 'powerline_trigger_delay':powerline_trigger_delay}
+    return PowerlineStateMessage(trig_on_powerline, powerline_locked, powerline_period, powerline_trigger_delay)
 
 def decode_notification(message):
     ''' 
@@ -222,7 +352,7 @@ def decode_notification(message):
 
     Returns
     -------
-    dictionary
+    NotificationMessage
         The decoded message containing information about what caused the Pulse 
         Gen to emit a notification.
 
@@ -246,15 +376,11 @@ def decode_notification(message):
         trigger notify tag                      1 bit       [17] 
         end of run notify tag                   1 bit       [18] 
     '''
-    address_of_notification, =  struct.unpack('<Q', message[0:2] + bytes(6))
-    tags, =                     struct.unpack('<Q', message[2:3] + bytes(7))
-    address_notify_tag =    (tags >> 0) & 0b1
-    trig_notify_tag =       (tags >> 1) & 0b1
-    finished_notify_tag =   (tags >> 2) & 0b1
+    address_of_notification, address_notify_tag, trig_notify_tag, finished_notify_tag = _unpack_notification(message)
     address_notify =    decode_lookup['address_notify'][address_notify_tag]
     trig_notify =       decode_lookup['trig_notify'][trig_notify_tag]
     finished_notify =        decode_lookup['finished_notify'][finished_notify_tag]
-    return {'address':address_of_notification, 'address_notify':address_notify, 'trigger_notify':trig_notify, 'finished_notify':finished_notify}
+    return NotificationMessage(address_of_notification, address_notify, trig_notify, finished_notify)
 
 def decode_echo(message):
     '''
@@ -269,7 +395,7 @@ def decode_echo(message):
 
     Returns
     -------
-    dictionary
+    EchoMessage
         The decoded message containing the echoed byte and device information
         including the hardware and firmware versions, and the device serial number.
 
@@ -291,14 +417,106 @@ def decode_echo(message):
     firmware version	2 bytes [3:5]   16 bits     [24+:16]  	16	65536       xx.xxx
     serial number		3 bytes [5:8]   24 bits     [40+:24]    24	16777216    xxxxxxxx
     '''
-    echoed_byte = message[0:1]
-    device_type, =      struct.unpack('<Q', message[1:2] + bytes(7))
-    hardware_version, = struct.unpack('<Q', message[2:3] + bytes(7))
-    firmware_version, = struct.unpack('<Q', message[3:5] + bytes(6))
-    serial_number, =    struct.unpack('<Q', message[5:8] + bytes(5))
+    echoed_byte, device_type, hardware_version, firmware_version, serial_number = _unpack_echo(message)
+    echoed_byte = _single_bytes[echoed_byte]
     firmware_version = str(firmware_version)
     firmware_version = firmware_version[:-3] + '.' + firmware_version[-3:]
-    return {'echoed_byte':echoed_byte, 'device_type':device_type, 'hardware_version':hardware_version, 'firmware_version':firmware_version, 'serial_number':serial_number}
+    return EchoMessage(echoed_byte, device_type, hardware_version, firmware_version, serial_number)
+
+def decode_messages(buffer, raw_message_types=()):
+    ''' 
+    Decodes every complete message in a buffer of bytes received from the Pulse
+    Gen, using the message identifiers and lengths in `msgin_decodeinfo`. This
+    allows many messages to be read from the serial port in a single chunk and
+    then decoded in one pass.
+
+    Parameters
+    ----------
+    buffer : bytes
+        The bytes sent by the Pulse Gen, starting at a message identifier.
+    raw_message_types : collection of str, optional
+        Message types (eg 'devicestate') that are not decoded. Their message is
+        the encoded bytes, not including the message identifier.
+
+    Returns
+    -------
+    list
+        A list of (message_type, message) tuples in the order they were
+        received, where message is the output of the relevant decode function.
+        A byte that is not a valid message identifier is returned as the message
+        type 'bytes_dropped', with the message BytesDroppedMessage(byte).
+    int
+        The number of bytes that were decoded. If the buffer ends part way
+        through a message, the remaining bytes are not decoded, and should be
+        prepended to the next bytes received.
+    '''
+    messages = []
+    position = 0
+    buffer_length = len(buffer)
+    while position < buffer_length:
+        message_identifier = buffer[position]
+        decodeinfo = msgin_decodeinfo.get(message_identifier)
+        if decodeinfo is None:
+            messages.append(('bytes_dropped', BytesDroppedMessage(message_identifier)))
+            position += 1
+            continue
+        message_end = position + decodeinfo['message_length']
+        if message_end > buffer_length:
+            break
+        if decodeinfo['message_type'] in raw_message_types:
+            messages.append((decodeinfo['message_type'], buffer[position+1:message_end]))
+        else:
+            messages.append((decodeinfo['message_type'], decodeinfo['decode_function'](buffer[position+1:message_end])))
+        position = message_end
+    return messages, position
+
+def decode_instructions(instructions):
+    ''' 
+    Decodes encoded timing instructions (as generated by `encode_instruction` or
+    `encode_instructions`) back into their fields. The buffer is viewed as a
+    (N, 19) array of bytes without copying, and every field is extracted for all
+    instructions at once.
+
+    Parameters
+    ----------
+    instructions : bytes-like
+        Any object supporting the buffer protocol (bytes, bytearray, memoryview,
+        mmap, numpy.ndarray) containing one or more encoded instructions joined
+        together, including their message identifiers.
+
+    Returns
+    -------
+    dictionary
+        Each value is a numpy array with one element per instruction, in the
+        order they appear in `instructions`. The keys are 'address', 'state'
+        (an int, where the binary digits represent the output state of each
+        channel), 'duration', 'goto_address', 'goto_counter', 'stop_and_wait',
+        'hardware_trig_out', 'notify_computer' and 'powerline_sync'.
+
+    Raises
+    ------
+    ValueError
+        If the buffer is not a whole number of encoded instructions, or contains
+        messages that are not encoded instructions.
+
+    See Also
+    --------
+    encode_instruction : The function that encodes instructions. Its notes
+        contain the bitwise layout of an encoded instruction.
+    '''
+    codec = protocol.msgout_codecs['load_ram']
+    records = np.frombuffer(instructions, dtype=np.uint8)
+    if records.size % codec.length != 0:
+        err_msg = f'\'instructions\' must have a length that is a multiple of {codec.length}, not {records.size}'
+        raise ValueError(err_msg)
+    records = records.view(codec.dtype)
+    if np.any(records['identifier'] != codec.identifier):
+        err_msg = f'\'instructions\' contains messages that are not encoded instructions'
+        raise ValueError(err_msg)
+    decoded = codec.unpack_arrays(records)
+    for tag in ('stop_and_wait', 'hardware_trig_out', 'notify_computer', 'powerline_sync'):
+        decoded[tag] = decoded[tag].astype(np.bool_)
+    return decoded
 #########################################################
 # encode
 def encode_echo(byte_to_echo):
@@ -350,8 +568,7 @@ def encode_echo(byte_to_echo):
     if len(byte_to_echo) != 1:
         err_msg = f'\'byte_to_echo\' must have length 1'
         raise ValueError(err_msg)
-    message_identifier = struct.pack('B', msgout_identifier['echo'])
-    return message_identifier + byte_to_echo
+    return _pack_echo(byte_to_echo[0])
 
 def encode_powerline_trigger_options(trigger_on_powerline=None, powerline_trigger_delay=None):
     ''' 
@@ -405,7 +622,7 @@ def encode_powerline_trigger_options(trigger_on_powerline=None, powerline_trigge
     '''
     # Type and value checking
     if isinstance(powerline_trigger_delay, (int, np.integer)):
-        update_powerline_trigger_delay_tag = 1 << 0
+        update_powerline_trigger_delay_tag = 1
         if powerline_trigger_delay < 0 or powerline_trigger_delay > 4194303:
             err_msg = f'\'powerline_trigger_delay\' out of range. Must be in must be range [0, 4194303]'
             raise ValueError(err_msg)
@@ -416,12 +633,8 @@ def encode_powerline_trigger_options(trigger_on_powerline=None, powerline_trigge
         err_msg = f'\'powerline_trigger_delay\' must be an int or np.integer, not a {type(powerline_trigger_delay).__name__}'
         raise TypeError(err_msg)
     # Tag arguments are not explicitly validated. Errors are caught in the dictionary lookup
-    trigger_on_powerline_tag =  encode_lookup['trigger_on_powerline'][trigger_on_powerline] << 1
-    tags = update_powerline_trigger_delay_tag | trigger_on_powerline_tag
-    message_identifier =        struct.pack('B', msgout_identifier['powerline_trigger_options'])
-    powerline_trigger_delay =   struct.pack('<Q', powerline_trigger_delay)[:3]
-    tags =                      struct.pack('<Q', tags)[:1]
-    return message_identifier + powerline_trigger_delay + tags
+    trigger_on_powerline_tag =  encode_lookup['trigger_on_powerline'][trigger_on_powerline]
+    return _pack_powerline_trigger_options(powerline_trigger_delay, update_powerline_trigger_delay_tag, trigger_on_powerline_tag)
 
 def encode_device_options(final_ram_address=None, run_mode=None, trigger_source=None, trigger_out_length=None, trigger_out_delay=None, notify_on_main_trig_out=None, notify_when_run_finished=None, software_run_enable=None):
     """ 
@@ -543,7 +756,7 @@ def encode_device_options(final_ram_address=None, run_mode=None, trigger_source=
     """
     # Type and value checking
     if isinstance(final_ram_address, (int, np.integer)):
-        update_final_ram_address_tag = 1 << 7
+        update_final_ram_address_tag = 1
         if final_ram_address < 0 or final_ram_address > 8191:
             err_msg = f'\'final_ram_address\' out of range. Must be in must be range [0, 8191]'
             raise ValueError(err_msg)
@@ -554,9 +767,9 @@ def encode_device_options(final_ram_address=None, run_mode=None, trigger_source=
         err_msg = f'\'final_ram_address\' must be an int or np.integer, not a {type(final_ram_address).__name__}'
         raise TypeError(err_msg)
     if isinstance(trigger_out_delay, (int, np.integer)):
-        update_trigger_out_delay_tag = 1 << 8
-        if trigger_out_delay < 0 or trigger_out_delay > 72057594037927936:
-            err_msg = f'\'trigger_out_delay\' out of range. Must be in range [0, 72057594037927936]'
+        update_trigger_out_delay_tag = 1
+        if trigger_out_delay < 0 or trigger_out_delay > 72057594037927935:
+            err_msg = f'\'trigger_out_delay\' out of range. Must be in range [0, 72057594037927935]'
             raise ValueError(err_msg)
     elif trigger_out_delay is None:
         trigger_out_delay = 0
@@ -565,7 +778,7 @@ def encode_device_options(final_ram_address=None, run_mode=None, trigger_source=
         err_msg = f'\'trigger_out_delay\' must be an int or np.integer, not a {type(trigger_out_delay).__name__}'
         raise TypeError(err_msg)
     if isinstance(trigger_out_length, (int, np.integer)):
-        update_trigger_out_length_tag = 1 << 9
+        update_trigger_out_length_tag = 1
         if trigger_out_length < 0 or trigger_out_length > 255:
             err_msg = f'\'trigger_out_length\' out of range. Must be in range [0, 255]'
             raise ValueError(err_msg)
@@ -576,18 +789,13 @@ def encode_device_options(final_ram_address=None, run_mode=None, trigger_source=
         err_msg = f'\'trigger_out_length\' must be an int or np.integer, not a {type(trigger_out_length).__name__}'
         raise TypeError(err_msg)
     # Tag arguments are not explicitly validated. Errors are caught in the dictionary lookup
-    run_mode_tag =                  encode_lookup['run_mode'][run_mode] << 0
-    trigger_source_tag =            encode_lookup['trigger_source'][trigger_source] << 2
-    notify_on_main_trig_out_tag =   encode_lookup['notify_on_trig'][notify_on_main_trig_out] << 5
-    software_run_enable_tag =       encode_lookup['software_run_enable'][software_run_enable] << 10
-    notify_when_run_finished_tag =  encode_lookup['notify_when_finished'][notify_when_run_finished] << 12
-    tags = run_mode_tag | trigger_source_tag | notify_on_main_trig_out_tag | update_final_ram_address_tag | update_trigger_out_delay_tag | update_trigger_out_length_tag | software_run_enable_tag | notify_when_run_finished_tag
-    message_identifier =    struct.pack('B', msgout_identifier['device_options'])
-    final_ram_address =     struct.pack('<Q', final_ram_address)[:2]
-    trigger_out_delay =     struct.pack('<Q', trigger_out_delay)[:7]
-    trigger_out_length =    struct.pack('<Q', trigger_out_length)[:1]
-    tags =                  struct.pack('<Q', tags)[:2]
-    return message_identifier + final_ram_address + trigger_out_delay + trigger_out_length + tags
+    run_mode_tag =                  encode_lookup['run_mode'][run_mode]
+    trigger_source_tag =            encode_lookup['trigger_source'][trigger_source]
+    notify_on_main_trig_out_tag =   encode_lookup['notify_on_trig'][notify_on_main_trig_out]
+    software_run_enable_tag =       encode_lookup['software_run_enable'][software_run_enable]
+    notify_when_run_finished_tag =  encode_lookup['notify_when_finished'][notify_when_run_finished]
+    return _pack_device_options(final_ram_address, trigger_out_delay, trigger_out_length, run_mode_tag, trigger_source_tag, notify_on_main_trig_out_tag, 
+        update_final_ram_address_tag, update_trigger_out_delay_tag, update_trigger_out_length_tag, software_run_enable_tag, notify_when_run_finished_tag)
 
 def encode_action(trigger_now=False, disable_after_current_run=False, reset_run=False, request_state=False, request_powerline_state=False):
     """
@@ -675,15 +883,12 @@ def encode_action(trigger_now=False, disable_after_current_run=False, reset_run=
         reset_run                               1 bit       [4] 
     """
     # Tag arguments are not explicitly validated. Errors are caught in the dictionary lookup
-    trigger_now_tag =                   encode_lookup['trigger_now'][trigger_now] << 0
-    request_state_tag =                 encode_lookup['request_state'][request_state] << 1
-    request_powerline_state_tag =       encode_lookup['request_powerline_state'][request_powerline_state] << 2
-    disable_after_current_run =         encode_lookup['disable_after_current_run'][disable_after_current_run] << 3
-    reset_run_tag =                     encode_lookup['reset_run'][reset_run] << 4
-    tags = trigger_now_tag | request_state_tag | reset_run_tag | disable_after_current_run | request_powerline_state_tag
-    message_identifier =    struct.pack('B', msgout_identifier['action_request'])
-    tags =                  struct.pack('<Q', tags)[:1]
-    return message_identifier + tags
+    trigger_now_tag =                   encode_lookup['trigger_now'][trigger_now]
+    request_state_tag =                 encode_lookup['request_state'][request_state]
+    request_powerline_state_tag =       encode_lookup['request_powerline_state'][request_powerline_state]
+    disable_after_current_run_tag =     encode_lookup['disable_after_current_run'][disable_after_current_run]
+    reset_run_tag =                     encode_lookup['reset_run'][reset_run]
+    return _pack_action(trigger_now_tag, request_state_tag, request_powerline_state_tag, disable_after_current_run_tag, reset_run_tag)
 
 def encode_general_debug(message):
     ''' 
@@ -711,9 +916,7 @@ def encode_general_debug(message):
     Message format:                             BITS USED   FPGA INDEX.
     general_putpose_input:      8 bytes [0:8]   64 bits     [0+:64]     unsigned int.
     '''
-    message_identifier =    struct.pack('B', msgout_identifier['general_input'])
-    message =               struct.pack('<Q', message)[:8]
-    return message_identifier + message
+    return _pack_general_input(message)
 
 def encode_static_state(state):
     '''
@@ -763,9 +966,7 @@ def encode_static_state(state):
     main_outputs_state:         3 bytes [0:3]   24 bits     [0+:24]     unsigned int.
     '''
     state = state_multiformat_to_int(state)
-    message_identifier =    struct.pack('B', msgout_identifier['set_static_state'])
-    state =                 struct.pack('<Q', state)[:3] 
-    return message_identifier + state
+    return _pack_static_state(state)
 
 def encode_instruction(address, duration, state, goto_address=0, goto_counter=0, stop_and_wait=False, hardware_trig_out=False, notify_computer=False, powerline_sync=False):
     """
@@ -910,19 +1111,130 @@ def encode_instruction(address, duration, state, goto_address=0, goto_counter=0,
         raise ValueError(err_msg)
     # Tag arguments are not explicitly validated. Errors are caught in the dictionary lookup
     state = state_multiformat_to_int(state)
-    stop_and_wait_tag =     encode_lookup['stop_and_wait'][stop_and_wait] << 0
-    hard_trig_out_tag =     encode_lookup['trig_out_on_instruction'][hardware_trig_out] << 1
-    notify_computer_tag =   encode_lookup['notify_on_instruction'][notify_computer] << 2
-    powerline_sync_tag =    encode_lookup['powerline_sync'][powerline_sync] << 3
-    tags = stop_and_wait_tag | hard_trig_out_tag | notify_computer_tag | powerline_sync_tag
-    message_identifier =    struct.pack('B', msgout_identifier['load_ram'])
-    address =               struct.pack('<Q', address)[:2]
-    state =                 struct.pack('<Q', state)[:3]
-    duration =              struct.pack('<Q', duration)[:6]
-    goto_address =          struct.pack('<Q', goto_address)[:2]
-    goto_counter =          struct.pack('<Q', goto_counter)[:4]
-    tags =                  struct.pack('<Q', tags)[:1]
-    return message_identifier + address + state + duration + goto_address + goto_counter + tags
+    stop_and_wait_tag =     encode_lookup['stop_and_wait'][stop_and_wait]
+    hard_trig_out_tag =     encode_lookup['trig_out_on_instruction'][hardware_trig_out]
+    notify_computer_tag =   encode_lookup['notify_on_instruction'][notify_computer]
+    powerline_sync_tag =    encode_lookup['powerline_sync'][powerline_sync]
+    return _pack_instruction(address, state, duration, goto_address, goto_counter, stop_and_wait_tag, hard_trig_out_tag, notify_computer_tag, powerline_sync_tag)
+
+def encode_instructions(address, duration, state, goto_address=0, goto_counter=0, stop_and_wait=False, hardware_trig_out=False, notify_computer=False, powerline_sync=False):
+    """
+    Generates many timing instructions at once, encoded in a format that is
+    readable by the Pulse Gen FPGA design. This is the vectorised equivalent of
+    `encode_instruction`, and produces identical bytes to joining the output of
+    `encode_instruction` for each instruction in turn. All type and range
+    checking is done in bulk, so it is much faster than encoding a large number
+    of instructions individually.
+
+    Parameters
+    ----------
+    address : array_like of int
+        `address` ∈ [0, 8191].
+        The addresses of the instructions in the Pulse Gen memory. The number of
+        instructions encoded is the length of `address`.
+    duration : int or array_like of int
+        `duration` ∈ [1, 281474976710655].
+        See `encode_instruction`.
+    state : int or array_like
+        The low/high output state for each of the 24 channels. Either a 1D array
+        of ints (one per instruction), or a 2D array with one row per
+        instruction, where the column index corresponds to the channel. See
+        `states_multiformat_to_int`.
+    goto_address : int or array_like of int, optional
+        `goto_address` ∈ [0, 8191].
+        See `encode_instruction`.
+    goto_counter : int or array_like of int, optional
+        `goto_counter` ∈ [0, 4294967295].
+        See `encode_instruction`.
+    stop_and_wait : bool or array_like of bool, optional
+        See `encode_instruction`.
+    hardware_trig_out : bool or array_like of bool, optional
+        See `encode_instruction`.
+    notify_computer : bool or array_like of bool, optional
+        See `encode_instruction`.
+    powerline_sync : bool or array_like of bool, optional
+        See `encode_instruction`.
+
+    Returns
+    -------
+    bytes
+        The raw bytes of all the instructions joined together, ready to be
+        uploaded to the Pulse Gen.
+
+    Raises
+    ------
+    TypeError
+        Arguments are checked for type to avoid undetermined behaviour of the
+        Pulse Gen.
+    ValueError
+        Arguments are checked to ensure they lie in a valid range to avoid
+        undetermined behaviour of Pulse Gen.
+
+    See Also
+    --------
+    encode_instruction : The function that encodes a single timing instruction,
+        which describes the meaning of each argument in detail.
+    """
+    address = _integer_array('address', address, 0, 8191)
+    instruction_num = address.size
+    duration =      _integer_array('duration', duration, 1, 281474976710655, instruction_num)
+    goto_address =  _integer_array('goto_address', goto_address, 0, 8191, instruction_num)
+    goto_counter =  _integer_array('goto_counter', goto_counter, 0, 4294967295, instruction_num)
+    stop_and_wait =     _tag_array('stop_and_wait', stop_and_wait, instruction_num)
+    hardware_trig_out = _tag_array('hardware_trig_out', hardware_trig_out, instruction_num)
+    notify_computer =   _tag_array('notify_computer', notify_computer, instruction_num)
+    powerline_sync =    _tag_array('powerline_sync', powerline_sync, instruction_num)
+    # Other consistancy checking
+    if np.any(powerline_sync & (address == 0)):
+        err_msg = f'Instruction at address=0 cannot have powerline_sync=True. The run would start automatically. See examples.py for workaround.'
+        raise ValueError(err_msg)
+    state = states_multiformat_to_int(state)
+    if state.ndim == 0:
+        state = np.full(instruction_num, state, dtype=np.uint64)
+    elif state.size != instruction_num:
+        err_msg = f'\'state\' must contain one state per instruction ({instruction_num}), not {state.size}'
+        raise ValueError(err_msg)
+    encoded = protocol.msgout_codecs['load_ram'].pack_arrays(address=address, state=state, duration=duration, goto_address=goto_address, goto_counter=goto_counter, 
+        stop_and_wait=stop_and_wait, hardware_trig_out=hardware_trig_out, notify_computer=notify_computer, powerline_sync=powerline_sync)
+    return encoded.tobytes()
+
+def _integer_array(name, values, minimum, maximum, size=None):
+    ''' Converts an argument of encode_instructions to a 1D uint64 array, checking type and range in bulk. '''
+    values = np.asarray(values)
+    if values.size == 0:
+        # An empty list is an array of floats
+        values = values.astype(np.uint64)
+    if not (np.issubdtype(values.dtype, np.integer) and values.ndim <= 1):
+        err_msg = f'\'{name}\' must be an int, np.integer or 1D array of integers, not a {values.ndim}D array of {values.dtype}'
+        raise TypeError(err_msg)
+    if values.size and (values.min() < minimum or values.max() > maximum):
+        err_msg = f'\'{name}\' out of range. Must be in range [{minimum}, {maximum}]'
+        raise ValueError(err_msg)
+    if size is None:
+        return np.atleast_1d(values).astype(np.uint64)
+    if values.ndim == 0:
+        return np.full(size, values, dtype=np.uint64)
+    if values.size != size:
+        err_msg = f'\'{name}\' must contain one value per instruction ({size}), not {values.size}'
+        raise ValueError(err_msg)
+    return values.astype(np.uint64)
+
+def _tag_array(name, values, size):
+    ''' Converts a tag argument of encode_instructions to a 1D bool array. Only bools (or 0 and 1) are accepted, as in encode_lookup. '''
+    values = np.asarray(values)
+    if values.size == 0:
+        values = values.astype(np.bool_)
+    if values.dtype != np.bool_:
+        if not np.issubdtype(values.dtype, np.integer) or np.any((values != 0) & (values != 1)):
+            err_msg = f'\'{name}\' must be a bool or an array of bools'
+            raise TypeError(err_msg)
+        values = values.astype(np.bool_)
+    if values.ndim == 0:
+        return np.full(size, values, dtype=np.bool_)
+    if values.ndim != 1 or values.size != size:
+        err_msg = f'\'{name}\' must contain one value per instruction ({size}), not {values.size}'
+        raise ValueError(err_msg)
+    return values
 
 def state_multiformat_to_int(state):
     """
@@ -979,17 +1291,79 @@ def state_multiformat_to_int(state):
         raise TypeError(err_msg)
     return state
 
+def states_multiformat_to_int(states):
+    """
+    The vectorised equivalent of `state_multiformat_to_int`. Takes the states
+    of many instructions at once, and returns them as an array of integers.
+
+    Parameters
+    ----------
+    states : int or array_like
+        Either an int or 1D array of ints, where the binary digits represent the
+        output state of the corresponding channel, or a 2D array with one row
+        per instruction, where the column index corresponds to the channel of
+        the Pulse Gen (and the boolean value of each element determines whether
+        that channel is low or high). A 2D array may have fewer than 24 columns,
+        in which case the remaining channels are low.
+
+    Returns
+    -------
+    numpy.ndarray
+        The states as uint64 integers. 0D if `states` was a single int,
+        otherwise 1D.
+
+    Raises
+    ------
+    TypeError
+        Arguments are checked for type to avoid undetermined behaviour of the
+        Pulse Gen.
+    ValueError
+        Arguments are checked to ensure they lie in a valid range to avoid
+        undetermined behaviour of Pulse Gen.
+
+    See Also
+    --------
+    state_multiformat_to_int : The equivalent function for a single state.
+    encode_instructions : function which calls `states_multiformat_to_int`.
+    """
+    states = np.asarray(states)
+    if states.size == 0:
+        states = states.astype(np.uint64)
+    if states.ndim <= 1:
+        if not np.issubdtype(states.dtype, np.integer):
+            err_msg = f'\'state\' must be an int, or a 1D array of ints, or a 2D array of channel states, not a {states.ndim}D array of {states.dtype}'
+            raise TypeError(err_msg)
+        if states.size and (states.min() < 0 or states.max() > 16777215):
+            err_msg = f'\'state\' out of range. If state is int, it must be in range [{bin(0)}, {bin(16777215)}]'
+            raise ValueError(err_msg)
+        return states.astype(np.uint64)
+    elif states.ndim == 2:
+        if states.shape[1] > 24:
+            err_msg = f'\'state\' too long. If state is a 2D array, it must have <= 24 columns'
+            raise ValueError(err_msg)
+        bits = np.zeros((states.shape[0], 24), dtype=np.bool_)
+        bits[:, :states.shape[1]] = states.astype(np.bool_)
+        packed = np.zeros((states.shape[0], 8), dtype=np.uint8)
+        packed[:, :3] = np.packbits(bits, axis=1, bitorder='little')
+        return packed.view('<u8').ravel().astype(np.uint64)
+    else:
+        err_msg = f'\'state\' must be an int, or a 1D array of ints, or a 2D array of channel states, not a {states.ndim}D array'
+        raise TypeError(err_msg)
+
 #########################################################
 # constants
-msgin_decodeinfo = {
-    100:{'message_length':3,    'decode_function':decode_internal_error,    'message_type':'error'},
-    101:{'message_length':9,    'decode_function':decode_echo,              'message_type':'echo'},
-    102:{'message_length':9,    'decode_function':decode_easyprint,         'message_type':'print'},
-    103:{'message_length':18,   'decode_function':decode_devicestate,       'message_type':'devicestate'},
-    104:{'message_length':4,    'decode_function':decode_notification,      'message_type':'notification'},
-    105:{'message_length':8,    'decode_function':decode_powerlinestate,    'message_type':'powerlinestate'}
+# The identifiers and lengths of the messages are in protocol.schema
+msgin_decode_functions = {
+    'error':            decode_internal_error,
+    'echo':             decode_echo,
+    'print':            decode_easyprint,
+    'devicestate':      decode_devicestate,
+    'notification':     decode_notification,
+    'powerlinestate':   decode_powerlinestate,
     }
 
+msgin_decodeinfo = {codec.identifier:{'message_length':codec.length, 'decode_function':msgin_decode_functions[message_type], 'message_type':message_type} for message_type, codec in protocol.msgin_codecs.items()}
+
 # This is a "reverse lookup" dictionaty for the msgin_decodeinfo. I don't think I use this much/at all. It can probably be deleted.
 msgin_identifier = {value['message_type']:key for key, value in msgin_decodeinfo.items()}
 
@@ -1014,15 +1388,7 @@ decode_lookup = {
     'error_info':{1:'echo', 2:'load_instruction', 3:'action', 4:'debug', 5:'device_settings', 6:'set_static_state', 7:'powerline_trigger_settings'},
     }
 
-msgout_identifier = {
-    'echo':150,
-    'load_ram':151,
-    'action_request':152,
-    'general_input':153,
-    'device_options':154,
-    'set_static_state':155,
-    'powerline_trigger_options':156
-    }
+msgout_identifier = {message_type:codec.identifier for message_type, codec in protocol.msgout_codecs.items()}
 
 encode_lookup = {
     'run_mode':{'single':0b10, 'continuous':0b11, None:0b00},
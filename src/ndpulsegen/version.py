@@ -0,0 +1,10 @@
+import functools
+
+@functools.lru_cache(maxsize=None)
+def package_version():
+    '''The installed version of ndpulsegen, or 'unknown' if it isn't installed (or is run on Python 3.7, which has no importlib.metadata).'''
+    try:
+        from importlib.metadata import version
+        return version('ndpulsegen')
+    except Exception as ex:
+        return 'unknown'
@@ -0,0 +1,147 @@
+'''
+Virtual Pulse Gens that appear as serial ports, so unmodified code (including code in other processes) can connect to them with
+PulseGenerator().connect(). Each virtual device is a PulseGenEmulator on the master side of a pseudo-terminal, and is registered so
+that PulseGenerator.get_connected_devices lists its slave side with the VID and PID of a real Pulse Gen. Only available on Linux
+(and other systems with pseudo-terminals).
+
+Any program on the computer can register a virtual device, so they are only listed by a PulseGenerator whose find_virtual_devices
+is True, which is the default when the NDPULSEGEN_VIRTUAL_DEVICES environment variable is set to 1.
+
+Run a virtual device until Ctrl-C with:
+    python -m ndpulsegen.virtual_device --serial-number 1234
+and connect to it from unmodified code run with NDPULSEGEN_VIRTUAL_DEVICES=1.
+
+Or use one from Python:
+    import ndpulsegen.virtual_device
+    with ndpulsegen.virtual_device.VirtualDevice(serial_number=1234) as device:
+        pg = ndpulsegen.PulseGenerator()
+        pg.find_virtual_devices = True
+        pg.connect(serial_number=1234)
+'''
+import argparse
+import json
+import os
+import select
+import tempfile
+import threading
+import serial.tools.list_ports_common
+from .emulator import PulseGenEmulator
+
+# The USB VID and PID of the FTDI chip in a real Pulse Gen. These are what PulseGenerator.get_connected_devices looks for.
+usb_vid = 1027
+usb_pid = 24592
+# Where every running virtual device leaves a description of itself.
+registry_directory = os.path.join(tempfile.gettempdir(), 'ndpulsegen_virtual_devices')
+
+
+class VirtualDevice():
+    '''
+    A PulseGenEmulator that can be connected to through a pseudo-terminal. The
+    device appears as soon as start is called (or the "with" block is
+    entered), and disappears when stop is called. "port" is the path of the
+    serial port to open, eg /dev/pts/3.
+    '''
+    def __init__(self, emulator=None, serial_number=None, idle_advance=10.0):
+        if emulator is None:
+            emulator = PulseGenEmulator() if serial_number is None else PulseGenEmulator(serial_number=serial_number)
+        self.emulator = emulator
+        self.idle_advance = idle_advance
+        self.port = None
+        self.close_event = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def registry_path(self):
+        return os.path.join(registry_directory, f'{self.emulator.serial_number}.json')
+
+    def start(self):
+        import tty
+        self.master_fd, self.slave_fd = os.openpty()
+        # The Pulse Gen protocol is binary, so the terminal must not echo or translate anything. The slave is kept open here too, so the
+        # master doesn't see a hangup every time a program closes the port (as device discovery does).
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.ser = self.emulator.open_serial(idle_advance=self.idle_advance)
+        self.close_event.clear()
+        self.threads = [threading.Thread(target=self.forward_to_emulator, daemon=True), threading.Thread(target=self.forward_to_host, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        os.makedirs(registry_directory, exist_ok=True)
+        with open(self.registry_path, 'w') as f:
+            json.dump({'device':self.port, 'vid':usb_vid, 'pid':usb_pid, 'serial_number':str(self.emulator.serial_number), 'process_id':os.getpid()}, f)
+
+    def stop(self):
+        try:
+            os.remove(self.registry_path)
+        except FileNotFoundError as ex:
+            pass
+        self.close_event.set()
+        self.ser.close()
+        for thread in self.threads:
+            thread.join()
+        os.close(self.slave_fd)
+        os.close(self.master_fd)
+
+    def forward_to_emulator(self):
+        # Everything the host writes to the port is a command for the emulator
+        while not self.close_event.is_set():
+            readable, writable, exceptional = select.select([self.master_fd], [], [], 0.1)
+            if readable:
+                self.ser.write(os.read(self.master_fd, 65536))
+
+    def forward_to_host(self):
+        # Everything the emulator sends is written to the port. The read also moves the emulator's clock on while nothing is being sent.
+        while not self.close_event.is_set():
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except serial.serialutil.SerialException as ex:
+                break
+            while data:
+                bytes_written = os.write(self.master_fd, data)
+                data = data[bytes_written:]
+
+
+def list_virtual_ports():
+    '''Returns a serial.tools.list_ports ListPortInfo for every running virtual device, in any process.'''
+    comports = []
+    if not os.path.isdir(registry_directory):
+        return comports
+    for file_name in sorted(os.listdir(registry_directory)):
+        try:
+            with open(os.path.join(registry_directory, file_name)) as f:
+                device_info = json.load(f)
+            # Devices left behind by processes that didn't stop them cleanly are ignored.
+            os.kill(device_info['process_id'], 0)
+        except (OSError, ValueError, KeyError) as ex:
+            continue
+        if not os.path.exists(device_info['device']):
+            continue
+        comport = serial.tools.list_ports_common.ListPortInfo(device_info['device'], skip_link_detection=True)
+        comport.vid = device_info['vid']
+        comport.pid = device_info['pid']
+        comport.serial_number = device_info['serial_number']
+        comport.description = 'Virtual Narwhal Devices Pulse Gen'
+        comports.append(comport)
+    return comports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a virtual Narwhal Devices Pulse Gen on a pseudo-terminal.')
+    parser.add_argument('--serial-number', type=int, default=1, help='The serial number the virtual device reports.')
+    parser.add_argument('--idle-advance', type=float, default=10.0, help='The most the virtual clock moves forward (in seconds) while waiting for each message.')
+    args = parser.parse_args(argv)
+
+    with VirtualDevice(serial_number=args.serial_number, idle_advance=args.idle_advance) as device:
+        print(f'Virtual Pulse Gen with serial number {args.serial_number} on {device.port}. Press Ctrl-C to stop.')
+        try:
+            device.close_event.wait()
+        except KeyboardInterrupt as ex:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+'''
+Fixtures and stand-ins for a Pulse Gen, shared by the tests. No Pulse Gen is needed.
+'''
+import threading
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from ndpulsegen.emulator import PulseGenEmulator
+
+# Encoded messages, as they would be sent by the Pulse Gen
+encoded_messages = {
+    'notification':     bytes([104, 5, 0, 0b001]),
+    'devicestate':      bytes([103]) + bytes(range(1, 18)),
+    'echo':             bytes([101, 209, 1, 2, 0x10, 0x27, 1, 0, 0]),
+    'powerlinestate':   bytes([105, 0b11, 1, 2, 3, 4, 5, 6]),
+    'error':            bytes([100, 0b100, 2]),
+    }
+
+def message_stream(message_num, seed=0):
+    '''A buffer of "message_num" encoded messages of random types.'''
+    rng = np.random.default_rng(seed)
+    message_types = rng.choice(list(encoded_messages.keys()), size=message_num)
+    return b''.join(encoded_messages[message_type] for message_type in message_types)
+
+def encode_notification(address, address_notify=False, trigger_notify=False, finished_notify=False):
+    return bytes([104, address & 0xFF, address >> 8, address_notify | trigger_notify << 1 | finished_notify << 2])
+
+
+class FakeSerial():
+    '''
+    Stands in for an open serial.Serial. Bytes passed to feed are read by the
+    PulseGenerator (at most "chunk_size" at a time, if given), and everything
+    written is kept in "written". Requests for an echo, the device state or the
+    powerline state are replied to with the messages in encoded_messages,
+    unless "reply" is False.
+    '''
+    def __init__(self, chunk_size=None, reply=True):
+        self.chunk_size = chunk_size
+        self.reply = reply
+        self.written = bytearray()
+        self.inbound = bytearray()
+        self.condition = threading.Condition()
+        self.timeout = 0.1
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            return len(self.inbound) if self.chunk_size is None else min(len(self.inbound), self.chunk_size)
+
+    def feed(self, data):
+        with self.condition:
+            self.inbound += data
+            self.condition.notify_all()
+
+    def read(self, size=1):
+        with self.condition:
+            if not self.inbound:
+                self.condition.wait(self.timeout)
+            if self.chunk_size is not None:
+                size = min(size, self.chunk_size)
+            data = bytes(self.inbound[:size])
+            del self.inbound[:size]
+        return data
+
+    def write(self, data):
+        self.written += data
+        if self.reply:
+            self.feed(self.replies(bytes(data)))
+        return len(data)
+
+    def replies(self, data):
+        replies = bytearray()
+        while data:
+            if data[0] == transcode.msgout_identifier['echo']:
+                replies += encoded_messages['echo'][:1] + data[1:2] + encoded_messages['echo'][2:]
+            elif data[0] == transcode.msgout_identifier['action_request']:
+                # The request_state and request_powerline_state tags
+                if data[1] & 0b010:
+                    replies += encoded_messages['devicestate']
+                if data[1] & 0b100:
+                    replies += encoded_messages['powerlinestate']
+            else:
+                # Nothing else is replied to
+                break
+            data = data[2:]
+        return bytes(replies)
+
+    def open(self):
+        self.is_open = True
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.inbound.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def fake_serial():
+    return FakeSerial()
+
+@pytest.fixture
+def fake_pg(fake_serial):
+    '''A PulseGenerator attached to a FakeSerial.'''
+    pg = ndpulsegen.PulseGenerator()
+    pg.attach_serial(fake_serial)
+    yield pg
+    pg.disconnect()
+
+@pytest.fixture
+def emulator():
+    return PulseGenEmulator()
+
+@pytest.fixture
+def pg(emulator):
+    '''A PulseGenerator attached to the emulator.'''
+    pg = ndpulsegen.PulseGenerator()
+    pg.attach_serial(emulator.open_serial(idle_advance=1.0))
+    yield pg
+    pg.disconnect()
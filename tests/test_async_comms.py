@@ -0,0 +1,65 @@
+'''
+Tests of AsyncPulseGenerator, using a stand-in serial port. No Pulse Gen is needed.
+'''
+import asyncio
+import pytest
+import ndpulsegen
+from .conftest import FakeSerial, encode_notification
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+async def attached_pulse_generator():
+    pg = ndpulsegen.AsyncPulseGenerator()
+    ser = FakeSerial()
+    pg.attach_serial(ser)
+    return pg, ser
+
+
+def test_attach_serial_binds_running_loop():
+    async def main():
+        pg, ser = await attached_pulse_generator()
+        try:
+            return pg.loop is asyncio.get_running_loop()
+        finally:
+            pg.disconnect()
+    assert run(main())
+
+def test_attach_serial_outside_loop():
+    pg = ndpulsegen.AsyncPulseGenerator()
+    with pytest.raises(RuntimeError):
+        pg.attach_serial(FakeSerial())
+
+def test_concurrent_get_state():
+    async def main():
+        pg, ser = await attached_pulse_generator()
+        try:
+            return await asyncio.gather(*[pg.get_state() for _ in range(5)])
+        finally:
+            pg.disconnect()
+    states = run(main())
+    assert all(state is not None for state in states)
+
+def test_wait_notification():
+    async def main():
+        pg, ser = await attached_pulse_generator()
+        try:
+            ser.feed(encode_notification(3, address_notify=True) + encode_notification(4, finished_notify=True))
+            return await pg.wait_notification(finished=True, timeout=5), await pg.wait_notification(timeout=0.1)
+        finally:
+            pg.disconnect()
+    notification, nothing = run(main())
+    assert notification['finished_notify']
+    assert notification['address'] == 4
+    assert nothing is None
+
+def test_return_on_notification():
+    async def main():
+        pg, ser = await attached_pulse_generator()
+        try:
+            with pytest.raises(NotImplementedError, match='wait_notification'):
+                pg.return_on_notification(timeout=0.1)
+        finally:
+            pg.disconnect()
+    run(main())
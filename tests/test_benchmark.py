@@ -0,0 +1,25 @@
+'''
+A quick run of the offline benchmarks, to check that they still work. No Pulse Gen is needed.
+'''
+import json
+from ndpulsegen import benchmark, version
+
+
+def test_benchmarks_run():
+    names = list(benchmark.benchmarks().keys())
+    assert 'decode_messages' in names
+    results = benchmark.run_benchmarks(['decode_echo', 'encode_instructions'], repeat=1)
+    assert set(results) == {'decode_echo', 'encode_instructions'}
+    assert all(result['items_per_second'] > 0 for result in results.values())
+
+def test_save_and_compare(tmp_path, capsys):
+    baseline_path = tmp_path/'baseline.json'
+    assert benchmark.main(['decode_echo', '--save', str(baseline_path)]) == 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    assert baseline['package_version'] == version.package_version()
+    # A baseline that is much slower can't be regressed from, and a much faster one always is
+    baseline['results']['decode_echo']['seconds_per_item'] *= 1000
+    assert benchmark.compare(benchmark.run_benchmarks(['decode_echo'], repeat=1), baseline) == []
+    baseline['results']['decode_echo']['seconds_per_item'] /= 1E6
+    assert benchmark.compare(benchmark.run_benchmarks(['decode_echo'], repeat=1), baseline) == ['decode_echo']
@@ -0,0 +1,79 @@
+'''
+Tests of CompileCache, using a temporary directory. No Pulse Gen is needed.
+'''
+import os
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import cache
+
+
+calls = []
+
+def compiler(duration, states=(0, 1)):
+    calls.append((duration, states))
+    return ndpulsegen.encode_instructions(np.arange(len(states)), duration, list(states))
+
+@pytest.fixture
+def compile_cache(tmp_path):
+    calls.clear()
+    return ndpulsegen.CompileCache(tmp_path)
+
+
+def test_hit_and_miss(compile_cache):
+    first = compile_cache.compile(compiler, 5, states=(1, 0, 1))
+    second = compile_cache.compile(compiler, 5, states=(1, 0, 1))
+    assert calls == [(5, (1, 0, 1))]
+    assert (compile_cache.hits, compile_cache.misses) == (1, 1)
+    assert isinstance(second, ndpulsegen.InstructionTable)
+    assert bytes(first.buffer) == bytes(second.buffer) == compiler(5, (1, 0, 1))
+
+def test_shared_directory(compile_cache):
+    compile_cache.compile(compiler, 5)
+    other = ndpulsegen.CompileCache(compile_cache.directory)
+    other.compile(compiler, 5)
+    assert len(calls) == 1
+    assert other.hits == 1
+
+def test_keys(tmp_path):
+    key = ndpulsegen.CompileCache(tmp_path).key
+    assert key(compiler, 1, states=(0, 1)) == key(compiler, 1, states=(0, 1))
+    assert key(compiler, 1) != key(compiler, 1.0)
+    assert key(compiler, [1, 2]) != key(compiler, (1, 2))
+    assert key(compiler, np.arange(3)) != key(compiler, np.arange(3, dtype=np.int32))
+    assert key(compiler, {'a':1, 'b':2}) == key(compiler, {'b':2, 'a':1})
+    with pytest.raises(TypeError):
+        key(compiler, object())
+
+def test_key_depends_on_versions(tmp_path, monkeypatch):
+    key = ndpulsegen.CompileCache(tmp_path).key(compiler, 1)
+    assert ndpulsegen.CompileCache(tmp_path, version='2').key(compiler, 1) != key
+    monkeypatch.setattr(cache, 'package_version', lambda: 'another version')
+    assert ndpulsegen.CompileCache(tmp_path).key(compiler, 1) != key
+
+def test_key_depends_on_the_code(tmp_path):
+    # Two versions of the same function, as if it was edited between runs
+    namespace = {}
+    exec('def edited(duration):\n    return duration*2', namespace)
+    first = namespace['edited']
+    exec('def edited(duration):\n    return duration*3', namespace)
+    second = namespace['edited']
+    key = ndpulsegen.CompileCache(tmp_path).key
+    assert key(first, 1) != key(second, 1)
+    exec('def edited(duration):\n    return duration*2', namespace)
+    assert key(first, 1) == key(namespace['edited'], 1)
+
+def test_eviction(tmp_path):
+    compile_cache = ndpulsegen.CompileCache(tmp_path, max_bytes=3*19*2)
+    for duration in range(1, 6):
+        compile_cache.compile(compiler, duration)
+    assert compile_cache.size <= compile_cache.max_bytes
+    compile_cache.clear()
+    assert compile_cache.size == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+def test_empty_program(compile_cache):
+    empty = compile_cache.compile(compiler, 1, states=())
+    assert len(empty) == 0
+    assert len(compile_cache.compile(compiler, 1, states=())) == 0
+    assert compile_cache.hits == 1
@@ -0,0 +1,90 @@
+'''
+Tests of compile_sequence, checked against the output of every channel computed one clock cycle at a time. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def cycle_by_cycle(edges, pulses, duration, initial_state=0):
+    # The state in every clock cycle of the sequence
+    states = np.zeros(duration, dtype=np.int64)
+    for channel in range(24):
+        levels = np.full(duration, (initial_state >> channel) & 1, dtype=np.int64)
+        # In time order. Of several edges at the same time, the last one given wins.
+        for time, level in sorted(edges.get(channel, []), key=lambda edge: edge[0]):
+            levels[time:] = level
+        for start, stop in pulses.get(channel, []):
+            levels[start:stop] = 1
+        states |= levels << channel
+    return states
+
+def expand(table):
+    return np.repeat(table.state, table.duration.astype(np.int64))
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_cycle_by_cycle(seed):
+    rng = np.random.default_rng(seed)
+    duration = 200
+    edges = {int(channel):[(int(time), int(level)) for time, level in zip(rng.integers(0, duration, 8), rng.integers(0, 2, 8))] for channel in rng.choice(24, 4, replace=False)}
+    # Some channels have both edges and pulses
+    pulses = {}
+    for channel in rng.choice(24, 6, replace=False):
+        starts = rng.integers(0, duration, 4)
+        pulses[int(channel)] = [(int(start), int(min(start + rng.integers(0, 40), duration))) for start in starts]
+    initial_state = int(rng.integers(0, 2**24))
+    table = ndpulsegen.compile_sequence(edges=edges, pulses=pulses, duration=duration, initial_state=initial_state)
+    assert np.array_equal(expand(table), cycle_by_cycle(edges, pulses, duration, initial_state))
+    # Minimal: neighbouring instructions always differ
+    assert np.all(table.state[1:] != table.state[:-1])
+    assert table.address.tolist() == list(range(len(table)))
+
+def test_initial_state():
+    table = ndpulsegen.compile_sequence(edges={0:[(5, 0)], 3:[(2, 1)]}, duration=10, initial_state=0b11)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(2, 0b0011), (3, 0b1011), (5, 0b1010)]
+
+def test_edges_and_pulses_on_one_channel():
+    # The channel stays at its initial state until its first edge, and pulses are high on top of that
+    table = ndpulsegen.compile_sequence(edges={0:[(10, 0)]}, pulses={0:[(5, 8)]}, duration=20, initial_state=1)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(10, 1), (10, 0)]
+    table = ndpulsegen.compile_sequence(edges={0:[(10, 0)]}, pulses={0:[]}, duration=20, initial_state=1)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(10, 1), (10, 0)]
+    table = ndpulsegen.compile_sequence(edges={0:[]}, pulses={0:[(5, 8)]}, duration=20)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(5, 0), (3, 1), (12, 0)]
+    table = ndpulsegen.compile_sequence(pulses={0:[(5, 8)]}, duration=20, initial_state=1)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(20, 1)]
+
+def test_edges_at_the_same_time():
+    table = ndpulsegen.compile_sequence(edges={1:[(4, 1), (4, 0), (4, 1)]}, duration=6)
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(4, 0), (2, 0b10)]
+
+def test_edge_array_format():
+    a = ndpulsegen.compile_sequence(edges={2:(np.array([1, 3]), np.array([1, 0]))})
+    b = ndpulsegen.compile_sequence(edges={2:[(1, 1), (3, 0)]})
+    assert bytes(a.buffer) == bytes(b.buffer)
+    # The default duration is one cycle after the last edge
+    assert int(b.duration.sum()) == 4
+
+def test_seconds():
+    table = ndpulsegen.compile_sequence(pulses={0:[(1E-6, 2E-6)]}, duration=5E-6, time_unit='seconds')
+    assert list(zip(table.duration.tolist(), table.state.tolist())) == [(100, 0), (100, 1), (300, 0)]
+
+def test_long_durations_are_split():
+    table = ndpulsegen.compile_sequence(edges={0:[(1, 1)]}, duration=2**49)
+    assert table.state.tolist() == [0, 1, 1, 1]
+    assert int(table.duration.astype(object).sum()) == 2**49
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        ndpulsegen.compile_sequence(edges={24:[(1, 1)]})
+    with pytest.raises(ValueError):
+        ndpulsegen.compile_sequence(edges={0:[(-1, 1)]})
+    with pytest.raises(ValueError):
+        ndpulsegen.compile_sequence(edges={0:[(10, 1)]}, duration=5)
+    with pytest.raises(ValueError):
+        ndpulsegen.compile_sequence(pulses={0:[(5, 2)]})
+    with pytest.raises(TypeError):
+        ndpulsegen.compile_sequence(edges={0:[(1.5, 1)]})
+    with pytest.raises(ValueError):
+        ndpulsegen.compile_sequence(edges={0:[(1, 1)]}, time_unit='minutes')
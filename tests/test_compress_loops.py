@@ -0,0 +1,84 @@
+'''
+Tests of compiler.compress_loops. Compressed programs are checked by executing
+them with the goto_counter rules of the Pulse Gen. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def flat_program(durations, states):
+    return ndpulsegen.InstructionTable.from_arrays(np.arange(len(durations)) % 8192, durations, states)
+
+def execute(table):
+    # Returns the (duration, state) of every instruction executed in a run, following the loops.
+    durations, states = table.duration.tolist(), table.state.tolist()
+    goto_addresses, goto_counters = table.goto_address.tolist(), table.goto_counter.tolist()
+    volitile_counters = {}
+    executed = []
+    address = 0
+    while True:
+        executed.append((durations[address], states[address]))
+        counter = volitile_counters.get(address, goto_counters[address])
+        if counter:
+            volitile_counters[address] = counter - 1
+            address = goto_addresses[address]
+        else:
+            volitile_counters.pop(address, None)
+            if address == len(table) - 1:
+                return executed
+            address += 1
+
+def check_equivalent(original, compression):
+    assert compression.instructions.address.tolist() == list(range(compression.instruction_number))
+    assert execute(compression.instructions) == list(zip(original.duration.tolist(), original.state.tolist()))
+
+
+def test_single_repeat():
+    original = flat_program([1, 2, 3]*50, [1, 2, 3]*50)
+    compression = ndpulsegen.compress_loops(original)
+    assert compression.instruction_number == 3
+    assert compression.original_instruction_number == 150
+    assert compression.compression_ratio == 50
+    assert compression.upload_time_saved > 0
+    check_equivalent(original, compression)
+
+def test_nested_repeats():
+    # A block that ends with an inner loop, repeated 20 times
+    block = [1, 2]*10 + [3]
+    sequence = [5]*3 + block*20 + [4]
+    original = flat_program(sequence, sequence)
+    compression = ndpulsegen.compress_loops(original)
+    assert compression.instruction_number < 12
+    check_equivalent(original, compression)
+
+def test_random_repeats():
+    rng = np.random.default_rng(3)
+    pieces = []
+    for _ in range(30):
+        body = rng.integers(1, 4, size=rng.integers(1, 5)).tolist()
+        pieces += body*int(rng.integers(1, 6))
+    original = flat_program(pieces, pieces)
+    compression = ndpulsegen.compress_loops(original, max_period=8)
+    assert compression.instruction_number <= len(original)
+    check_equivalent(original, compression)
+
+def test_nothing_to_compress():
+    original = flat_program([1, 2, 3, 4], [0, 1, 0, 1])
+    compression = ndpulsegen.compress_loops(original.buffer)
+    assert compression.instruction_number == 4
+    check_equivalent(original, compression)
+
+def test_rejects_loops():
+    original = ndpulsegen.InstructionTable.from_arrays([0, 1], [1, 1], [0, 1], goto_address=[0, 0], goto_counter=[0, 3])
+    with pytest.raises(ValueError):
+        ndpulsegen.compress_loops(original)
+
+def test_too_long_after_compression():
+    # Every instruction is different, so nothing can be compressed
+    original = flat_program(np.arange(1, 8194), np.zeros(8193, dtype=np.int64))
+    with pytest.raises(ValueError, match='8192'):
+        ndpulsegen.compress_loops(original, max_period=1)
+    # A long sequence that compresses to fit is fine
+    compression = ndpulsegen.compress_loops(flat_program([1, 2]*5000, [0, 1]*5000))
+    assert compression.instruction_number == 2
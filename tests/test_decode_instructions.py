@@ -0,0 +1,45 @@
+'''Offline tests of transcode.decode_instructions. No Pulse Gen is needed.'''
+import mmap
+import numpy as np
+import pytest
+from ndpulsegen import transcode
+from .test_encode_instructions import random_arguments
+
+
+def test_round_trip():
+    arguments = random_arguments(300, seed=1)
+    decoded = transcode.decode_instructions(transcode.encode_instructions(**arguments))
+    assert set(decoded.keys()) == set(arguments.keys())
+    for name, values in arguments.items():
+        assert np.array_equal(decoded[name], values), name
+    for tag in ('stop_and_wait', 'hardware_trig_out', 'notify_computer', 'powerline_sync'):
+        assert decoded[tag].dtype == np.bool_
+
+def test_matches_encode_instruction():
+    encoded = transcode.encode_instruction(8191, 281474976710655, 16777215, goto_address=8191, goto_counter=4294967295, stop_and_wait=True, powerline_sync=True)
+    decoded = transcode.decode_instructions(encoded)
+    assert {name:values.tolist() for name, values in decoded.items()} == {'address':[8191], 'duration':[281474976710655], 'state':[16777215],
+        'goto_address':[8191], 'goto_counter':[4294967295], 'stop_and_wait':[True], 'hardware_trig_out':[False], 'notify_computer':[False], 'powerline_sync':[True]}
+
+@pytest.mark.parametrize('make_buffer', [bytes, bytearray, memoryview, lambda encoded: np.frombuffer(encoded, dtype=np.uint8)])
+def test_buffer_types(make_buffer):
+    encoded = transcode.encode_instructions([0, 1], [5, 6], [1, 2])
+    assert transcode.decode_instructions(make_buffer(encoded))['duration'].tolist() == [5, 6]
+
+def test_mmap():
+    encoded = transcode.encode_instructions([0, 1, 2], [5, 6, 7], 0)
+    with mmap.mmap(-1, len(encoded)) as buffer:
+        buffer.write(encoded)
+        assert transcode.decode_instructions(buffer)['duration'].tolist() == [5, 6, 7]
+
+def test_empty():
+    decoded = transcode.decode_instructions(b'')
+    assert all(values.size == 0 for values in decoded.values())
+
+def test_invalid():
+    encoded = transcode.encode_instructions([0, 1], 5, 0)
+    with pytest.raises(ValueError):
+        transcode.decode_instructions(encoded[:-1])
+    with pytest.raises(ValueError):
+        # The second instruction has the identifier of another message
+        transcode.decode_instructions(encoded[:19] + bytes([transcode.msgout_identifier['action_request']]) + encoded[20:])
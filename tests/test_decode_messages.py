@@ -0,0 +1,65 @@
+'''
+Tests of decoding messages from a stream of bytes, with transcode.decode_messages and in the monitor thread. No Pulse Gen is needed.
+'''
+import time
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from .conftest import FakeSerial, message_stream
+
+
+def comparable(messages):
+    # Messages with the timestamp removed, and arrays (the devicestate 'state') as lists, so they can be compared with ==
+    return [(message_type, {key:(value.tolist() if isinstance(value, np.ndarray) else value) for key, value in message.items() if key != 'timestamp'})
+        for message_type, message in messages]
+
+
+def test_whole_buffer():
+    stream = message_stream(500)
+    messages, bytes_decoded = transcode.decode_messages(stream)
+    assert bytes_decoded == len(stream)
+    assert len(messages) == 500
+    assert {message_type for message_type, message in messages} == {'notification', 'devicestate', 'echo', 'powerlinestate', 'error'}
+
+def test_partial_message_is_left():
+    stream = message_stream(20)
+    whole_messages, bytes_decoded = transcode.decode_messages(stream)
+    for split in range(len(stream)):
+        first, first_decoded = transcode.decode_messages(stream[:split])
+        rest, rest_decoded = transcode.decode_messages(stream[first_decoded:])
+        assert first_decoded <= split
+        assert comparable(first + rest) == comparable(whole_messages)
+
+def test_invalid_identifiers_are_dropped():
+    notification = bytes([104, 5, 0, 0b001])
+    messages, bytes_decoded = transcode.decode_messages(bytes([0, 1]) + notification)
+    assert [message_type for message_type, message in messages] == ['bytes_dropped', 'bytes_dropped', 'notification']
+    assert messages[1][1]['message_identifier'] == 1
+    assert messages[2][1]['address'] == 5
+    assert bytes_decoded == 6
+
+def test_raw_message_types():
+    devicestate = bytes([103]) + bytes(range(1, 18))
+    messages, bytes_decoded = transcode.decode_messages(devicestate*2, raw_message_types={'devicestate'})
+    assert messages == [('devicestate', bytes(range(1, 18)))]*2
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_monitor_thread(chunk_size):
+    # The bytes arrive a few at a time, so messages are split across reads
+    stream = message_stream(300, seed=2)
+    expected, bytes_decoded = transcode.decode_messages(stream)
+    pg = ndpulsegen.PulseGenerator()
+    ser = FakeSerial(chunk_size=chunk_size)
+    pg.attach_serial(ser)
+    ser.feed(stream)
+    try:
+        deadline = time.time() + 5
+        while sum(q.qsize() for q in pg.msgin_queues.values()) < len(expected) and time.time() < deadline:
+            time.sleep(0.01)
+        received = {message_type:list(q.queue) for message_type, q in pg.msgin_queues.items()}
+    finally:
+        pg.disconnect()
+    for message_type, messages in received.items():
+        assert all('timestamp' in message for message in messages)
+        assert comparable([(message_type, message) for message in messages]) == comparable([message for message in expected if message[0] == message_type])
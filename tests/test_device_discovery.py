@@ -0,0 +1,65 @@
+'''
+Tests of device discovery with get_connected_devices, using stand-in serial ports. No Pulse Gen is needed.
+'''
+import time
+import pytest
+import serial
+import serial.tools.list_ports
+import serial.tools.list_ports_common
+import ndpulsegen
+from .conftest import FakeSerial
+
+
+def comport(device, vid=1027, pid=24592):
+    comport = serial.tools.list_ports_common.ListPortInfo(device, skip_link_detection=True)
+    comport.vid = vid
+    comport.pid = pid
+    return comport
+
+@pytest.fixture
+def ports(monkeypatch):
+    # Three ports that look like Pulse Gens, of which only one replies, and one port of some other device
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: [comport('/dev/fake0'), comport('/dev/fake1'), comport('/dev/fake2'), comport('/dev/other', vid=1)])
+    probed = []
+    def probe_port(port, timeout=1):
+        probed.append(port)
+        # Each probe takes half a second, like a device that is slow to reply
+        time.sleep(0.5)
+        if port == '/dev/fake1':
+            return {'device_type':1, 'hardware_version':2, 'firmware_version':3, 'serial_number':12345}
+        return None
+    return probe_port, probed
+
+
+def test_probes_in_parallel(ports):
+    probe_port, probed = ports
+    pg = ndpulsegen.PulseGenerator()
+    pg.probe_port = probe_port
+    t0 = time.perf_counter()
+    devices = pg.get_connected_devices()
+    elapsed = time.perf_counter() - t0
+    assert sorted(probed) == ['/dev/fake0', '/dev/fake1', '/dev/fake2']
+    assert devices['validated_devices'] == [{'device_type':1, 'hardware_version':2, 'firmware_version':3, 'serial_number':12345, 'comport':'/dev/fake1'}]
+    assert devices['unvalidated_devices'] == ['/dev/fake0', '/dev/fake2']
+    # The probes are waited for at the same time
+    assert elapsed < 1.0
+
+def test_missing_device(ports):
+    probe_port, probed = ports
+    pg = ndpulsegen.PulseGenerator()
+    pg.probe_port = probe_port
+    with pytest.raises(Exception, match='44444'):
+        pg.connect(serial_number=44444)
+
+def test_probe_port(monkeypatch):
+    monkeypatch.setattr(serial, 'Serial', FakeSerial)
+    device_info = ndpulsegen.PulseGenerator().probe_port('/dev/fake0')
+    assert device_info['serial_number'] == 1
+    assert 'echoed_byte' not in device_info
+
+def test_probe_silent_port(monkeypatch):
+    monkeypatch.setattr(serial, 'Serial', lambda: FakeSerial(reply=False))
+    assert ndpulsegen.PulseGenerator().probe_port('/dev/fake0', timeout=0.2) is None
+
+def test_probe_missing_port():
+    assert ndpulsegen.PulseGenerator().probe_port('/dev/does_not_exist', timeout=0.1) is None
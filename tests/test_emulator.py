@@ -0,0 +1,124 @@
+'''
+Tests of PulseGenEmulator, driving it directly with encoded commands. No Pulse Gen is needed.
+'''
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from ndpulsegen.emulator import PulseGenEmulator
+
+
+def replies(emulator):
+    messages, bytes_decoded = transcode.decode_messages(emulator.read(emulator.in_waiting))
+    return messages
+
+def load(emulator, instructions, **options):
+    emulator.write(b''.join(instructions))
+    emulator.write(transcode.encode_device_options(final_ram_address=len(instructions) - 1, software_run_enable=True, **options))
+
+def run_to_end(emulator, seconds=1):
+    # Returns the notifications sent during the run, with the virtual time (in cycles) that each was read at
+    notifications = []
+    while emulator.advance(seconds=seconds, stop_on_output=True):
+        notifications += [(emulator.time, message) for message_type, message in replies(emulator) if message_type == 'notification']
+    notifications += [(emulator.time, message) for message_type, message in replies(emulator) if message_type == 'notification']
+    return notifications
+
+
+def test_echo():
+    emulator = PulseGenEmulator(serial_number=555, firmware_version=1234)
+    emulator.write(transcode.encode_echo(b'\x07'))
+    [(message_type, message)] = replies(emulator)
+    assert message_type == 'echo'
+    assert dict(message) == {'echoed_byte':b'\x07', 'device_type':1, 'hardware_version':1, 'firmware_version':'1.234', 'serial_number':555}
+
+def test_run_timing():
+    emulator = PulseGenEmulator()
+    load(emulator, [transcode.encode_instruction(0, 100, [1], notify_computer=True), transcode.encode_instruction(1, 50, [0], notify_computer=True)], notify_when_run_finished=True)
+    emulator.write(transcode.encode_action(trigger_now=True))
+    notifications = run_to_end(emulator)
+    assert [(time, message['address'], message['finished_notify']) for time, message in notifications] == [(0, 0, False), (100, 1, False), (150, 1, True)]
+
+def test_loops_match_simulate_run():
+    instructions = [transcode.encode_instruction(0, 3, [1]), transcode.encode_instruction(1, 7, [0], goto_address=0, goto_counter=10**9),
+        transcode.encode_instruction(2, 5, [1], goto_address=0, goto_counter=10**6), transcode.encode_instruction(3, 1, [0])]
+    emulator = PulseGenEmulator()
+    load(emulator, instructions, notify_when_run_finished=True)
+    emulator.write(transcode.encode_action(trigger_now=True))
+    [(time, finished)] = run_to_end(emulator, seconds=1E9)
+    assert finished['finished_notify']
+    assert time == ndpulsegen.simulate_run(instructions).total_duration
+
+def test_continuous_run():
+    emulator = PulseGenEmulator()
+    load(emulator, [transcode.encode_instruction(0, 10, [1], notify_computer=True)], run_mode='continuous')
+    emulator.write(transcode.encode_action(trigger_now=True))
+    emulator.advance(cycles=35)
+    assert len(replies(emulator)) == 4
+    emulator.write(transcode.encode_action(disable_after_current_run=True))
+    emulator.advance(cycles=100)
+    assert not emulator.is_pending()
+
+def test_stop_and_wait():
+    emulator = PulseGenEmulator()
+    load(emulator, [transcode.encode_instruction(0, 10, [1], stop_and_wait=True), transcode.encode_instruction(1, 10, [0], notify_computer=True)])
+    emulator.write(transcode.encode_action(trigger_now=True))
+    emulator.advance(cycles=100)
+    assert replies(emulator) == []
+    assert emulator.run_status == 'paused'
+    emulator.write(transcode.encode_action(trigger_now=True))
+    emulator.advance(cycles=1)
+    [(message_type, message)] = replies(emulator)
+    assert message['address'] == 1
+
+def test_hardware_trigger():
+    emulator = PulseGenEmulator()
+    load(emulator, [transcode.encode_instruction(0, 10, [1], notify_computer=True)], trigger_source='hardware')
+    emulator.write(transcode.encode_action(trigger_now=True))
+    emulator.advance(cycles=100)
+    assert replies(emulator) == []
+    emulator.hardware_trigger()
+    emulator.advance(cycles=100)
+    assert [message_type for message_type, message in replies(emulator)] == ['notification']
+
+def test_powerline_sync():
+    emulator = PulseGenEmulator(powerline_period=1000)
+    load(emulator, [transcode.encode_instruction(0, 10, [1], notify_computer=True)], notify_when_run_finished=True)
+    emulator.write(transcode.encode_powerline_trigger_options(trigger_on_powerline=True, powerline_trigger_delay=0))
+    emulator.advance(cycles=123)
+    emulator.write(transcode.encode_action(trigger_now=True))
+    notifications = run_to_end(emulator)
+    assert [time for time, message in notifications] == [1000, 1010]
+
+def test_state_replies():
+    emulator = PulseGenEmulator()
+    emulator.write(transcode.encode_static_state([1, 0, 1]))
+    emulator.write(transcode.encode_device_options(final_ram_address=12, run_mode='continuous', trigger_source='either'))
+    emulator.write(transcode.encode_action(request_state=True, request_powerline_state=True))
+    [(devicestate_type, devicestate), (powerlinestate_type, powerlinestate)] = replies(emulator)
+    assert (devicestate_type, powerlinestate_type) == ('devicestate', 'powerlinestate')
+    assert devicestate['state'][:3].tolist() == [1, 0, 1]
+    assert (devicestate['final_ram_address'], devicestate['run_mode'], devicestate['trigger_source'], devicestate['running']) == (12, 'continuous', 'either', False)
+    assert powerlinestate['powerline_period'] == emulator.powerline_period
+
+def test_errors():
+    emulator = PulseGenEmulator()
+    emulator.write(bytes([0]))
+    [(message_type, message)] = replies(emulator)
+    assert message_type == 'error'
+    assert message['invalid_identifier_received']
+    # A command that is never finished is dropped when the clock moves on
+    emulator.write(transcode.encode_echo(b'\x01')[:1])
+    emulator.advance(cycles=10)
+    [(message_type, message)] = replies(emulator)
+    assert message_type == 'error'
+    assert message['timeout_waiting_to_receive_message']
+    emulator.write(transcode.encode_echo(b'\x02'))
+    assert [message_type for message_type, message in replies(emulator)] == ['echo']
+
+def test_pulse_generator_through_emulated_serial(pg, emulator):
+    pg.write_instructions([ndpulsegen.encode_instruction(0, 10, [1]), ndpulsegen.encode_instruction(1, 10, [0])])
+    pg.write_device_options(final_ram_address=1, notify_when_run_finished=True, software_run_enable=True)
+    pg.write_action(trigger_now=True)
+    assert pg.return_on_notification(finished=True, timeout=5)['finished_notify']
+    assert emulator.durations[:2] == [10, 10]
+    assert pg.get_state() is not None
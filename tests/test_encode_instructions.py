@@ -0,0 +1,48 @@
+'''Offline tests of transcode.encode_instructions. No Pulse Gen is needed.'''
+import numpy as np
+import pytest
+from ndpulsegen import transcode
+
+
+def random_arguments(instruction_num, seed=0):
+    rng = np.random.default_rng(seed)
+    powerline_sync = rng.random(instruction_num) < 0.5
+    powerline_sync[0] = False
+    return {'address':np.arange(instruction_num), 'duration':rng.integers(1, 2**48, instruction_num), 'state':rng.integers(0, 2**24, instruction_num),
+        'goto_address':rng.integers(0, 8192, instruction_num), 'goto_counter':rng.integers(0, 2**32, instruction_num),
+        'stop_and_wait':rng.random(instruction_num) < 0.5, 'hardware_trig_out':rng.random(instruction_num) < 0.5,
+        'notify_computer':rng.random(instruction_num) < 0.5, 'powerline_sync':powerline_sync}
+
+def test_matches_encode_instruction():
+    arguments = random_arguments(200)
+    expected = b''.join(transcode.encode_instruction(*(int(value[index]) if value.dtype != np.bool_ else bool(value[index]) for value in arguments.values()))
+        for index in range(200))
+    assert transcode.encode_instructions(**arguments) == expected
+
+def test_scalars_are_broadcast():
+    encoded = transcode.encode_instructions([1, 2, 3], 10, 0b101, notify_computer=True)
+    assert encoded == b''.join(transcode.encode_instruction(address, 10, 0b101, notify_computer=True) for address in [1, 2, 3])
+
+def test_channel_state_rows():
+    states = np.zeros((2, 24), dtype=np.bool_)
+    states[0, 3] = True
+    states[1, 23] = True
+    assert transcode.encode_instructions([0, 1], 1, states) == transcode.encode_instruction(0, 1, 1 << 3) + transcode.encode_instruction(1, 1, 1 << 23)
+
+@pytest.mark.parametrize('arguments', [([], 1, 0), ([], [], []), ([], [], [], [], [], [], [], [], [])])
+def test_empty(arguments):
+    assert transcode.encode_instructions(*arguments) == b''
+
+def test_out_of_range():
+    with pytest.raises(ValueError):
+        transcode.encode_instructions([0, 8192], 1, 0)
+    with pytest.raises(ValueError):
+        transcode.encode_instructions([0, 1], [1, 0], 0)
+    with pytest.raises(ValueError):
+        transcode.encode_instructions([0, 1], 1, 0, powerline_sync=[True, False])
+
+def test_wrong_type():
+    with pytest.raises(TypeError):
+        transcode.encode_instructions([0.5], 1, 0)
+    with pytest.raises(TypeError):
+        transcode.encode_instructions([0], 1, 0, stop_and_wait=[2])
@@ -0,0 +1,66 @@
+'''Offline tests of InstructionTable. No Pulse Gen is needed.'''
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from ndpulsegen.instruction_table import InstructionTable, instruction_dtype
+from .conftest import FakeSerial
+from .test_encode_instructions import random_arguments
+
+
+def test_from_arrays_columns():
+    arguments = random_arguments(100)
+    table = InstructionTable.from_arrays(**arguments)
+    assert len(table) == 100
+    assert table.nbytes == 100*19
+    for name, values in arguments.items():
+        assert np.array_equal(getattr(table, name), values)
+
+def test_from_bytes_is_a_view():
+    encoded = bytearray(transcode.encode_instructions([0, 1, 2], [5, 6, 7], [0, 1, 2]))
+    table = InstructionTable.from_bytes(encoded)
+    table.goto_counter[1] = 9
+    assert InstructionTable.from_bytes(bytes(encoded)).goto_counter.tolist() == [0, 9, 0]
+    assert bytes(table.buffer) == bytes(encoded)
+    read_only = InstructionTable.from_bytes(bytes(encoded))
+    with pytest.raises(ValueError):
+        read_only.goto_counter[1] = 1
+
+def test_acts_like_a_list_of_instructions():
+    instructions = [transcode.encode_instruction(address, 10 + address, [address % 2]) for address in range(5)]
+    table = InstructionTable.from_bytes(instructions)
+    assert list(table) == instructions
+    assert table[3] == instructions[3]
+    assert bytes(table) == b''.join(instructions)
+    assert isinstance(table[1:3], InstructionTable)
+    assert list(table[1:3]) == instructions[1:3]
+    assert list(table[table.duration > 12]) == instructions[3:]
+
+def test_sort_by_address():
+    table = InstructionTable.from_arrays([4, 0, 2], [1, 2, 3], 0)
+    ordered = table.sort_by_address()
+    assert ordered.address.tolist() == [0, 2, 4]
+    assert ordered.duration.tolist() == [2, 3, 1]
+
+def test_channel_states():
+    table = InstructionTable.from_arrays([0, 1], 1, [0b101, 1 << 23])
+    channel_states = table.channel_states
+    assert channel_states.shape == (2, 24)
+    assert np.flatnonzero(channel_states[0]).tolist() == [0, 2]
+    assert np.flatnonzero(channel_states[1]).tolist() == [23]
+
+def test_write_instructions_accepts_tables():
+    pg = ndpulsegen.PulseGenerator()
+    pg.ser = FakeSerial()
+    table = InstructionTable.from_arrays([0, 1], [3, 4], [1, 0])
+    pg.write_instructions(table)
+    assert bytes(pg.ser.written) == bytes(table.buffer)
+
+def test_invalid():
+    with pytest.raises(TypeError):
+        InstructionTable(np.zeros(3, dtype=np.uint8))
+    with pytest.raises(ValueError):
+        InstructionTable.from_bytes(bytes(20))
+    with pytest.raises(ValueError):
+        InstructionTable.from_bytes(bytes(19))
+    assert len(InstructionTable(np.zeros(0, dtype=instruction_dtype))) == 0
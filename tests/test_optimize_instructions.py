@@ -0,0 +1,88 @@
+'''
+Tests of optimize_instructions. Optimized programs are checked by executing them with the goto_counter rules, and comparing what is
+output with the original program. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def output(table, final_ram_address=None):
+    # Runs the program one instruction at a time. Returns the state changes as (time, state), and the tags that act when an instruction
+    # starts (or, for stop_and_wait, ends) as (time, tag bits).
+    by_address = {address:index for index, address in enumerate(table.address.tolist())}
+    durations, states, tags = table.duration.tolist(), table.state.tolist(), table.array['tags'].tolist()
+    goto_addresses, goto_counters = table.goto_address.tolist(), table.goto_counter.tolist()
+    if final_ram_address is None:
+        final_ram_address = max(by_address)
+    volitile_counters = {}
+    state_changes = []
+    events = []
+    time = 0
+    address = 0
+    while True:
+        index = by_address[address]
+        if not state_changes or state_changes[-1][1] != states[index]:
+            state_changes.append((time, states[index]))
+        if tags[index] & 0b1110:
+            events.append((time, tags[index] & 0b1110))
+        time += durations[index]
+        if tags[index] & 0b1:
+            events.append((time, 0b1))
+        counter = volitile_counters.get(address, goto_counters[index])
+        if counter:
+            volitile_counters[address] = counter - 1
+            address = goto_addresses[index]
+        else:
+            volitile_counters.pop(address, None)
+            if address == final_ram_address:
+                return state_changes, events, time
+            address += 1
+
+def random_program(instruction_num, seed):
+    rng = np.random.default_rng(seed)
+    address = np.arange(instruction_num)
+    goto_counter = rng.integers(1, 4, instruction_num)*(rng.random(instruction_num) < 0.1)
+    goto_counter[0] = 0
+    goto_address = np.maximum(address - rng.integers(1, 6, instruction_num), 0)
+    # Few states and tags, so many neighbouring instructions can be merged
+    tags = [rng.random(instruction_num) < 0.05 for tag in range(3)]
+    return ndpulsegen.InstructionTable.from_arrays(address, rng.integers(1, 100, instruction_num), rng.integers(0, 2, instruction_num), goto_address, goto_counter, *tags)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_output_is_unchanged(seed):
+    original = random_program(80, seed)
+    optimization = ndpulsegen.optimize_instructions(original)
+    assert optimization.instruction_number < len(original)
+    assert optimization.instructions.address.tolist() == list(range(optimization.instruction_number))
+    assert output(optimization.instructions, optimization.final_ram_address) == output(original)
+
+def test_merges_runs_of_the_same_state():
+    original = ndpulsegen.InstructionTable.from_arrays([0, 1, 2, 3, 4], [1, 2, 3, 4, 5], [0, 0, 1, 1, 1])
+    optimization = ndpulsegen.optimize_instructions(original)
+    assert list(zip(optimization.instructions.duration.tolist(), optimization.instructions.state.tolist())) == [(3, 0), (12, 1)]
+    assert optimization.final_ram_address == 1
+    assert optimization.upload_time_saved > 0
+
+def test_loop_targets_are_kept():
+    # Address 1 is jumped back to, so it can't be merged into address 0
+    original = ndpulsegen.InstructionTable.from_arrays([0, 1, 2], [1, 2, 3], 0, goto_address=[0, 0, 1], goto_counter=[0, 0, 4])
+    optimization = ndpulsegen.optimize_instructions(original)
+    assert optimization.instruction_number == 2
+    assert output(optimization.instructions, optimization.final_ram_address) == output(original)
+
+def test_unexecuted_instructions():
+    original = ndpulsegen.InstructionTable.from_arrays([0, 1, 2, 5], [1, 2, 3, 4], [0, 1, 0, 1])
+    assert ndpulsegen.optimize_instructions(original, final_ram_address=2).instruction_number == 3
+    assert ndpulsegen.optimize_instructions(original, final_ram_address=2, remove_unexecuted=False).instruction_number == 4
+
+def test_durations_are_not_merged_beyond_the_maximum():
+    maximum = 281474976710655
+    original = ndpulsegen.InstructionTable.from_arrays([0, 1, 2], [maximum - 1, 5, 7], 1)
+    optimization = ndpulsegen.optimize_instructions(original)
+    assert optimization.instructions.duration.tolist() == [maximum - 1, 12]
+
+def test_missing_address():
+    with pytest.raises(ValueError):
+        ndpulsegen.optimize_instructions(ndpulsegen.InstructionTable.from_arrays([0, 2], 1, 0))
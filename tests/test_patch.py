@@ -0,0 +1,84 @@
+'''
+Tests of ProgramPatch, writing to the emulator. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def program(instruction_num=8):
+    return ndpulsegen.encode_instructions(np.arange(instruction_num), np.arange(instruction_num) + 10, np.arange(instruction_num), goto_address=0, goto_counter=0)
+
+def written(pg):
+    # Commands are processed in order, so once the state reply arrives every instruction written before it has been loaded
+    assert pg.get_state() is not None
+
+def test_first_write_sends_everything(pg, emulator):
+    patch = ndpulsegen.ProgramPatch(program())
+    assert patch.write(pg) == 8
+    assert patch.write(pg) == 0
+    written(pg)
+    assert emulator.durations[:8] == list(range(10, 18))
+
+@pytest.mark.parametrize('field, value, emulator_field', [('goto_address', 3, 'goto_addresses'), ('goto_counter', 123456, 'goto_counters')])
+def test_write_through_scalar_view(pg, emulator, field, value, emulator_field):
+    patch = ndpulsegen.ProgramPatch(program())
+    patch.write(pg)
+    view = patch.view(field, 5)
+    assert view.ndim == 0
+    view[...] = value
+    assert list(patch.dirty_addresses) == [5]
+    assert patch.write(pg) == 1
+    written(pg)
+    assert getattr(emulator, emulator_field)[5] == value
+    assert patch.instructions.array[field][5] == value
+
+def test_write_through_duration_view(pg, emulator):
+    patch = ndpulsegen.ProgramPatch(program())
+    patch.write(pg)
+    delay = patch.view('duration', 2)
+    for duration in [100, 2**40 + 7]:
+        delay[:] = np.array([duration], dtype='<u8').view(np.uint8)[:6]
+        assert patch.write(pg) == 1
+        written(pg)
+        assert emulator.durations[2] == duration
+
+def test_slice_view(pg, emulator):
+    patch = ndpulsegen.ProgramPatch(program())
+    patch.write(pg)
+    patch.view('goto_counter', slice(1, 4))[:] = [7, 8, 9]
+    assert list(patch.dirty_addresses) == [1, 2, 3]
+    patch.write(pg)
+    written(pg)
+    assert emulator.goto_counters[1:4] == [7, 8, 9]
+
+def test_set_methods(pg, emulator):
+    patch = ndpulsegen.ProgramPatch(program())
+    patch.write(pg)
+    patch.set_duration([0, 6], [50, 60])
+    patch.set_state(4, [1, 1, 0])
+    patch.set_goto(7, 1, 2)
+    assert list(patch.dirty_addresses) == [0, 4, 6, 7]
+    assert patch.write(pg) == 4
+    written(pg)
+    assert (emulator.durations[0], emulator.durations[6]) == (50, 60)
+    assert emulator.states[4] == 0b011
+    assert (emulator.goto_addresses[7], emulator.goto_counters[7]) == (1, 2)
+
+def test_unchanged_view_is_not_sent(pg, emulator):
+    patch = ndpulsegen.ProgramPatch(program())
+    patch.write(pg)
+    view = patch.view('goto_counter', 3)
+    view[...] = view.copy()
+    assert patch.write(pg) == 0
+
+def test_invalid_arguments():
+    patch = ndpulsegen.ProgramPatch(program())
+    with pytest.raises(ValueError):
+        patch.view('address', 0)
+    with pytest.raises(TypeError):
+        patch.view('duration', [0, 1])
+    with pytest.raises(ValueError):
+        patch.view('duration', 100)
+    with pytest.raises(ValueError):
+        patch.set_duration(0, 0)
@@ -0,0 +1,91 @@
+'''
+Tests of the message codecs generated from protocol.schema. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+from ndpulsegen import protocol, transcode
+
+codecs = [pytest.param(codec, id=f'{codec.direction}-{message_type}') for codecs in (protocol.msgin_codecs, protocol.msgout_codecs) for message_type, codec in codecs.items()]
+
+
+def value_widths(codec):
+    # The width in bits of every value of the codec, in order
+    widths = []
+    for name, offset, width, bits in codec.fields:
+        widths.extend([8*width] if bits is None else [bit_width for bit_name, bit_offset, bit_width in bits])
+    return widths
+
+def random_values(codec, rng, message_num):
+    return {name:rng.integers(0, 2**width, message_num, dtype=np.uint64) if width < 64 else rng.integers(0, 2**63, message_num, dtype=np.uint64)
+        for name, width in zip(codec.value_names, value_widths(codec))}
+
+
+@pytest.mark.parametrize('codec', codecs)
+def test_round_trip(codec):
+    rng = np.random.default_rng(codec.identifier)
+    values = random_values(codec, rng, 50)
+    for index in range(50):
+        message_values = [int(values[name][index]) for name in codec.value_names]
+        encoded = codec.pack(*message_values)
+        assert len(encoded) == codec.length
+        assert encoded[0] == codec.identifier
+        assert list(codec.unpack(encoded[1:])) == message_values
+
+@pytest.mark.parametrize('codec', codecs)
+def test_largest_values(codec):
+    largest = [2**width - 1 for width in value_widths(codec)]
+    assert list(codec.unpack(codec.pack(*largest)[1:])) == largest
+
+@pytest.mark.parametrize('codec', codecs)
+def test_arrays_match_single_messages(codec):
+    rng = np.random.default_rng(codec.identifier + 1)
+    values = random_values(codec, rng, 20)
+    encoded = codec.pack_arrays(**values)
+    assert encoded.dtype.itemsize == codec.length
+    assert encoded.tobytes() == b''.join(codec.pack(*(int(values[name][index]) for name in codec.value_names)) for index in range(20))
+    decoded = codec.unpack_arrays(encoded.tobytes())
+    assert list(decoded.keys()) == codec.value_names
+    for name in codec.value_names:
+        assert np.array_equal(decoded[name], values[name])
+
+@pytest.mark.parametrize('codec', codecs)
+def test_layout_table(codec):
+    table = codec.layout_table()
+    assert str(codec.identifier) in table
+    assert all(name in table for name in codec.value_names)
+
+def test_message_lengths():
+    # The lengths of the messages, including the identifier, as made by the FPGA design
+    assert {message_type:codec.length for message_type, codec in protocol.msgin_codecs.items()} == {'error':3, 'echo':9, 'print':9, 'devicestate':18, 'notification':4, 'powerlinestate':8}
+    assert {message_type:codec.length for message_type, codec in protocol.msgout_codecs.items()} == {'echo':2, 'load_ram':19, 'action_request':2, 'general_input':9,
+        'device_options':13, 'set_static_state':4, 'powerline_trigger_options':5}
+
+def test_identifiers_are_unique():
+    identifiers = [codec.identifier for codecs in (protocol.msgin_codecs, protocol.msgout_codecs) for codec in codecs.values()]
+    assert len(set(identifiers)) == len(identifiers)
+    assert transcode.msgin_decodeinfo[103]['message_length'] == 18
+    assert transcode.msgout_identifier['load_ram'] == 151
+
+def test_transcode_uses_the_codecs():
+    codec = protocol.msgout_codecs['load_ram']
+    assert transcode.encode_instruction(5, 1234, 0b101, 3, 7, stop_and_wait=True, notify_computer=True) == codec.pack(5, 0b101, 1234, 3, 7, 1, 0, 1, 0)
+    notification = transcode.decode_notification(protocol.msgin_codecs['notification'].pack(42, 1, 0, 1)[1:])
+    assert (notification['address'], notification['address_notify'], notification['trigger_notify'], notification['finished_notify']) == (42, True, False, True)
+
+def test_invalid():
+    codec = protocol.msgout_codecs['load_ram']
+    with pytest.raises(TypeError):
+        codec.pack_arrays(not_a_value=1)
+    with pytest.raises(ValueError):
+        codec.unpack_arrays(bytes(18))
+    with pytest.raises(ValueError):
+        codec.unpack_arrays(transcode.encode_echo(b'\x01')*19)
+    with pytest.raises(ValueError):
+        protocol.MessageCodec('repeated', 'out', 200, [('a', 0, 1), ('tags', 1, 1, [('a', 0, 1)])])
+
+def test_new_message_type():
+    codec = protocol.MessageCodec('example', 'out', 200, [('counter', 0, 5), ('tags', 5, 1, [('flag', 0, 1), ('mode', 1, 3)])])
+    assert codec.length == 7
+    encoded = codec.pack(2**40 - 1, 1, 5)
+    assert encoded == bytes([200]) + (2**40 - 1).to_bytes(5, 'little') + bytes([1 | 5 << 1])
+    assert codec.unpack(encoded[1:]) == (2**40 - 1, 1, 5)
@@ -0,0 +1,106 @@
+'''
+Tests of bounded message queues and their overflow policies, using the emulator. No Pulse Gen is needed.
+'''
+import asyncio
+import threading
+import time
+import pytest
+import ndpulsegen
+from ndpulsegen.emulator import PulseGenEmulator
+
+
+def send_echoes(pg, echo_num):
+    # The reply to the state request comes after every echo. Subscribers are called once the messages received with it have been queued.
+    queued = threading.Event()
+    callback = lambda message: queued.set()
+    pg.subscribe('devicestate', callback)
+    try:
+        for value in range(echo_num):
+            pg.write_echo(bytes([value]))
+        pg.request_state()
+        assert queued.wait(5)
+    finally:
+        pg.unsubscribe('devicestate', callback)
+
+def echoed_values(pg):
+    return [message['echoed_byte'][0] for message in pg.read_all_messages() if 'echoed_byte' in message]
+
+
+def test_drop_oldest(pg):
+    pg.set_queue_capacity('echo', 3)
+    send_echoes(pg, 10)
+    assert echoed_values(pg) == [7, 8, 9]
+    assert pg.dropped_messages['echo'] == 7
+
+def test_drop_newest(pg):
+    pg.set_queue_capacity('echo', 3, overflow='drop_newest')
+    send_echoes(pg, 10)
+    assert echoed_values(pg) == [0, 1, 2]
+    assert pg.dropped_messages['echo'] == 7
+
+def test_other_types_are_unlimited(pg):
+    pg.set_queue_capacity('notification', 1)
+    send_echoes(pg, 10)
+    assert len(echoed_values(pg)) == 10
+    assert pg.dropped_messages['echo'] == 0
+
+def test_block(pg):
+    pg.set_queue_capacity('echo', 2, overflow='block')
+    for value in range(6):
+        pg.write_echo(bytes([value]))
+    received = []
+    # Reading the serial port stops while the queue is full, so the echoes come out as they are consumed
+    def consume():
+        while len(received) < 6:
+            received.append(pg.msgin_queues['echo'].get(timeout=5)['echoed_byte'][0])
+    thread = threading.Thread(target=consume)
+    time.sleep(0.2)
+    assert pg.msgin_queues['echo'].qsize() == 2
+    thread.start()
+    thread.join(5)
+    assert received == list(range(6))
+    assert pg.dropped_messages['echo'] == 0
+
+def test_raising_the_capacity_unblocks(pg):
+    pg.set_queue_capacity('echo', 1, overflow='block')
+    send_echoes_thread = threading.Thread(target=send_echoes, args=(pg, 5))
+    send_echoes_thread.start()
+    time.sleep(0.2)
+    pg.set_queue_capacity('echo', 0)
+    send_echoes_thread.join(5)
+    assert echoed_values(pg) == list(range(5))
+
+def test_lowering_the_capacity(pg):
+    send_echoes(pg, 10)
+    pg.set_queue_capacity('echo', 5)
+    send_echoes(pg, 1)
+    # Old messages over the new capacity are dropped when the next one arrives
+    assert echoed_values(pg) == [6, 7, 8, 9, 0]
+    assert pg.dropped_messages['echo'] == 6
+    assert pg.get_state() is not None
+
+def test_invalid(pg):
+    with pytest.raises(ValueError):
+        pg.set_queue_capacity('not_a_message', 1)
+    with pytest.raises(ValueError):
+        pg.set_queue_capacity('echo', -1)
+    with pytest.raises(ValueError):
+        pg.set_queue_capacity('echo', 1, overflow='drop_some')
+
+def test_async_drop_oldest():
+    async def main():
+        pg = ndpulsegen.AsyncPulseGenerator()
+        pg.attach_serial(PulseGenEmulator().open_serial(idle_advance=1.0))
+        try:
+            with pytest.raises(ValueError):
+                pg.set_queue_capacity('echo', 1, overflow='block')
+            pg.set_queue_capacity('echo', 2)
+            for value in range(5):
+                pg.write_echo(bytes([value]))
+            # The batch of messages with the reply is put in the queues before the coroutine waiting for the reply resumes
+            assert await pg.get_state() is not None
+            await asyncio.sleep(0)
+            return [message['echoed_byte'][0] for message in pg.read_all_current_messages() if 'echoed_byte' in message], pg.dropped_messages['echo']
+        finally:
+            pg.disconnect()
+    assert asyncio.run(main()) == ([3, 4], 3)
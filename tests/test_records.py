@@ -0,0 +1,77 @@
+'''
+Tests of the decoded message records, and of connecting to a virtual device
+(which builds its device list from echo records). No Pulse Gen is needed.
+'''
+import json
+import sys
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from ndpulsegen.emulator import PulseGenEmulator
+
+
+def test_record_reads_like_a_dictionary():
+    message = transcode.EchoMessage(b'\xd1', 1, 2, 3, 1234)
+    assert message['serial_number'] == message.serial_number == 1234
+    assert dict(message) == {'echoed_byte':b'\xd1', 'device_type':1, 'hardware_version':2, 'firmware_version':3, 'serial_number':1234}
+    assert message == dict(message)
+    assert 'timestamp' not in message
+    assert message.get('timestamp') is None
+    with pytest.raises(KeyError):
+        message['timestamp']
+
+def test_record_changes_like_a_dictionary():
+    message = transcode.EchoMessage(b'\xd1', 1, 2, 3, 1234)
+    message['serial_number'] = 1
+    assert message.serial_number == 1
+    del message['echoed_byte']
+    assert 'echoed_byte' not in message
+    with pytest.raises(KeyError):
+        del message['echoed_byte']
+    # Keys that aren't fields are kept too
+    message.update(timestamp=1.5, comport='COM3')
+    assert message['comport'] == 'COM3'
+    assert message.pop('comport') == 'COM3'
+    assert dict(message) == {'device_type':1, 'hardware_version':2, 'firmware_version':3, 'serial_number':1, 'timestamp':1.5}
+
+def test_copy_is_a_dict():
+    message = transcode.NotificationMessage(5, True, False, False)
+    message['timestamp'] = 1.5
+    copy = message.copy()
+    assert type(copy) is dict
+    assert json.loads(json.dumps(copy)) == message
+    copy['address'] = 6
+    assert message['address'] == 5
+
+def test_decoded_messages_are_records():
+    emulator = PulseGenEmulator(serial_number=4321)
+    emulator.write(transcode.encode_echo(b'\x05'))
+    messages, bytes_decoded = transcode.decode_messages(emulator.read(emulator.in_waiting))
+    assert len(messages) == 1
+    message_type, message = messages[0]
+    assert message_type == 'echo'
+    assert isinstance(message, transcode.EchoMessage)
+    assert message['echoed_byte'] == b'\x05'
+    assert message['serial_number'] == 4321
+
+def test_received_messages_are_timestamped(pg):
+    state = pg.get_state()
+    assert isinstance(state, transcode.DeviceStateMessage)
+    assert 'timestamp' in state
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='virtual devices need pseudo-terminals')
+def test_connect_to_virtual_device():
+    from ndpulsegen.virtual_device import VirtualDevice
+    with VirtualDevice(serial_number=98765, idle_advance=1.0) as device:
+        pg = ndpulsegen.PulseGenerator()
+        pg.find_virtual_devices = True
+        devices = pg.get_connected_devices()['validated_devices']
+        device_info = [info for info in devices if info['serial_number'] == 98765]
+        assert len(device_info) == 1
+        assert device_info[0]['comport'] == device.port
+        assert 'echoed_byte' not in device_info[0]
+        pg.connect(serial_number=98765)
+        try:
+            assert pg.get_state() is not None
+        finally:
+            pg.disconnect()
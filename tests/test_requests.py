@@ -0,0 +1,85 @@
+'''
+Tests of matching devicestate and powerlinestate replies to the requests that asked for them, using the emulator. No Pulse Gen is needed.
+'''
+import concurrent.futures
+import threading
+import time
+import pytest
+import ndpulsegen
+from ndpulsegen.emulator import PulseGenEmulator
+from .conftest import FakeSerial
+
+
+def state_int(devicestate):
+    return int(''.join(str(bit) for bit in devicestate['state'][::-1]), 2)
+
+
+def test_each_request_gets_its_own_reply(pg):
+    futures = []
+    for state in range(5):
+        pg.write_static_state(state)
+        futures.append(pg.request_state())
+    assert [state_int(future.result(1)) for future in futures] == list(range(5))
+
+def test_queued_replies_are_kept_separate(pg):
+    pg.write_static_state(1)
+    pg.write_action(request_state=True)
+    pg.write_static_state(2)
+    future = pg.request_state()
+    pg.write_static_state(3)
+    pg.write_action(request_state=True, request_powerline_state=True)
+    assert state_int(future.result(1)) == 2
+    messages = pg.read_all_messages(timeout=0.5)
+    assert sorted(state_int(message) for message in messages if 'state' in message) == [1, 3]
+    assert len([message for message in messages if 'powerline_period' in message]) == 1
+
+def test_from_many_threads(pg):
+    results = []
+    def get_states():
+        results.extend(pg.get_state() is not None for repeat in range(20))
+    threads = [threading.Thread(target=get_states) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True]*80
+    assert not pg.pending_requests['devicestate']
+
+def test_powerline_state(pg):
+    powerlinestate = pg.get_powerline_state()
+    assert powerlinestate['powerline_period'] == 2000000
+    assert pg.request_powerline_state().result(1) is not None
+
+def test_lost_request_expires(pg):
+    # A request sent long ago that was never answered
+    lost = concurrent.futures.Future()
+    pg.pending_requests['devicestate'].append((time.time() - 2*pg.request_expiry, lost))
+    assert pg.get_state() is not None
+    with pytest.raises(TimeoutError):
+        lost.result(0)
+
+def test_lost_reply_expires_without_another_reply():
+    pg = ndpulsegen.PulseGenerator()
+    pg.attach_serial(FakeSerial(reply=False))
+    pg.request_expiry = 0.2
+    try:
+        t0 = time.perf_counter()
+        assert pg.get_state() is None
+        assert time.perf_counter() - t0 < 1
+        # No other devicestate reply ever arrives, so the monitor thread expires the request
+        future = pg.request_state()
+        with pytest.raises(TimeoutError):
+            future.result(1)
+        assert not pg.pending_requests['devicestate']
+    finally:
+        pg.disconnect()
+
+def test_disconnect_fails_pending_requests():
+    pg = ndpulsegen.PulseGenerator()
+    emulator = PulseGenEmulator()
+    pg.attach_serial(emulator.open_serial(idle_advance=1.0))
+    pending = concurrent.futures.Future()
+    pg.pending_requests['devicestate'].append((time.time(), pending))
+    pg.disconnect()
+    with pytest.raises(ConnectionError):
+        pending.result(0)
@@ -0,0 +1,78 @@
+'''
+Tests of StateSampler, sampling the emulator. No Pulse Gen is needed.
+'''
+import time
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def wait_for_samples(sampler, sample_number, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while sampler.sample_number < sample_number and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert sampler.sample_number >= sample_number
+
+
+def test_samples(pg):
+    pg.write_static_state([1, 0, 1])
+    with ndpulsegen.StateSampler(pg, rate=None, capacity=16) as sampler:
+        wait_for_samples(sampler, 40)
+        assert pg.raw_message_types == {'devicestate'}
+    assert pg.raw_message_types == frozenset()
+    snapshot = sampler.snapshot()
+    assert snapshot['timestamp'].size == 16
+    assert np.all(np.diff(snapshot['timestamp']) >= 0)
+    assert np.all(snapshot['state'] == 0b101)
+    assert sampler.channel_states.shape == (16, 24)
+    assert sampler.lost_number == 0
+
+def test_snapshot_since(pg):
+    with ndpulsegen.StateSampler(pg, rate=None) as sampler:
+        wait_for_samples(sampler, 5)
+        first = sampler.snapshot()
+        wait_for_samples(sampler, first['sample_number'] + 5)
+        since = sampler.snapshot(first['sample_number'])
+    assert since['timestamp'].size == since['sample_number'] - first['sample_number']
+    assert since['timestamp'][0] >= first['timestamp'][-1]
+
+def test_get_state_while_sampling(pg):
+    with ndpulsegen.StateSampler(pg, rate=None) as sampler:
+        wait_for_samples(sampler, 5)
+        assert pg.get_state() is not None
+        assert pg.msgin_queues['devicestate'].empty()
+
+def test_stop_without_start(pg):
+    sampler = ndpulsegen.StateSampler(pg)
+    sampler.stop()
+    assert pg.raw_message_types == frozenset()
+    sampler.start()
+    sampler.stop()
+    sampler.stop()
+    assert pg.raw_message_types == frozenset()
+
+def test_two_samplers(pg):
+    first = ndpulsegen.StateSampler(pg, rate=500)
+    second = ndpulsegen.StateSampler(pg, rate=500)
+    first.start()
+    second.start()
+    first.stop()
+    # The second sampler still gets its replies undecoded
+    assert pg.raw_message_types == {'devicestate'}
+    sample_number = second.sample_number
+    wait_for_samples(second, sample_number + 5)
+    second.stop()
+    assert pg.raw_message_types == frozenset()
+    assert pg.msgin_queues['devicestate'].empty()
+
+def test_snapshot_stays_valid_for_margin_samples():
+    sampler = ndpulsegen.StateSampler(None, capacity=4, margin=2)
+    for sample in range(7):
+        sampler.record(sample, sample, sample, True, True, False, 0)
+    snapshot = sampler.snapshot()
+    assert list(snapshot['timestamp']) == [3, 4, 5, 6]
+    for sample in range(7, 9):
+        sampler.record(sample, sample, sample, True, True, False, 0)
+        assert list(snapshot['timestamp']) == [3, 4, 5, 6]
+    assert list(sampler.snapshot()['timestamp']) == [5, 6, 7, 8]
+    assert list(sampler.snapshot(7)['state']) == [7, 8]
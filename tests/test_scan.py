@@ -0,0 +1,50 @@
+'''
+Tests of compile_scan. The templates are defined at the top level so the worker
+processes can unpickle them. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def template(duration, repeats):
+    return ndpulsegen.encode_instructions(np.arange(repeats), duration, np.arange(repeats) % 2)
+
+def list_template(duration, repeats):
+    return [ndpulsegen.encode_instruction(address, duration, [address % 2]) for address in range(repeats)]
+
+grid = {'duration':[1, 5, 100], 'repeats':[1, 4]}
+
+def expected(parameters):
+    return ndpulsegen.InstructionTable.from_bytes(bytearray(template(**parameters))).buffer
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_compile_in_order(workers):
+    results = list(ndpulsegen.compile_scan(template, grid, workers=workers))
+    assert [parameters for parameters, instructions in results] == [{'duration':d, 'repeats':r} for d in [1, 5, 100] for r in [1, 4]]
+    for parameters, instructions in results:
+        assert isinstance(instructions, ndpulsegen.InstructionTable)
+        assert bytes(instructions.buffer) == bytes(expected(parameters))
+
+def test_list_of_variants():
+    variants = [{'duration':7, 'repeats':3}, {'duration':2, 'repeats':2}]
+    results = list(ndpulsegen.compile_scan(list_template, variants, workers=2, max_pending=1))
+    assert [parameters for parameters, instructions in results] == variants
+    for parameters, instructions in results:
+        assert bytes(instructions.buffer) == bytes(expected(parameters))
+
+def test_stop_early():
+    scan = ndpulsegen.compile_scan(template, {'duration':range(1, 50), 'repeats':[2]}, workers=2)
+    parameters, instructions = next(scan)
+    assert parameters == {'duration':1, 'repeats':2}
+    scan.close()
+
+def test_cache(tmp_path):
+    cache = ndpulsegen.CompileCache(tmp_path)
+    first = list(ndpulsegen.compile_scan(template, grid, workers=2, cache=cache))
+    assert (cache.hits, cache.misses) == (0, 6)
+    second = list(ndpulsegen.compile_scan(template, grid, workers=2, cache=cache))
+    assert (cache.hits, cache.misses) == (6, 6)
+    for (parameters, a), (_, b) in zip(first, second):
+        assert bytes(a.buffer) == bytes(b.buffer) == bytes(expected(parameters))
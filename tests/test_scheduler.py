@@ -0,0 +1,53 @@
+'''
+Tests of ShotScheduler, running shots on the emulator. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+
+
+def shot_instructions(instruction_num, duration):
+    # Every instruction sends a notification, so the next shot can be preloaded as the run moves on
+    return ndpulsegen.InstructionTable.from_arrays(np.arange(instruction_num), duration, np.arange(instruction_num) % 2, notify_computer=True)
+
+
+def test_runs_every_shot(pg, emulator):
+    scheduler = ndpulsegen.ShotScheduler(pg)
+    lengths = [4, 6, 3, 6]
+    for index, instruction_num in enumerate(lengths):
+        scheduler.add_shot(shot_instructions(instruction_num, 1000 + index), software_run_enable=True)
+    results = list(scheduler.run())
+    assert len(results) == len(lengths)
+    assert [result['finished']['address'] for result in results] == [instruction_num - 1 for instruction_num in lengths]
+    assert results[0]['dead_time'] is None
+    assert all(result['dead_time'] >= 0 for result in results[1:])
+    # Every instruction of each shot is written once, either while the shot before it runs or between the shots
+    assert [result['preloaded'] + result['uploaded'] for result in results] == lengths
+    assert sum(result['preloaded'] for result in results) > 0
+    assert emulator.durations[:6] == [1003]*6
+    assert emulator.final_ram_address == 5
+
+def test_repeated_shot_is_not_uploaded_again(pg, emulator):
+    scheduler = ndpulsegen.ShotScheduler(pg)
+    for repeat in range(3):
+        scheduler.add_shot(shot_instructions(5, 100), software_run_enable=True)
+    results = list(scheduler.run())
+    assert [result['preloaded'] + result['uploaded'] for result in results] == [5, 0, 0]
+
+def test_invalid_shots(pg, emulator):
+    scheduler = ndpulsegen.ShotScheduler(pg)
+    with pytest.raises(ValueError):
+        scheduler.add_shot(shot_instructions(2, 10), run_mode='continuous')
+    with pytest.raises(ValueError):
+        scheduler.add_shot(ndpulsegen.InstructionTable.from_arrays([0, 0], 10, 0))
+    with pytest.raises(ValueError):
+        # The run would reach address 1, which isn't in the shot
+        scheduler.add_shot(ndpulsegen.InstructionTable.from_arrays([0, 2], 10, 0))
+
+def test_timeout(pg, emulator):
+    scheduler = ndpulsegen.ShotScheduler(pg)
+    # Never triggered, as the software run enable is off
+    scheduler.add_shot(shot_instructions(2, 10), timeout=0.2, software_run_enable=False)
+    scheduler.add_shot(shot_instructions(2, 10))
+    with pytest.raises(TimeoutError):
+        list(scheduler.run())
@@ -0,0 +1,78 @@
+'''
+Tests of simulate_run, checked against a simple simulation that follows every jump. No Pulse Gen is needed.
+'''
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+
+
+def random_instructions(instruction_num, seed):
+    # Random durations and states, with occasional short loops back to earlier addresses
+    rng = np.random.default_rng(seed)
+    addresses = np.arange(instruction_num)
+    goto_counters = rng.integers(1, 4, size=instruction_num)*(rng.random(instruction_num) < 0.1)
+    goto_counters[0] = 0
+    goto_addresses = np.maximum(addresses - rng.integers(1, 6, size=instruction_num), 0)
+    return transcode.encode_instructions(addresses, rng.integers(1, 10, size=instruction_num), rng.integers(0, 2, size=(instruction_num, 24)), goto_addresses, goto_counters)
+
+def unrolled_run(instructions, final_ram_address=None):
+    # Returns the address of every instruction executed, following the goto_counter rules one instruction at a time
+    decoded = transcode.decode_instructions(instructions)
+    goto_addresses = dict(zip(decoded['address'].tolist(), decoded['goto_address'].tolist()))
+    goto_counters = dict(zip(decoded['address'].tolist(), decoded['goto_counter'].tolist()))
+    if final_ram_address is None:
+        final_ram_address = max(goto_addresses)
+    volitile_counters = {}
+    executed = []
+    address = 0
+    while True:
+        executed.append(address)
+        counter = volitile_counters.get(address, goto_counters[address])
+        if counter:
+            volitile_counters[address] = counter - 1
+            address = goto_addresses[address]
+        else:
+            volitile_counters.pop(address, None)
+            if address == final_ram_address:
+                return executed
+            address += 1
+
+def expand(simulation):
+    executed = []
+    for start, stop, repetitions in simulation.executed_addresses():
+        executed += list(range(start, stop + 1))*repetitions
+    return executed
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_unrolled_run(seed):
+    instructions = random_instructions(300, seed=seed)
+    durations = transcode.decode_instructions(instructions)['duration']
+    executed = unrolled_run(instructions)
+    simulation = ndpulsegen.simulate_run(instructions)
+    assert expand(simulation) == executed
+    assert simulation.executed_instruction_number == len(executed)
+    assert simulation.execution_counts[:300].tolist() == np.bincount(executed, minlength=300).tolist()
+    assert simulation.total_duration == int(sum(durations[executed].tolist()))
+
+def test_final_ram_address():
+    instructions = random_instructions(100, seed=7)
+    assert expand(ndpulsegen.simulate_run(instructions, final_ram_address=50)) == unrolled_run(instructions, final_ram_address=50)
+
+def test_long_loops_are_not_unrolled():
+    # Three nested loops of 2**32 repeats each
+    instructions = ndpulsegen.InstructionTable.from_arrays([0, 1, 2, 3], [1, 2, 3, 4], [0, 1, 0, 1], goto_address=[0, 0, 0, 0], goto_counter=[0, 2**32 - 1, 2**32 - 1, 0])
+    simulation = ndpulsegen.simulate_run(instructions)
+    inner = 2**32*(1 + 2)
+    outer = 2**32*(inner + 3)
+    assert simulation.total_duration == outer + 4
+    assert simulation.execution_counts[:4].tolist() == [2**64, 2**64, 2**32, 1]
+
+def test_invalid_programs():
+    with pytest.raises(ValueError):
+        # Address 1 is never written
+        ndpulsegen.simulate_run(transcode.encode_instructions([0, 2], 1, 0))
+    with pytest.raises(ValueError):
+        # An infinite loop
+        ndpulsegen.simulate_run(transcode.encode_instruction(0, 1, 0) + transcode.encode_instruction(1, 1, 0, goto_address=0, goto_counter=1) + transcode.encode_instruction(2, 1, 0, goto_address=1, goto_counter=0), final_ram_address=5, max_steps=1000)
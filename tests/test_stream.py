@@ -0,0 +1,63 @@
+'''
+Tests of stream_instructions, streaming to the emulator. No Pulse Gen is needed.
+'''
+import time
+import numpy as np
+import pytest
+import ndpulsegen
+from ndpulsegen import transcode
+from ndpulsegen.emulator import EmulatedSerial, PulseGenEmulator
+
+
+class PacedSerial(EmulatedSerial):
+    '''An EmulatedSerial whose virtual clock moves no faster than real time, so the host has to keep up with the run as it would with a Pulse Gen.'''
+    def read(self, size=1):
+        if not self.emulator.in_waiting and self.emulator.is_pending():
+            time.sleep(self.idle_advance)
+        return super().read(size)
+
+
+@pytest.fixture
+def emulated():
+    emulator = PulseGenEmulator()
+    # Record the duration and state of every instruction the emulator executes
+    emulator.executed = []
+    start_instruction = emulator.start_instruction
+    def record_instruction(address):
+        emulator.executed.append((emulator.durations[address], emulator.states[address]))
+        start_instruction(address)
+    emulator.start_instruction = record_instruction
+    pg = ndpulsegen.PulseGenerator()
+    pg.attach_serial(PacedSerial(emulator, idle_advance=1E-3))
+    yield pg, emulator
+    pg.disconnect()
+
+def chunks(instruction_num, chunk_size):
+    # Generates the instructions a few at a time. The addresses are ignored, so they are allowed to wrap around.
+    for start in range(0, instruction_num, chunk_size):
+        index = np.arange(start, min(start + chunk_size, instruction_num))
+        yield transcode.encode_instructions(index % 8192, 200000 + index, index % 7)
+
+
+@pytest.mark.parametrize('instruction_num', [5, 16, 17, 100])
+def test_executes_every_instruction_in_order(emulated, instruction_num):
+    pg, emulator = emulated
+    result = ndpulsegen.stream_instructions(pg, chunks(instruction_num, 3), bank_size=8)
+    assert result.completed
+    assert result.instruction_number == instruction_num
+    assert result.underruns == 0
+    index = np.arange(instruction_num)
+    assert emulator.executed == list(zip((200000 + index).tolist(), (index % 7).tolist()))
+
+def test_empty(emulated):
+    pg, emulator = emulated
+    result = ndpulsegen.stream_instructions(pg, iter([]), bank_size=8)
+    assert result.instruction_number == 0
+    assert emulator.executed == []
+
+def test_invalid(emulated):
+    pg, emulator = emulated
+    with pytest.raises(ValueError):
+        ndpulsegen.stream_instructions(pg, chunks(10, 3), bank_size=4097)
+    with pytest.raises(ValueError):
+        ndpulsegen.stream_instructions(pg, [transcode.encode_instruction(0, 10, 0, goto_counter=2)], bank_size=8)
@@ -0,0 +1,73 @@
+'''
+Tests of message subscriptions and waiting for messages, using a stand-in serial port. No Pulse Gen is needed.
+'''
+import threading
+import time
+import pytest
+from .conftest import encode_notification
+
+
+def notifications(address_num=3):
+    # A notification for each address of a run, and one when it is finished
+    return b''.join(encode_notification(address, address_notify=True) for address in range(address_num)) + encode_notification(address_num - 1, finished_notify=True)
+
+
+def test_subscribe(fake_pg, fake_serial):
+    received = []
+    finished = threading.Event()
+    def callback(notification):
+        received.append(notification)
+        if notification['finished_notify']:
+            finished.set()
+    fake_pg.subscribe('notification', callback)
+    fake_serial.feed(notifications())
+    assert finished.wait(5)
+    assert [notification['address'] for notification in received if notification['address_notify']] == [0, 1, 2]
+    # Subscribed messages still go in the queues
+    assert fake_pg.return_on_notification(finished=True, timeout=1) is not None
+
+def test_unsubscribe(fake_pg):
+    received = []
+    fake_pg.subscribe('devicestate', received.append)
+    # Subscribers are also passed replies to get_state
+    assert fake_pg.get_state() is not None
+    fake_pg.write_action(request_state=True)
+    assert fake_pg.read_all_messages(timeout=0.5)
+    assert len(received) == 2
+    fake_pg.unsubscribe('devicestate', received.append)
+    fake_pg.write_action(request_state=True)
+    assert fake_pg.read_all_messages(timeout=0.5)
+    assert len(received) == 2
+
+def test_broken_callback(fake_pg, capsys):
+    def callback(message):
+        raise RuntimeError('broken callback')
+    fake_pg.subscribe('echo', callback)
+    fake_pg.write_echo(b'\x01')
+    fake_pg.write_echo(b'\x02')
+    messages = fake_pg.read_all_messages(timeout=0.5)
+    assert [message['echoed_byte'] for message in messages] == [b'\x01', b'\x02']
+    assert 'broken callback' in capsys.readouterr().err
+    assert fake_pg.get_state() is not None
+
+def test_invalid_message_type(fake_pg):
+    with pytest.raises(ValueError):
+        fake_pg.subscribe('not_a_message', print)
+
+def test_read_all_messages_waits(fake_pg):
+    def write_later():
+        time.sleep(0.2)
+        fake_pg.write_echo(b'\x05')
+    thread = threading.Thread(target=write_later)
+    thread.start()
+    messages = fake_pg.read_all_messages(timeout=1)
+    thread.join()
+    assert [message['echoed_byte'] for message in messages] == [b'\x05']
+    assert fake_pg.read_all_messages() == []
+
+def test_return_on_notification(fake_pg, fake_serial):
+    fake_serial.feed(notifications())
+    notification = fake_pg.return_on_notification(address=1, timeout=5)
+    assert notification['address'] == 1
+    assert fake_pg.return_on_notification(finished=True, timeout=5)['finished_notify']
+    assert fake_pg.return_on_notification(timeout=0.1) is None
@@ -0,0 +1,80 @@
+'''
+Tests of virtual devices on pseudo-terminals. No Pulse Gen is needed.
+'''
+import json
+import os
+import subprocess
+import sys
+import pytest
+import ndpulsegen
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='virtual devices need pseudo-terminals')
+
+
+@pytest.fixture
+def find_virtual_devices(monkeypatch):
+    monkeypatch.setenv('NDPULSEGEN_VIRTUAL_DEVICES', '1')
+
+
+def test_registered_while_running():
+    from ndpulsegen.virtual_device import VirtualDevice, list_virtual_ports
+    device = VirtualDevice(serial_number=61616)
+    assert device.port is None
+    with device:
+        assert os.path.exists(device.registry_path)
+        [comport] = [comport for comport in list_virtual_ports() if comport.serial_number == '61616']
+        assert (comport.device, comport.vid, comport.pid) == (device.port, 1027, 24592)
+    assert not os.path.exists(device.registry_path)
+    assert '61616' not in [comport.serial_number for comport in list_virtual_ports()]
+
+def test_stale_entries_are_ignored():
+    from ndpulsegen import virtual_device
+    # A process that has already exited
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True, check=True)
+    path = os.path.join(virtual_device.registry_directory, 'stale.json')
+    os.makedirs(virtual_device.registry_directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'device':'/dev/null', 'vid':1027, 'pid':24592, 'serial_number':'71717', 'process_id':int(process.stdout)}, f)
+    try:
+        assert '71717' not in [comport.serial_number for comport in virtual_device.list_virtual_ports()]
+    finally:
+        os.remove(path)
+
+def test_found_only_when_asked_for(find_virtual_devices, monkeypatch):
+    from ndpulsegen.virtual_device import VirtualDevice
+    with VirtualDevice(serial_number=11111, idle_advance=1.0) as first, VirtualDevice(serial_number=22222, idle_advance=1.0) as second:
+        devices = ndpulsegen.PulseGenerator().get_connected_devices()['validated_devices']
+        found = {device['serial_number']:device['comport'] for device in devices}
+        assert found[11111] == first.port
+        assert found[22222] == second.port
+        pg = ndpulsegen.PulseGenerator()
+        pg.connect(serial_number=22222)
+        try:
+            assert pg.ser.port == second.port
+        finally:
+            pg.disconnect()
+        monkeypatch.delenv('NDPULSEGEN_VIRTUAL_DEVICES')
+        pg = ndpulsegen.PulseGenerator()
+        assert 22222 not in [device['serial_number'] for device in pg.get_connected_devices()['validated_devices']]
+        pg.find_virtual_devices = True
+        assert 22222 in [device['serial_number'] for device in pg.get_connected_devices()['validated_devices']]
+
+def test_run_from_another_process(find_virtual_devices):
+    from ndpulsegen.virtual_device import VirtualDevice
+    code = '''
+import ndpulsegen
+pg = ndpulsegen.PulseGenerator()
+pg.connect(serial_number=81818)
+pg.write_instructions([ndpulsegen.encode_instruction(0, 10, [1]), ndpulsegen.encode_instruction(1, 10, [0])])
+pg.write_device_options(final_ram_address=1, notify_when_run_finished=True, software_run_enable=True)
+pg.write_action(trigger_now=True)
+print(pg.return_on_notification(finished=True, timeout=5)['finished_notify'])
+pg.disconnect()
+'''
+    src_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([src_directory, os.environ.get('PYTHONPATH', '')]))
+    with VirtualDevice(serial_number=81818, idle_advance=1.0) as device:
+        process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=30, env=environment)
+        assert process.returncode == 0, process.stderr
+        assert process.stdout.strip() == 'True'
+        assert device.emulator.durations[:2] == [10, 10]
@@ -0,0 +1,47 @@
+'''
+Tests of delta uploads with write_program, using a stand-in serial port. No Pulse Gen is needed.
+'''
+import ndpulsegen
+from ndpulsegen import transcode
+
+
+def program(durations):
+    return [transcode.encode_instruction(address, duration, [address % 2]) for address, duration in enumerate(durations)]
+
+
+def test_only_changes_are_sent(fake_pg, fake_serial):
+    assert fake_pg.write_program(program([10, 20, 30, 40])) == 4
+    assert fake_pg.write_program(program([10, 20, 30, 40])) == 0
+    del fake_serial.written[:]
+    assert fake_pg.write_program(program([10, 25, 30, 45])) == 2
+    written = transcode.decode_instructions(bytes(fake_serial.written))
+    assert written['address'].tolist() == [1, 3]
+    assert written['duration'].tolist() == [25, 45]
+
+def test_full_upload(fake_pg):
+    fake_pg.write_program(program([10, 20]))
+    assert fake_pg.write_program(program([10, 20]), delta=False) == 2
+    assert fake_pg.write_program(ndpulsegen.InstructionTable.from_bytes(program([10, 20]))) == 0
+
+def test_write_instructions_updates_the_shadow(fake_pg):
+    fake_pg.write_instructions(program([10, 20, 30]))
+    assert fake_pg.write_program(program([10, 20, 31])) == 1
+
+def test_reset_run_invalidates(fake_pg):
+    fake_pg.write_program(program([10, 20]))
+    fake_pg.write_action(reset_run=True)
+    assert fake_pg.write_program(program([10, 20])) == 2
+
+def test_untracked_write_invalidates(fake_pg, fake_serial):
+    fake_pg.write_program(program([10, 20]))
+    # Something that isn't a whole number of instructions
+    fake_pg.write_instructions(program([15])[0] + transcode.encode_echo(b'\x01'))
+    del fake_serial.written[:]
+    assert fake_pg.write_program(program([10, 20])) == 2
+    assert bytes(fake_serial.written) == b''.join(program([10, 20]))
+
+def test_reconnect_invalidates(fake_pg, fake_serial):
+    fake_pg.write_program(program([10, 20]))
+    fake_pg.disconnect()
+    fake_pg.attach_serial(fake_serial)
+    assert fake_pg.write_program(program([10, 20])) == 2